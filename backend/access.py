@@ -0,0 +1,88 @@
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Course, Enrollment
+from cache import TTLCache
+
+# Controle de acesso a cursos e aulas. Cada usuário tem em cache o conjunto
+# compacto dos ids de cursos em que está matriculado: respostas positivas saem
+# do cache sem consulta. Uma resposta negativa é confirmada com uma única
+# consulta indexada (criador do curso ou matrícula pela chave primária), que
+# também corrige o cache se a matrícula foi feita em outro processo.
+
+_entitlements = TTLCache(ttl=300, maxsize=10000)
+
+
+def enrolled_course_ids(user_id):
+    """``frozenset`` dos ids de cursos em que o usuário está matriculado"""
+    course_ids = _entitlements.get(user_id)
+    if course_ids is None:
+        course_ids = frozenset(
+            course_id for (course_id,) in db.session.query(Enrollment.course_id).filter_by(user_id=user_id)
+        )
+        _entitlements.set(user_id, course_ids, ttl=current_app.config.get('ENTITLEMENT_CACHE_TTL', 300))
+    return course_ids
+
+
+def invalidate_entitlements(user_id):
+    _entitlements.delete(user_id)
+
+
+def _confirm_enrollment(user_id, course_id):
+    """Matrícula pela chave primária; se existe, o cache deste processo estava velho"""
+    enrolled = db.session.query(
+        db.exists().where(Enrollment.user_id == user_id, Enrollment.course_id == course_id)
+    ).scalar()
+    if enrolled:
+        # Matrícula feita em outro processo depois que o cache foi montado
+        invalidate_entitlements(user_id)
+    return enrolled
+
+
+def is_enrolled(user_id, course_id):
+    """Matrícula do usuário no curso (positivo do cache, negativo confirmado no banco)"""
+    return course_id in enrolled_course_ids(user_id) or _confirm_enrollment(user_id, course_id)
+
+
+def can_access_course(user, course_id):
+    """Conteúdo do curso: admin, criador do curso ou aluno matriculado"""
+    if user.role == 'admin' or course_id in enrolled_course_ids(user.id):
+        return True
+
+    # Uma consulta para as duas regras restantes
+    row = db.session.query(
+        Course.creator_id == user.id,
+        db.exists().where(Enrollment.user_id == user.id, Enrollment.course_id == course_id)
+    ).filter(Course.id == course_id).first()
+    if row is None:
+        return False
+    is_creator, enrolled = row
+    if enrolled:
+        invalidate_entitlements(user.id)
+    return bool(is_creator or enrolled)
+
+
+def can_read_lesson(user, lesson):
+    """Aulas gratuitas são abertas a qualquer usuário autenticado"""
+    return bool(lesson.is_free) or can_access_course(user, lesson.course_id)
+
+
+# ==================== INVALIDAÇÃO ====================
+
+@event.listens_for(Enrollment, 'after_insert')
+@event.listens_for(Enrollment, 'after_delete')
+def _mark_entitlements_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_entitlements', set()).add(target.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_entitlements(session):
+    for user_id in session.info.pop('changed_entitlements', ()):
+        invalidate_entitlements(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_entitlements(session):
+    session.info.pop('changed_entitlements', None)
@@ -0,0 +1,300 @@
+import atexit
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from models import db, Analytics, AnalyticsRollup, AnalyticsRollupState
+from writes import run_write
+
+
+class AnalyticsBuffer:
+    """Fila limitada de eventos de analytics gravados em lote por uma thread.
+
+    A requisição apenas enfileira o evento; a thread de gravação insere em lote
+    quando junta ``batch_size`` eventos ou passa ``flush_interval`` segundos.
+    Com a fila cheia, espera até ``enqueue_timeout`` (contrapressão) e depois
+    descarta o evento. Eventos podem ser amostrados por tipo (``sample_rates``);
+    a taxa usada fica em ``event_data['sample_rate']`` para que contagens
+    possam ser reescaladas.
+    """
+
+    def __init__(self, app, queue_size=10000, batch_size=500, flush_interval=2.0,
+                 enqueue_timeout=0.01, sample_rates=None, asynchronous=True, rollup_interval=0):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.sample_rates = dict(sample_rates or {})
+        self.asynchronous = asynchronous
+        self.rollup_interval = rollup_interval
+        self._last_rollup = time.monotonic()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._counters = Counter()
+        self._counters_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self._counters[name] += amount
+
+    def log(self, event_type, user_id=None, course_id=None, lesson_id=None, event_data=None):
+        """Registra um evento sem bloquear a requisição. Retorna False se descartado."""
+        rate = self.sample_rates.get(event_type, 1.0)
+        if rate < 1.0:
+            if random.random() >= rate:
+                self._count('sampled_out')
+                return False
+            event_data = dict(event_data or {}, sample_rate=rate)
+
+        row = {
+            'event_type': event_type,
+            'user_id': user_id,
+            'course_id': course_id,
+            'lesson_id': lesson_id,
+            'event_data': event_data,
+            'created_at': datetime.utcnow()
+        }
+
+        if not self.asynchronous:
+            self._write([row], from_queue=False)
+            return True
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('backpressure')
+            try:
+                self._queue.put(row, timeout=self.enqueue_timeout)
+            except queue.Full:
+                self._count('dropped')
+                return False
+        self._count('enqueued')
+        return True
+
+    def _ensure_started(self):
+        # A thread só nasce no primeiro evento (evita threads em comandos do CLI
+        # e em processos mestres que fazem fork dos workers)
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='analytics-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._write(batch)
+            if self.rollup_interval and time.monotonic() - self._last_rollup >= self.rollup_interval:
+                self._last_rollup = time.monotonic()
+                self._rollup()
+
+    def _rollup(self):
+        with self.app.app_context():
+            try:
+                self._count('rolled_up', rollup_analytics())
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"Erro ao agregar analytics: {str(e)}")
+
+    def _collect_batch(self):
+        """Espera o primeiro evento e junta outros até encher o lote ou vencer o prazo"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch, from_queue=True):
+        with self._write_lock, self.app.app_context():
+            try:
+                run_write(lambda session: session.execute(db.insert(Analytics), batch))
+                self._count('flushed', len(batch))
+                self._count('batches')
+            except Exception as e:
+                db.session.rollback()
+                self._count('failed', len(batch))
+                self.app.logger.error(f"Erro ao gravar lote de analytics: {str(e)}")
+            finally:
+                if from_queue:
+                    for _ in batch:
+                        self._queue.task_done()
+
+    def flush(self, timeout=5.0):
+        """Grava tudo o que está na fila e espera o lote em andamento da thread"""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            self._write(batch)
+
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(remaining)
+
+    def shutdown(self, timeout=5.0):
+        """Para a thread de gravação e grava os eventos pendentes"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._counters_lock:
+            data = dict(self._counters)
+        data['queue_depth'] = self._queue.qsize()
+        data['queue_capacity'] = self._queue.maxsize
+        return data
+
+
+def init_analytics(app):
+    """Cria o buffer de analytics da aplicação a partir da configuração"""
+    buffer = AnalyticsBuffer(
+        app,
+        queue_size=app.config.get('ANALYTICS_QUEUE_SIZE', 10000),
+        batch_size=app.config.get('ANALYTICS_BATCH_SIZE', 500),
+        flush_interval=app.config.get('ANALYTICS_FLUSH_INTERVAL', 2.0),
+        enqueue_timeout=app.config.get('ANALYTICS_ENQUEUE_TIMEOUT', 0.01),
+        sample_rates=app.config.get('ANALYTICS_SAMPLE_RATES'),
+        asynchronous=app.config.get('ANALYTICS_ASYNC', True),
+        rollup_interval=app.config.get('ANALYTICS_ROLLUP_INTERVAL', 0)
+    )
+    app.extensions['analytics'] = buffer
+    atexit.register(buffer.shutdown)
+    return buffer
+
+
+def log_event(event_type, user_id=None, course_id=None, lesson_id=None, event_data=None):
+    """Registra um evento de analytics da requisição atual (nunca levanta exceção)"""
+    try:
+        return current_app.extensions['analytics'].log(
+            event_type, user_id=user_id, course_id=course_id,
+            lesson_id=lesson_id, event_data=event_data
+        )
+    except Exception as e:
+        current_app.logger.error(f"Erro ao registrar analytics: {str(e)}")
+        return False
+
+
+# ==================== AGREGAÇÃO (ROLLUPS) ====================
+
+ROLLUP_JOB = 'analytics_rollups'
+
+
+def _event_weight(event_data):
+    """Peso do evento: eventos amostrados contam como 1 / taxa de amostragem"""
+    if isinstance(event_data, dict) and event_data.get('sample_rate'):
+        return 1.0 / float(event_data['sample_rate'])
+    return 1.0
+
+
+def _increment_rollup(bucket, bucket_start, event_type, course_id, lesson_id, amount):
+    key = dict(bucket=bucket, bucket_start=bucket_start, event_type=event_type,
+               course_id=course_id, lesson_id=lesson_id)
+    updated = AnalyticsRollup.query.filter_by(**key).update(
+        {AnalyticsRollup.count: AnalyticsRollup.count + amount}, synchronize_session=False
+    )
+    if not updated:
+        db.session.add(AnalyticsRollup(count=amount, **key))
+
+
+def rollup_analytics(chunk_size=10000, lag=None):
+    """Agrega nos rollups apenas os eventos acima da marca d'água.
+
+    A marca d'água é o par (``created_at``, ``id``) do último evento agregado,
+    e só entram eventos criados há mais de ``lag`` segundos
+    (``ANALYTICS_ROLLUP_LAG``): ids não são confirmados em ordem quando dois
+    lotes gravam ao mesmo tempo, mas um evento dessa idade já foi confirmado.
+    Cada lote de até ``chunk_size`` eventos é somado e gravado na mesma
+    transação que avança a marca d'água; a atualização da marca é condicional
+    ao valor lido, então execuções concorrentes não contam eventos em dobro.
+    Retorna quantos eventos foram processados.
+    """
+    if lag is None:
+        lag = current_app.config.get('ANALYTICS_ROLLUP_LAG', 60)
+    cutoff = datetime.utcnow() - timedelta(seconds=lag)
+
+    processed = 0
+    while True:
+        state = db.session.get(AnalyticsRollupState, ROLLUP_JOB)
+        if state is None:
+            state = AnalyticsRollupState(name=ROLLUP_JOB, last_event_id=0)
+            db.session.add(state)
+            db.session.flush()
+        last_event_id = state.last_event_id
+        last_event_at = state.last_event_at
+        if last_event_at is None and last_event_id:
+            # Marca gravada por versões que só guardavam o id
+            last_event_at = db.session.query(db.func.max(Analytics.created_at)).filter(
+                Analytics.id <= last_event_id
+            ).scalar()
+
+        query = db.select(Analytics.id, Analytics.event_type, Analytics.course_id, Analytics.lesson_id,
+                          Analytics.event_data, Analytics.created_at).where(Analytics.created_at <= cutoff)
+        if last_event_at is not None:
+            query = query.where(db.or_(
+                Analytics.created_at > last_event_at,
+                db.and_(Analytics.created_at == last_event_at, Analytics.id > last_event_id)
+            ))
+        events = db.session.execute(
+            query.order_by(Analytics.created_at, Analytics.id).limit(chunk_size)
+        ).all()
+        if not events:
+            db.session.commit()
+            return processed
+
+        totals = Counter()
+        for event in events:
+            weight = _event_weight(event.event_data)
+            for bucket in AnalyticsRollup.BUCKETS:
+                totals[(bucket, AnalyticsRollup.truncate(event.created_at, bucket), event.event_type,
+                        event.course_id or 0, event.lesson_id or 0)] += weight
+
+        for key, amount in totals.items():
+            _increment_rollup(*key, amount)
+
+        advanced = AnalyticsRollupState.query.filter_by(
+            name=ROLLUP_JOB, last_event_id=state.last_event_id, last_event_at=state.last_event_at
+        ).update({
+            AnalyticsRollupState.last_event_id: events[-1].id,
+            AnalyticsRollupState.last_event_at: events[-1].created_at,
+            AnalyticsRollupState.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        if advanced != 1:
+            # Outro processo agregou este lote primeiro
+            db.session.rollback()
+            return processed
+
+        db.session.commit()
+        processed += len(events)
+        if len(events) < chunk_size:
+            return processed
@@ -1,15 +1,30 @@
-from flask import request, jsonify, send_file, current_app as app
-from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import request, jsonify, current_app as app
+from flask_jwt_extended import jwt_required, create_access_token, current_user
 from werkzeug.utils import secure_filename
-from sqlalchemy import func, desc, or_
+from sqlalchemy import func, desc
 import os
 from datetime import datetime
 
 # Importações que serão disponíveis após app.py executar
 def get_db_and_models():
-    from backend.models import db, User, Course, Lesson, Comment, Rating, StudentProgress, Analytics, course_enrollments
-    return db, User, Course, Lesson, Comment, Rating, StudentProgress, Analytics, course_enrollments
+    from backend.models import db, User, Course, CourseStats, Lesson, Comment, Rating, StudentProgress, Analytics, Enrollment, course_enrollments
+    return db, User, Course, CourseStats, Lesson, Comment, Rating, StudentProgress, Analytics, Enrollment, course_enrollments
+
+from backend.serializers import serialize, serialize_one
+from backend.search import apply_search, split_search_rows
+from backend.pagination import paginate_catalog, published_filter, InvalidCursor, CATALOG_ARGS
+from backend.threads import thread_page, thread_fields
+from backend.access import is_enrolled, can_read_lesson
+from backend.analytics import log_event
+from backend.passwords import hash_password, verify_password, HasherBusy
+from backend.writes import run_write, WriteQueueBusy
+from backend.progress import BatchItemError, parse_watch_time
+from backend.media import send_upload
+from backend.storage import store_stream
+from backend.images import enqueue_variants, variants_for_url
+from backend.identity import load_user
+from backend.conditional import course_version, lesson_version, user_version, is_not_modified, not_modified_response, with_validators
+from backend.cache import CATALOG_TAG, catalog_sort_tag, course_tag, creator_tag, cache_key, get_or_build, invalidate, json_body, json_response
 
 # Utilitários
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mov', 'avi', 'doc', 'docx', 'ppt', 'pptx'}
@@ -18,19 +33,9 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def log_analytics(event_type, user_id=None, course_id=None, lesson_id=None, metadata=None):
-    """Log analytics events"""
-    try:
-        analytics = Analytics(
-            event_type=event_type,
-            user_id=user_id,
-            course_id=course_id,
-            lesson_id=lesson_id,
-            metadata=metadata
-        )
-        db.session.add(analytics)
-        db.session.commit()
-    except Exception as e:
-        app.logger.error(f"Erro ao registrar analytics: {str(e)}")
+    """Log analytics events (enfileirados e gravados em lote, fora da requisição)"""
+    log_event(event_type, user_id=user_id, course_id=course_id,
+              lesson_id=lesson_id, event_data=metadata)
 
 # ==================== AUTENTICAÇÃO ====================
 
@@ -55,7 +60,7 @@ def register():
         user = User(
             name=data['name'],
             email=data['email'],
-            password=generate_password_hash(data['password']),
+            password=hash_password(data['password']),
             role=data.get('role', 'student'),
             bio=data.get('bio', '')
         )
@@ -75,6 +80,8 @@ def register():
             'user': user.to_dict(include_email=True)
         }), 201
         
+    except HasherBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -88,12 +95,16 @@ def login():
         
         user = User.query.filter_by(email=data['email']).first()
         
-        if not user or not user.check_password(data['password']):
+        if not user or not verify_password(user, data['password']):
             return jsonify({'error': 'Credenciais inválidas'}), 401
         
         if not user.is_active:
             return jsonify({'error': 'Conta desativada'}), 401
         
+        # Grava o hash refeito com os parâmetros atuais, se foi o caso
+        if user in db.session.dirty:
+            db.session.commit()
+        
         # Criar token JWT
         token = create_access_token(identity=user.uuid)
         
@@ -106,6 +117,8 @@ def login():
             'user': user.to_dict(include_email=True)
         }), 200
         
+    except HasherBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -113,13 +126,13 @@ def login():
 @jwt_required()
 def get_profile():
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = load_user(current_user)
         
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        version = user_version(user)
+        if is_not_modified(version):
+            return not_modified_response(version, private=True)
         
-        return jsonify({'user': user.to_dict(include_email=True)}), 200
+        return with_validators(jsonify({'user': user.to_dict(include_email=True)}), version, private=True)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -128,11 +141,7 @@ def get_profile():
 @jwt_required()
 def update_profile():
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = load_user(current_user)
         
         data = request.get_json()
         
@@ -143,10 +152,14 @@ def update_profile():
             user.bio = data['bio']
         if 'avatar_url' in data:
             user.avatar_url = data['avatar_url']
+            user.avatar_variants = variants_for_url(user.avatar_url)
         
         user.updated_at = datetime.utcnow()
         db.session.commit()
         
+        # Nome e avatar aparecem nas respostas em cache dos cursos do usuário
+        invalidate(creator_tag(user.id))
+        
         return jsonify({
             'message': 'Perfil atualizado com sucesso',
             'user': user.to_dict(include_email=True)
@@ -160,77 +173,62 @@ def update_profile():
 @app.route('/api/courses', methods=['GET'])
 def get_courses():
     try:
-        # Parâmetros de query
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 50)  # máximo 50 por página
-        category = request.args.get('category')
-        level = request.args.get('level')
-        search = request.args.get('search')
-        featured = request.args.get('featured', type=bool)
-        creator_uuid = request.args.get('creator')
-        
-        # Query base
-        query = Course.query.filter_by(is_published=True)
-        
-        # Filtros
-        if category:
-            query = query.filter_by(category=category)
-        if level:
-            query = query.filter_by(level=level)
-        if search:
-            query = query.filter(
-                or_(
-                    Course.title.contains(search),
-                    Course.description.contains(search)
-                )
-            )
-        if featured:
-            query = query.filter_by(is_featured=True)
-        if creator_uuid:
-            creator = User.query.filter_by(uuid=creator_uuid).first()
-            if creator:
-                query = query.filter_by(creator_id=creator.id)
-        
-        # Ordenação
-        sort_by = request.args.get('sort', 'recent')
-        if sort_by == 'popular':
-            # Ordenar por número de estudantes
-            query = query.outerjoin(course_enrollments).group_by(Course.id).order_by(
-                desc(func.count(course_enrollments.c.user_id))
-            )
-        elif sort_by == 'rating':
-            # Ordenar por avaliação média
-            query = query.outerjoin(Rating).group_by(Course.id).order_by(
-                desc(func.avg(Rating.value))
-            )
-        else:  # recent (padrão)
-            query = query.order_by(desc(Course.created_at))
-        
-        # Paginação
-        courses = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        def build():
+            # Parâmetros de query
+            category = request.args.get('category')
+            level = request.args.get('level')
+            search = request.args.get('search')
+            featured = request.args.get('featured', type=bool)
+            creator_uuid = request.args.get('creator')
+            
+            # Query base
+            query = Course.query.filter(published_filter(request.args.get('sort')))
+            
+            # Filtros
+            if category:
+                query = query.filter_by(category=category)
+            if level:
+                query = query.filter_by(level=level)
+            rank = None
+            if search:
+                query, rank = apply_search(query, search)
+            if featured:
+                query = query.filter_by(is_featured=True)
+            if creator_uuid:
+                creator = User.query.filter_by(uuid=creator_uuid).first()
+                if creator:
+                    query = query.filter_by(creator_id=creator.id)
+            
+            # Ordenação e paginação (por cursor com ?cursor=, ou por página)
+            items, pagination = paginate_catalog(query, request.args, rank)
+            
+            if rank is not None:
+                items, snippets = split_search_rows(items)
+                courses_data = serialize(items, include_stats=True)
+                for course_dict, snippet in zip(courses_data, snippets):
+                    course_dict['search_snippet'] = snippet
+            else:
+                courses_data = serialize(items, include_stats=True)
+            
+            body = json_body({
+                'courses': courses_data,
+                'pagination': pagination
+            })
+            return body, ([course_tag(course.uuid) for course in items] + [creator_tag(course.creator_id) for course in items]
+                          + [catalog_sort_tag(pagination['sort'])])
+        
+        body = get_or_build(cache_key('courses', request.args, CATALOG_ARGS), build, tags=[CATALOG_TAG])
         
         # Log analytics
         log_analytics('courses_viewed', metadata={
-            'page': page, 
+            'page': request.args.get('page', 1, type=int), 
             'filters': request.args.to_dict()
         })
         
-        return jsonify({
-            'courses': [course.to_dict(include_stats=True) for course in courses.items],
-            'pagination': {
-                'page': page,
-                'pages': courses.pages,
-                'per_page': per_page,
-                'total': courses.total,
-                'has_next': courses.has_next,
-                'has_prev': courses.has_prev
-            }
-        }), 200
+        return json_response(body)
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app.logger.error(f"Erro ao buscar cursos: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -238,15 +236,31 @@ def get_courses():
 @app.route('/api/courses/<course_uuid>', methods=['GET'])
 def get_course(course_uuid):
     try:
-        course = Course.query.filter_by(uuid=course_uuid, is_published=True).first()
+        version = course_version(course_uuid, published_only=True)
         
-        if not course:
+        if not version:
             return jsonify({'error': 'Curso não encontrado'}), 404
         
         # Log analytics
-        log_analytics('course_viewed', course_id=course.id)
+        log_analytics('course_viewed', course_id=version.id)
         
-        return jsonify({'course': course.to_dict(include_lessons=True, include_stats=True)}), 200
+        # Cliente já tem a versão atual: responde 304 sem serializar
+        if is_not_modified(version):
+            return not_modified_response(version)
+        
+        def build():
+            course = Course.query.filter_by(uuid=course_uuid, is_published=True).first()
+            if not course:
+                return None
+            return json_body({'course': serialize_one(course, include_lessons=True, include_stats=True)}), [creator_tag(course.creator_id)]
+        
+        # A ETag entra na chave: o corpo em cache é sempre o da versão validada
+        body = get_or_build(cache_key(f'course/{course_uuid}/{version.etag}'), build, tags=[course_tag(course_uuid)])
+        
+        if body is None:
+            return jsonify({'error': 'Curso não encontrado'}), 404
+        
+        return with_validators(json_response(body), version)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -255,11 +269,7 @@ def get_course(course_uuid):
 @jwt_required()
 def create_course():
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         if user.role not in ['teacher', 'admin']:
             return jsonify({'error': 'Sem permissão para criar cursos'}), 403
@@ -282,6 +292,9 @@ def create_course():
         db.session.add(course)
         db.session.commit()
         
+        if course.is_published:
+            invalidate(CATALOG_TAG)
+        
         # Log analytics
         log_analytics('course_created', user_id=user.id, course_id=course.id)
         
@@ -297,11 +310,7 @@ def create_course():
 @jwt_required()
 def update_course(course_uuid):
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         
@@ -327,9 +336,11 @@ def update_course(course_uuid):
             course.price = data['price']
         if 'thumbnail_url' in data:
             course.thumbnail_url = data['thumbnail_url']
+            course.thumbnail_variants = variants_for_url(course.thumbnail_url)
         
         course.updated_at = datetime.utcnow()
         db.session.commit()
+        invalidate(CATALOG_TAG, course_tag(course.uuid))
         
         return jsonify({
             'message': 'Curso atualizado com sucesso',
@@ -343,8 +354,7 @@ def update_course(course_uuid):
 @jwt_required()
 def publish_course(course_uuid):
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         
@@ -358,6 +368,7 @@ def publish_course(course_uuid):
         course.is_published = True
         course.published_at = datetime.utcnow()
         db.session.commit()
+        invalidate(CATALOG_TAG, course_tag(course.uuid))
         
         # Log analytics
         log_analytics('course_published', user_id=user.id, course_id=course.id)
@@ -371,11 +382,7 @@ def publish_course(course_uuid):
 @jwt_required()
 def enroll_course(course_uuid):
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid, is_published=True).first()
         
@@ -383,18 +390,21 @@ def enroll_course(course_uuid):
             return jsonify({'error': 'Curso não encontrado'}), 404
         
         # Verificar se já está matriculado
-        if course in user.enrolled_courses:
+        if is_enrolled(user.id, course.id):
             return jsonify({'error': 'Usuário já matriculado neste curso'}), 409
         
         # Matricular usuário
-        user.enrolled_courses.append(course)
-        db.session.commit()
+        enrollment = Enrollment(user_id=user.id, course_id=course.id)
+        run_write(lambda session: session.add(enrollment))
+        invalidate(course_tag(course.uuid), catalog_sort_tag('popular'))
         
         # Log analytics
         log_analytics('course_enrolled', user_id=user.id, course_id=course.id)
         
         return jsonify({'message': 'Matrícula realizada com sucesso'}), 200
         
+    except WriteQueueBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -403,17 +413,22 @@ def enroll_course(course_uuid):
 @app.route('/api/courses/<course_uuid>/lessons', methods=['GET'])
 def get_lessons(course_uuid):
     try:
-        course = Course.query.filter_by(uuid=course_uuid).first()
+        version = course_version(course_uuid, kind='lessons')
         
-        if not course:
+        if not version:
             return jsonify({'error': 'Curso não encontrado'}), 404
         
-        # Ordenar por order_index
-        lessons = Lesson.query.filter_by(course_id=course.id).order_by(Lesson.order_index).all()
+        if is_not_modified(version):
+            return not_modified_response(version)
         
-        return jsonify({
-            'lessons': [lesson.to_dict() for lesson in lessons]
-        }), 200
+        def build():
+            # Ordenar por order_index
+            lessons = Lesson.query.filter_by(course_id=version.id).order_by(Lesson.order_index).all()
+            return json_body({'lessons': serialize(lessons)}), []
+        
+        body = get_or_build(cache_key(f'course/{course_uuid}/lessons/{version.etag}'), build, tags=[course_tag(course_uuid)])
+        
+        return with_validators(json_response(body), version)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -422,8 +437,7 @@ def get_lessons(course_uuid):
 @jwt_required()
 def create_lesson(course_uuid):
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         
@@ -455,6 +469,7 @@ def create_lesson(course_uuid):
         
         db.session.add(lesson)
         db.session.commit()
+        invalidate(course_tag(course.uuid))
         
         # Log analytics
         log_analytics('lesson_created', user_id=user.id, course_id=course.id, lesson_id=lesson.id)
@@ -471,8 +486,7 @@ def create_lesson(course_uuid):
 @jwt_required()
 def get_lesson(lesson_uuid):
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         lesson = Lesson.query.filter_by(uuid=lesson_uuid).first()
         
@@ -481,15 +495,19 @@ def get_lesson(lesson_uuid):
         
         course = lesson.course
         
-        # Verificar se o usuário tem acesso
-        if not lesson.is_free:
-            if course not in user.enrolled_courses and course.creator_id != user.id and user.role != 'admin':
-                return jsonify({'error': 'Acesso negado. Matricule-se no curso'}), 403
+        # Verificar se o usuário tem acesso (aula gratuita, admin, criador ou matriculado)
+        if not can_read_lesson(user, lesson):
+            return jsonify({'error': 'Acesso negado. Matricule-se no curso'}), 403
         
         # Log analytics
         log_analytics('lesson_viewed', user_id=user.id, course_id=course.id, lesson_id=lesson.id)
         
-        return jsonify({'lesson': lesson.to_dict()}), 200
+        # A verificação de acesso vem antes: o 304 não dispensa a autorização
+        version = lesson_version(lesson)
+        if is_not_modified(version):
+            return not_modified_response(version, private=True)
+        
+        return with_validators(jsonify({'lesson': lesson.to_dict()}), version, private=True)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -500,8 +518,7 @@ def get_lesson(lesson_uuid):
 @jwt_required()
 def complete_lesson(lesson_uuid):
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         lesson = Lesson.query.filter_by(uuid=lesson_uuid).first()
         
@@ -522,12 +539,24 @@ def complete_lesson(lesson_uuid):
             db.session.add(progress)
         
         data = request.get_json() or {}
+        if 'watch_time' in data:
+            try:
+                parse_watch_time(data['watch_time'])
+            except BatchItemError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        completed_delta = 0 if progress.is_completed else 1
+        previous_watch_time = progress.watch_time or 0
         
         progress.is_completed = True
         progress.completed_at = datetime.utcnow()
         progress.watch_time = data.get('watch_time', progress.watch_time)
         progress.updated_at = datetime.utcnow()
         
+        # Manter o progresso consolidado da matrícula
+        Enrollment.apply_progress(user.id, lesson.course_id, completed_delta,
+                                  (progress.watch_time or 0) - previous_watch_time)
+        
         db.session.commit()
         
         # Log analytics
@@ -546,8 +575,7 @@ def complete_lesson(lesson_uuid):
 @jwt_required()
 def get_course_progress(course_uuid):
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         
@@ -570,7 +598,7 @@ def get_course_progress(course_uuid):
             'total_lessons': total_lessons,
             'completed_lessons': completed_lessons,
             'progress_percentage': round(progress_percentage, 1),
-            'lesson_progress': [p.to_dict() for p in progress_records]
+            'lesson_progress': serialize(progress_records)
         }), 200
         
     except Exception as e:
@@ -586,14 +614,22 @@ def get_comments(course_uuid):
         if not course:
             return jsonify({'error': 'Curso não encontrado'}), 404
         
-        # Buscar comentários principais (sem parent_id)
-        comments = Comment.query.filter_by(
-            course_id=course.id, 
-            parent_id=None
-        ).order_by(desc(Comment.created_at)).all()
+        per_page = max(min(request.args.get('per_page', 20, type=int), 50), 1)
+        replies = max(min(request.args.get('replies', 3, type=int), 20), 0)
+        
+        # Conversas paginadas por cursor, com as primeiras respostas de cada uma
+        try:
+            threads, next_cursor = thread_page(course.id, request.args.get('cursor'), per_page, replies)
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'comments': [comment.to_dict() for comment in comments]
+            'comments': threads,
+            'pagination': {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_next': next_cursor is not None
+            }
         }), 200
         
     except Exception as e:
@@ -603,8 +639,7 @@ def get_comments(course_uuid):
 @jwt_required()
 def create_comment(course_uuid):
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         
@@ -624,18 +659,23 @@ def create_comment(course_uuid):
         
         # Se é uma resposta a outro comentário
         if data.get('parent_uuid'):
-            parent = Comment.query.filter_by(uuid=data['parent_uuid']).first()
+            parent = Comment.query.filter_by(uuid=data['parent_uuid'], course_id=course.id).first()
             if parent:
                 comment.parent_id = parent.id
+                comment.root_id, comment.depth = thread_fields(parent)
         
-        db.session.add(comment)
-        db.session.commit()
+        def write(session):
+            session.add(comment)
+            session.flush()
+            return comment.to_dict(include_replies=False)
         
         return jsonify({
             'message': 'Comentário criado com sucesso',
-            'comment': comment.to_dict(include_replies=False)
+            'comment': run_write(write)
         }), 201
         
+    except WriteQueueBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -645,8 +685,7 @@ def create_comment(course_uuid):
 @jwt_required()
 def rate_course(course_uuid):
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         
@@ -655,33 +694,41 @@ def rate_course(course_uuid):
         
         data = request.get_json()
         
-        if not data.get('value') or data['value'] not in [1, 2, 3, 4, 5]:
+        value = data.get('value')
+        if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 5:
             return jsonify({'error': 'Avaliação deve ser entre 1 e 5 estrelas'}), 400
         
-        # Verificar se já avaliou
-        existing_rating = Rating.query.filter_by(
-            user_id=user.id, 
-            course_id=course.id
-        ).first()
+        # A transação pode rodar na thread da fila de escrita: só valores simples
+        user_id, course_id = user.id, course.id
         
-        if existing_rating:
-            # Atualizar avaliação existente
-            existing_rating.value = data['value']
-            existing_rating.comment = data.get('comment', '')
-        else:
-            # Criar nova avaliação
-            rating = Rating(
-                value=data['value'],
-                comment=data.get('comment', ''),
-                user_id=user.id,
-                course_id=course.id
-            )
-            db.session.add(rating)
+        def write(session):
+            # Verificar se já avaliou
+            existing_rating = session.query(Rating).filter_by(
+                user_id=user_id, 
+                course_id=course_id
+            ).first()
+            
+            if existing_rating:
+                # Atualizar avaliação existente
+                existing_rating.value = data['value']
+                existing_rating.comment = data.get('comment', '')
+            else:
+                # Criar nova avaliação
+                rating = Rating(
+                    value=data['value'],
+                    comment=data.get('comment', ''),
+                    user_id=user_id,
+                    course_id=course_id
+                )
+                session.add(rating)
         
-        db.session.commit()
+        run_write(write)
+        invalidate(course_tag(course.uuid), catalog_sort_tag('rating'))
         
         return jsonify({'message': 'Avaliação salva com sucesso'}), 200
         
+    except WriteQueueBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -691,8 +738,7 @@ def rate_course(course_uuid):
 @jwt_required()
 def analytics_dashboard():
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         if user.role not in ['teacher', 'admin']:
             return jsonify({'error': 'Sem permissão para acessar analytics'}), 403
@@ -705,22 +751,15 @@ def analytics_dashboard():
         
         course_ids = [c.id for c in courses]
         
-        # Estatísticas básicas
-        total_students = db.session.query(course_enrollments).filter(
-            course_enrollments.c.course_id.in_(course_ids)
-        ).count()
+        # Estatísticas básicas (somadas a partir de course_stats)
+        total_students, total_lessons, total_ratings, rating_sum = db.session.query(
+            func.coalesce(func.sum(CourseStats.student_count), 0),
+            func.coalesce(func.sum(CourseStats.lesson_count), 0),
+            func.coalesce(func.sum(CourseStats.rating_count), 0),
+            func.coalesce(func.sum(CourseStats.rating_sum), 0)
+        ).filter(CourseStats.course_id.in_(course_ids)).one()
         
-        total_lessons = Lesson.query.filter(
-            Lesson.course_id.in_(course_ids)
-        ).count()
-        
-        total_ratings = Rating.query.filter(
-            Rating.course_id.in_(course_ids)
-        ).count()
-        
-        avg_rating = db.session.query(func.avg(Rating.value)).filter(
-            Rating.course_id.in_(course_ids)
-        ).scalar() or 0
+        avg_rating = (rating_sum / total_ratings) if total_ratings else 0
         
         return jsonify({
             'summary': {
@@ -730,7 +769,7 @@ def analytics_dashboard():
                 'total_ratings': total_ratings,
                 'average_rating': round(float(avg_rating), 1)
             },
-            'courses': [course.to_dict(include_stats=True) for course in courses]
+            'courses': serialize(courses, include_stats=True)
         }), 200
         
     except Exception as e:
@@ -752,28 +791,17 @@ def upload_file():
             return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            # Adicionar timestamp para evitar conflitos
-            name, ext = os.path.splitext(filename)
-            filename = f"{name}_{int(datetime.now().timestamp())}{ext}"
-            
-            # Determinar subdiretório baseado no tipo
-            subdir = {
-                'video': 'videos',
-                'avatar': 'avatars',
-                'material': 'materials'
-            }.get(file_type, 'materials')
-            
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], subdir, filename)
-            file.save(filepath)
-            
-            # URL relativa para o arquivo
-            file_url = f"/uploads/{subdir}/{filename}"
+            # Armazenamento por conteúdo: o mesmo arquivo enviado de novo não ocupa espaço
+            if file_type not in ('video', 'avatar', 'material'):
+                file_type = 'material'
+            stored = store_stream(file.stream, file.filename, file_type=file_type, user_id=current_user.id)
+            enqueue_variants(stored)
             
             return jsonify({
                 'message': 'Arquivo enviado com sucesso',
-                'file_url': file_url,
-                'filename': filename
+                'file_url': stored.url,
+                'filename': stored.filename,
+                'file': stored.to_dict()
             }), 200
         
         return jsonify({'error': 'Tipo de arquivo não permitido'}), 400
@@ -786,9 +814,11 @@ def upload_file():
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     try:
-        return send_file(
-            os.path.join(app.config['UPLOAD_FOLDER'], filename),
-            as_attachment=False
-        )
+        response = send_upload(filename)
+        
+        if response is None:
+            return jsonify({'error': 'Arquivo não encontrado'}), 404
+        
+        return response
     except Exception as e:
         return jsonify({'error': 'Arquivo não encontrado'}), 404
@@ -3,7 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from flask_migrate import Migrate
-from werkzeug.security import generate_password_hash
+import multiprocessing
 import os
 import logging
 from config import config
@@ -20,11 +20,42 @@ def create_app(config_name='default'):
     
     # Extensões
     from models import db
+    from database import configure_engine, init_engine
+    configure_engine(app)
     db.init_app(app)
+    init_engine(app)
+    
+    from instrumentation import init_sql_instrumentation
+    init_sql_instrumentation(app)
+    
+    from routing import init_read_routing
+    init_read_routing(app)
+    
+    from writes import init_write_coordinator
+    init_write_coordinator(app)
+    
+    from analytics import init_analytics
+    init_analytics(app)
+    
+    from progress import init_progress_buffer
+    init_progress_buffer(app)
+    
+    from cache import init_response_cache
+    init_response_cache(app)
     
     jwt = JWTManager(app)
+    from identity import init_identity
+    init_identity(jwt)
+    
+    from passwords import init_password_hasher
+    init_password_hasher(app)
+    
+    from images import init_image_variants
+    init_image_variants(app)
     migrate = Migrate(app, db)
-    CORS(app, origins=["http://localhost:3000", "http://localhost:8080", "http://127.0.0.1:5500"])
+    # O front-end ecoa X-Read-Primary-Until para ler do banco principal logo após escrever
+    CORS(app, origins=["http://localhost:3000", "http://localhost:8080", "http://127.0.0.1:5500"],
+         expose_headers=['X-Read-Primary-Until'])
     
     # Criar diretórios de uploads se não existirem
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -38,12 +69,18 @@ def create_app(config_name='default'):
     from routes.material import uploads_bp
     from routes.aluno import students_bp
     from routes.meus_cursos import my_courses_bp
+    from routes.analytics import analytics_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(courses_bp)
     app.register_blueprint(uploads_bp)
     app.register_blueprint(students_bp)
     app.register_blueprint(my_courses_bp)
+    app.register_blueprint(analytics_bp)
+    
+    # Comandos de manutenção (flask rebuild-progress, ...)
+    from commands import register_commands
+    register_commands(app)
     
     # Rota principal
     @app.route('/')
@@ -57,17 +94,26 @@ def create_app(config_name='default'):
                 'courses': '/api/courses',
                 'students': '/api/students',
                 'my_courses': '/api/my-courses',
-                'upload': '/api/upload'
+                'upload': '/api/upload',
+                'analytics': '/api/analytics'
             }
         })
     
     # Inicializar dados padrão
     def create_default_data():
         """Criar dados padrão da aplicação"""
-        from models import User, Course, Lesson
+        from models import User, Course, CourseStats, Lesson
+        from schema import upgrade_schema
+        from search import ensure_search_index
+        from threads import backfill_threads
+        from passwords import hash_password
         
         with app.app_context():
             db.create_all()
+            upgrade_schema()
+            backfill_threads()
+            CourseStats.backfill()
+            ensure_search_index()
             
             # Criar usuário admin padrão se não existir
             admin = User.query.filter_by(email='admin@cursohub.com').first()
@@ -75,7 +121,7 @@ def create_app(config_name='default'):
                 admin = User(
                     name='Administrador',
                     email='admin@cursohub.com',
-                    password=generate_password_hash('admin123'),
+                    password=hash_password('admin123'),
                     role='admin'
                 )
                 db.session.add(admin)
@@ -86,7 +132,7 @@ def create_app(config_name='default'):
                 professor = User(
                     name='Professor Demonstração',
                     email='professor@cursohub.com',
-                    password=generate_password_hash('123456'),
+                    password=hash_password('123456'),
                     role='teacher'
                 )
                 db.session.add(professor)
@@ -97,7 +143,7 @@ def create_app(config_name='default'):
                 aluno = User(
                     name='Aluno Demonstração',
                     email='aluno@cursohub.com',
-                    password=generate_password_hash('123456'),
+                    password=hash_password('123456'),
                     role='student'
                 )
                 db.session.add(aluno)
@@ -150,7 +196,9 @@ def create_app(config_name='default'):
     return app
 
 # Para desenvolvimento direto
-app = create_app('development')
+# (não nos processos do pool de imagens, que reimportam o módulo principal)
+if multiprocessing.current_process().name == 'MainProcess':
+    app = create_app('development')
 
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5000, debug=True)
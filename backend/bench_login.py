@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark de vazão de login (POST /api/auth/login)
+
+Simula logins simultâneos em um banco temporário e compara o hashing na
+própria thread da requisição (workers=0) com o pool limitado de hashing.
+
+Uso: python bench_login.py --concurrency 32 --logins 256 --workers 0 2 4
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_app(database_path):
+    """Importa a aplicação apontando para um banco temporário"""
+    os.chdir(BASE_DIR)
+    sys.path.insert(0, BASE_DIR)
+    import config
+    config.Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + database_path
+    from app import app
+    return app
+
+
+def create_users(app, count, method):
+    from models import db, User
+    from werkzeug.security import generate_password_hash
+    password_hash = generate_password_hash('senha-benchmark', method)
+    with app.app_context():
+        db.session.execute(db.delete(User).where(User.email.like('bench-%')))
+        db.session.add_all([
+            User(name=f'Bench {i}', email=f'bench-{i}@cursohub.com', password=password_hash, role='student')
+            for i in range(count)
+        ])
+        db.session.commit()
+
+
+def run_scenario(app, workers, concurrency, logins, max_pending, method):
+    from passwords import PasswordHasher
+    previous = app.extensions['password_hasher']
+    app.extensions['password_hasher'] = PasswordHasher(method=method, workers=workers, max_pending=max_pending)
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(logins))
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            started = time.perf_counter()
+            response = client.post('/api/auth/login', json={
+                'email': f'bench-{index % concurrency}@cursohub.com', 'password': 'senha-benchmark'
+            })
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status_code < 300:
+                    latencies.append(elapsed)  # recusas rápidas distorceriam a latência
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - started
+
+    app.extensions['password_hasher'].shutdown()
+    app.extensions['password_hasher'] = previous
+
+    # Vazão conta só os logins aceitos; 503 (pool cheio) e 429 são recusas
+    latencies.sort()
+    rejected = statuses.get(503, 0) + statuses.get(429, 0)
+    return {
+        'workers': workers,
+        'throughput': len(latencies) / total,
+        'rejected': rejected / logins,
+        'p50': statistics.median(latencies) * 1000 if latencies else 0,
+        'p95': latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000 if latencies else 0,
+        'statuses': statuses
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de vazão de login')
+    parser.add_argument('--concurrency', type=int, default=32, help='requisições simultâneas')
+    parser.add_argument('--logins', type=int, default=256, help='total de logins por cenário')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4], help='tamanhos do pool (0 = sem pool)')
+    parser.add_argument('--max-pending', type=int, default=64, help='limite da fila do pool')
+    parser.add_argument('--method', default='pbkdf2:sha256:600000', help='parâmetros do hash')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = build_app(os.path.join(tmp, 'bench.db'))
+        app.logger.setLevel('WARNING')
+        create_users(app, args.concurrency, args.method)
+
+        print(f"🔐 Login: {args.logins} logins, {args.concurrency} simultâneos, {args.method}")
+        print(f"{'workers':>8} {'logins/s':>10} {'recusas':>8} {'p50 ms':>9} {'p95 ms':>9}  status")
+        for workers in args.workers:
+            result = run_scenario(app, workers, args.concurrency, args.logins, args.max_pending, args.method)
+            print(f"{result['workers']:>8} {result['throughput']:>10.1f} {result['rejected']:>8.1%} {result['p50']:>9.1f} "
+                  f"{result['p95']:>9.1f}  {result['statuses']}")
+
+        # Grava os eventos pendentes antes de apagar o banco temporário
+        app.extensions['analytics'].shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from urllib.parse import urlencode
+from flask import Response, current_app
+
+
+class TTLCache:
+    """Cache em memória com expiração por tempo e limite de itens (LRU).
+
+    Seguro para uso entre threads do mesmo processo.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+# ==================== CACHE DE RESPOSTAS ====================
+
+class MemoryBackend:
+    """Backend em memória do processo (LRU com expiração)"""
+
+    def __init__(self, maxsize=2048):
+        self._entries = TTLCache(ttl=60, maxsize=maxsize)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, value, ttl):
+        self._entries.set(key, value, ttl=ttl)
+
+    def get_versions(self, tags):
+        with self._lock:
+            return {tag: self._versions.get(tag, '0') for tag in tags}
+
+    def bump(self, tag):
+        with self._lock:
+            self._versions[tag] = uuid.uuid4().hex
+
+
+class DiskBackend:
+    """Backend em arquivos, compartilhado entre processos da mesma máquina.
+
+    Cada entrada é um arquivo pickle gravado de forma atômica (arquivo
+    temporário + ``os.replace``); as versões das tags ficam em arquivos próprios.
+    A cada ``sweep_interval`` segundos uma gravação remove as entradas
+    expiradas e, acima de ``max_entries``, as que expiram primeiro.
+    """
+
+    def __init__(self, directory, max_entries=10000, sweep_interval=60):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0
+        self._sweep_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, prefix, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, f'{prefix}-{digest}')
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key):
+        data = self._read(self._path('entry', key))
+        if data is None:
+            return None
+        expires_at, value = data
+        if expires_at < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        path = self._path('entry', key)
+        expires_at = time.time() + ttl
+        self._write(path, (expires_at, value))
+        # A data de modificação do arquivo guarda a expiração: a limpeza não precisa abri-lo
+        os.utime(path, (expires_at, expires_at))
+        if time.time() >= self._next_sweep:
+            self.sweep()
+
+    def sweep(self):
+        """Remove entradas expiradas e as mais antigas acima do limite. Retorna quantas."""
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0  # outra thread já está varrendo
+        try:
+            self._next_sweep = time.time() + self.sweep_interval
+            now = time.time()
+            entries = []
+            removed = 0
+            with os.scandir(self.directory) as listing:
+                for item in listing:
+                    if not item.name.startswith('entry-'):
+                        continue
+                    try:
+                        expires_at = item.stat().st_mtime
+                    except OSError:
+                        continue  # removida por outro processo
+                    if expires_at < now:
+                        removed += self._remove(item.path)
+                    else:
+                        entries.append((expires_at, item.path))
+            excess = len(entries) - self.max_entries
+            if excess > 0:
+                for _, path in sorted(entries)[:excess]:
+                    removed += self._remove(path)
+            return removed
+        finally:
+            self._sweep_lock.release()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def get_versions(self, tags):
+        return {tag: self._read(self._path('tag', tag)) or '0' for tag in tags}
+
+    def bump(self, tag):
+        self._write(self._path('tag', tag), uuid.uuid4().hex)
+
+
+class ResponseCache:
+    """Cache de respostas com invalidação por tags e coalescência de requisições.
+
+    Cada entrada guarda a versão de suas tags no momento em que foi gerada;
+    ``invalidate(tag)`` troca a versão da tag, o que torna obsoletas todas as
+    entradas marcadas com ela sem precisar enumerá-las. Requisições simultâneas
+    pela mesma chave ausente esperam uma única reconstrução (no processo).
+    """
+
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    _MISSING = object()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _lookup(self, key):
+        entry = self.backend.get(key)
+        if entry is None:
+            return self._MISSING
+        tags, value = entry
+        if self.backend.get_versions(tags) != tags:
+            return self._MISSING
+        return value
+
+    def get_or_build(self, key, builder, tags=(), ttl=None):
+        """Retorna o valor em cache ou o constrói com ``builder``.
+
+        ``tags`` são as tags conhecidas antes da construção; ``builder`` devolve
+        ``(valor, tags_extras)`` ou ``None`` quando o resultado não deve ser
+        guardado (por exemplo, um 404), caso em que retorna ``None``.
+        """
+        value = self._lookup(key)
+        if value is not self._MISSING:
+            self._count('hits')
+            return value
+
+        with self._locks_guard:
+            lock_entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            lock_entry[1] += 1
+        try:
+            with lock_entry[0]:
+                value = self._lookup(key)
+                if value is not self._MISSING:
+                    self._count('coalesced')
+                    return value
+
+                self._count('misses')
+                # Versões lidas antes de consultar o banco: uma invalidação
+                # durante a construção já deixa a entrada obsoleta
+                versions = self.backend.get_versions(tags)
+                result = builder()
+                if result is None:
+                    return None
+                value, extra_tags = result
+                versions = {**self.backend.get_versions(extra_tags), **versions}
+                self.backend.set(key, (versions, value), self.ttl if ttl is None else ttl)
+                self._count('stores')
+                return value
+        finally:
+            with self._locks_guard:
+                lock_entry[1] -= 1
+                if lock_entry[1] == 0:
+                    del self._locks[key]
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.bump(tag)
+            self._count('invalidations')
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        lookups = data.get('hits', 0) + data.get('coalesced', 0) + data.get('misses', 0)
+        data['hit_ratio'] = round((data.get('hits', 0) + data.get('coalesced', 0)) / lookups, 3) if lookups else None
+        data['backend'] = type(self.backend).__name__
+        return data
+
+
+class NullResponseCache(ResponseCache):
+    """Cache desativado: sempre reconstrói"""
+
+    def __init__(self):
+        super().__init__(backend=None)
+
+    def get_or_build(self, key, builder, tags=(), ttl=None):
+        self._count('misses')
+        result = builder()
+        return result[0] if result is not None else None
+
+    def invalidate(self, *tags):
+        pass
+
+
+# Tags: a listagem do catálogo como um todo, cada curso (detalhe, aulas e
+# as páginas do catálogo em que ele aparece) e o criador dos cursos
+CATALOG_TAG = 'catalog'
+
+
+def course_tag(course_uuid):
+    return f'course:{course_uuid}'
+
+
+def catalog_sort_tag(sort_by):
+    """Páginas do catálogo em uma ordenação: ``popular`` muda com as matrículas e
+    ``rating`` com as avaliações, inclusive de cursos que ainda não estão na página
+    """
+    return f'catalog:sort:{sort_by}'
+
+
+def creator_tag(user_id):
+    """Respostas que mostram o perfil do criador (nome, avatar) nos cursos dele"""
+    return f'creator:{user_id}'
+
+
+def init_response_cache(app):
+    """Cria o cache de respostas conforme RESPONSE_CACHE_BACKEND (memory, disk ou none)"""
+    backend_name = app.config.get('RESPONSE_CACHE_BACKEND', 'memory')
+    ttl = app.config.get('RESPONSE_CACHE_TTL', 60)
+    if backend_name == 'memory':
+        cache = ResponseCache(MemoryBackend(app.config.get('RESPONSE_CACHE_MAXSIZE', 2048)), ttl)
+    elif backend_name == 'disk':
+        cache = ResponseCache(DiskBackend(
+            app.config.get('RESPONSE_CACHE_DIR', 'cache'),
+            max_entries=app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 10000),
+            sweep_interval=app.config.get('RESPONSE_CACHE_SWEEP_INTERVAL', 60)
+        ), ttl)
+    else:
+        cache = NullResponseCache()
+    app.extensions['response_cache'] = cache
+    return cache
+
+
+def cache_key(prefix, args=None, params=None):
+    """Chave normalizada pelos parâmetros da query em ordem.
+
+    ``params`` restringe a chave aos parâmetros que o endpoint lê: valores
+    arbitrários em outros parâmetros não criam entradas novas.
+    """
+    items = sorted((name, value) for name, value in (args.items(multi=True) if args else ())
+                   if params is None or name in params)
+    if not items:
+        return prefix
+    return f'{prefix}?{urlencode(items)}'
+
+
+def get_or_build(key, builder, tags=(), ttl=None):
+    return current_app.extensions['response_cache'].get_or_build(key, builder, tags, ttl)
+
+
+def invalidate(*tags):
+    """Invalida as respostas marcadas com as tags (chamar após o commit)"""
+    current_app.extensions['response_cache'].invalidate(*tags)
+
+
+def json_body(data):
+    """Serializa ``data`` como o ``jsonify`` faria, para guardar no cache"""
+    return current_app.json.response(data).get_data()
+
+
+def json_response(body, status=200):
+    return Response(body, status=status, mimetype=current_app.json.mimetype)
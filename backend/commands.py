@@ -0,0 +1,149 @@
+from contextlib import nullcontext
+import click
+from models import db, Course, CourseStats, Enrollment, StoredFile
+from schema import upgrade_schema
+from analytics import rollup_analytics
+from search import ensure_search_index, reindex_courses
+from uploads import cleanup_uploads
+from storage import collect_blobs, blob_path
+from images import is_image
+from threads import backfill_threads
+from database import refresh_replica
+from query_plans import check_query_plans, plan_fixtures
+
+
+def register_commands(app):
+    """Registra os comandos de manutenção no CLI do Flask"""
+
+    @app.cli.command('upgrade-schema')
+    def upgrade_schema_command():
+        """Cria tabelas e colunas novas no banco existente"""
+        db.create_all()
+        added = upgrade_schema()
+        for item in added:
+            click.echo(f'Adicionado: {item}')
+        backfilled = backfill_threads()
+        if backfilled:
+            click.echo(f'{backfilled} comentários associados às suas conversas')
+        seeded = CourseStats.backfill()
+        if seeded:
+            click.echo(f'{seeded} cursos com estatísticas criadas')
+        if ensure_search_index():
+            click.echo('Índice de busca criado')
+        click.echo('Esquema atualizado')
+
+    @app.cli.command('rebuild-progress')
+    @click.option('--course', 'course_uuid', help='UUID do curso (padrão: todos)')
+    def rebuild_progress_command(course_uuid):
+        """Reconstrói o progresso consolidado das matrículas"""
+        course_id = None
+        if course_uuid:
+            course = Course.query.filter_by(uuid=course_uuid).first()
+            if not course:
+                raise click.ClickException('Curso não encontrado')
+            course_id = course.id
+
+        updated = Enrollment.rebuild(course_id=course_id)
+        db.session.commit()
+        click.echo(f'{updated} matrículas recalculadas')
+
+    @app.cli.command('reconcile-stats')
+    @click.option('--course', 'course_uuid', help='UUID do curso (padrão: todos)')
+    def reconcile_stats_command(course_uuid):
+        """Corrige divergências das estatísticas consolidadas dos cursos"""
+        course_id = None
+        if course_uuid:
+            course = Course.query.filter_by(uuid=course_uuid).first()
+            if not course:
+                raise click.ClickException('Curso não encontrado')
+            course_id = course.id
+
+        repaired = CourseStats.reconcile(course_id=course_id)
+        db.session.commit()
+        click.echo(f'{repaired} cursos corrigidos')
+
+    @app.cli.command('rebuild-search')
+    def rebuild_search_command():
+        """Reconstrói o índice de busca textual dos cursos"""
+        if not ensure_search_index():
+            with db.engine.begin() as conn:
+                reindex_courses(conn)
+        click.echo('Índice de busca reconstruído')
+
+    @app.cli.command('check-query-plans')
+    @click.option('--verbose', is_flag=True, help='Mostra também as consultas com B-tree temporária')
+    @click.option('--fixtures', is_flag=True, help='Cria (e remove ao final) o aluno e a conversa que faltarem')
+    def check_query_plans_command(verbose, fixtures):
+        """Confere com EXPLAIN QUERY PLAN se as consultas dos endpoints de leitura usam índices"""
+        failures = 0
+        with (plan_fixtures(app) if fixtures else nullcontext()):
+            results = check_query_plans(app)
+        for result in results:
+            if 'skipped' in result:
+                # Endpoint não verificado não pode passar como verificado
+                failures += 1
+                click.echo(f"FALHA {result['name']}: não verificado ({result['skipped']}; use --fixtures)")
+                continue
+            failed = bool(result['scans']) or result['status'] >= 500
+            failures += failed
+            line = f"{'FALHA' if failed else 'ok   '} {result['name']} ({result['path']}): HTTP {result['status']}, {result['queries']} consultas"
+            if result['warnings']:
+                line += f", {len(result['warnings'])} com B-tree temporária"
+            click.echo(line)
+            for item in result['scans'] + (result['warnings'] if verbose else []):
+                click.echo(f"        {item['sql']}")
+                for step in item['plan']:
+                    click.echo(f'          {step}')
+        if failures:
+            raise click.ClickException(f'{failures} endpoints com consultas sem índice, com erro ou não verificados')
+        click.echo('Todas as consultas usam índices')
+
+    @app.cli.command('refresh-replica')
+    def refresh_replica_command():
+        """Atualiza a cópia do banco usada como réplica de leitura"""
+        try:
+            target = refresh_replica()
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Réplica atualizada: {target}')
+
+    @app.cli.command('rollup-analytics')
+    @click.option('--chunk-size', default=10000, show_default=True, help='Eventos por transação')
+    @click.option('--lag', type=int, help='Segundos de atraso dos eventos agregados (padrão: ANALYTICS_ROLLUP_LAG)')
+    def rollup_analytics_command(chunk_size, lag):
+        """Agrega os eventos novos de analytics por hora e por dia"""
+        app.extensions['analytics'].flush()
+        processed = rollup_analytics(chunk_size=chunk_size, lag=lag)
+        click.echo(f'{processed} eventos agregados')
+
+    @app.cli.command('cleanup-uploads')
+    @click.option('--max-age', type=int, help='Horas sem atividade (padrão: UPLOAD_SESSION_TTL_HOURS)')
+    def cleanup_uploads_command(max_age):
+        """Descarta uploads em partes abandonados e seus arquivos parciais"""
+        removed = cleanup_uploads(max_age_hours=max_age)
+        click.echo(f'{removed} uploads descartados')
+
+    @app.cli.command('gc-blobs')
+    def gc_blobs_command():
+        """Apaga do disco os blobs que não são mais referenciados por nenhum arquivo"""
+        removed = collect_blobs()
+        click.echo(f'{removed} blobs removidos')
+
+    @app.cli.command('build-image-variants')
+    def build_image_variants_command():
+        """Gera as versões reduzidas que faltam para as imagens já enviadas"""
+        pipeline = app.extensions['image_variants']
+        if not pipeline.enabled:
+            click.echo('Geração desativada (Pillow não instalado ou IMAGE_WORKERS = 0)')
+            return
+
+        seen = set()
+        queued = 0
+        for stored in StoredFile.query.order_by(StoredFile.id):
+            if stored.blob_sha256 in seen or not is_image(stored):
+                continue
+            seen.add(stored.blob_sha256)
+            if pipeline.submit(stored.blob_sha256, blob_path(stored.blob_sha256)):
+                queued += 1
+        pipeline.shutdown(wait=True)
+        click.echo(f'{queued} imagens processadas')
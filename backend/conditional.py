@@ -0,0 +1,77 @@
+import hashlib
+from collections import namedtuple
+from datetime import timezone
+from flask import request, current_app
+from sqlalchemy import func
+from models import db, User, Course, CourseStats, Lesson
+
+# Versão de um recurso: id do registro principal, ETag forte e data da última
+# alteração. Calculada com uma consulta leve, antes de qualquer serialização.
+ResourceVersion = namedtuple('ResourceVersion', ['id', 'etag', 'last_modified'])
+
+
+def make_version(kind, record_id, parts, timestamps):
+    """Monta a versão a partir das partes que mudam junto com a representação"""
+    digest = hashlib.sha1(repr((kind, record_id) + tuple(parts)).encode()).hexdigest()
+    timestamps = [moment for moment in timestamps if moment is not None]
+    last_modified = max(timestamps).replace(microsecond=0, tzinfo=timezone.utc) if timestamps else None
+    return ResourceVersion(record_id, digest[:32], last_modified)
+
+
+def course_version(course_uuid, kind='course', published_only=False):
+    """Versão do curso: o próprio curso, o criador, as estatísticas e a aula mais recente.
+
+    ``course_stats.updated_at`` muda a cada aula criada/removida, matrícula e
+    avaliação, e a contagem de aulas cobre remoções. Retorna None se não existir.
+    """
+    query = db.session.query(
+        Course.id, Course.updated_at, User.updated_at, CourseStats.updated_at,
+        func.max(Lesson.updated_at), func.count(Lesson.id)
+    ).join(User, User.id == Course.creator_id).outerjoin(
+        CourseStats, CourseStats.course_id == Course.id
+    ).outerjoin(Lesson, Lesson.course_id == Course.id).filter(
+        Course.uuid == course_uuid
+    ).group_by(Course.id, Course.updated_at, User.updated_at, CourseStats.updated_at)
+    if published_only:
+        query = query.filter(Course.is_published == True)
+
+    row = query.first()
+    if row is None:
+        return None
+    course_id, course_updated, creator_updated, stats_updated, lesson_updated, lesson_count = row
+    return make_version(
+        kind, course_id,
+        (course_updated, creator_updated, stats_updated, lesson_updated, lesson_count),
+        (course_updated, creator_updated, stats_updated, lesson_updated)
+    )
+
+
+def lesson_version(lesson):
+    return make_version('lesson', lesson.id, (lesson.updated_at, lesson.course_id), (lesson.updated_at,))
+
+
+def user_version(user):
+    return make_version('user', user.id, (user.updated_at, user.email, user.role), (user.updated_at,))
+
+
+def is_not_modified(version):
+    """Avalia If-None-Match (prioritário) e If-Modified-Since da requisição"""
+    if request.if_none_match:
+        return request.if_none_match.contains(version.etag)
+    if request.if_modified_since and version.last_modified:
+        return version.last_modified <= request.if_modified_since
+    return False
+
+
+def not_modified_response(version, private=False):
+    response = current_app.response_class(status=304)
+    return with_validators(response, version, private)
+
+
+def with_validators(response, version, private=False):
+    """Adiciona ETag, Last-Modified e Cache-Control (revalidar sempre) à resposta"""
+    response.set_etag(version.etag)
+    if version.last_modified:
+        response.last_modified = version.last_modified
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'public, no-cache'
+    return response
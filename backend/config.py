@@ -5,18 +5,119 @@ class Config:
     SECRET_KEY = 'sua-chave-secreta-muito-segura-aqui'
     SQLALCHEMY_DATABASE_URI = 'sqlite:///cursohub.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # Perfis do engine do banco: opções do pool e PRAGMAs aplicados em cada
+    # conexão do SQLite, conferidos na inicialização (ver ``database.py``)
+    DATABASE_PROFILES = {
+        'sqlite-dev': {
+            'engine_options': {},
+            'pragmas': {'busy_timeout': 5000}
+        },
+        'sqlite-wal': {
+            'engine_options': {'pool_size': 10, 'max_overflow': 5, 'pool_timeout': 10},
+            'pragmas': {
+                'journal_mode': 'WAL',  # leitores não bloqueiam o escritor
+                'synchronous': 'NORMAL',  # com WAL, fsync só no checkpoint
+                'busy_timeout': 5000,  # ms esperando a trava de escrita
+                'cache_size': -65536,  # KiB por conexão (64MB)
+                'mmap_size': 268435456  # 256MB
+            }
+        },
+        'server': {
+            'engine_options': {'pool_size': 10, 'max_overflow': 20, 'pool_pre_ping': True, 'pool_recycle': 1800},
+            'pragmas': {}
+        }
+    }
+    DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite-dev')
+    
+    # Réplica de leitura para requisições só de leitura (GET/HEAD).
+    # 'readonly' abre o próprio arquivo SQLite com mode=ro; uma URL aponta para
+    # outro banco (ex.: cópia atualizada por ``flask refresh-replica``)
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')  # None desativa
+    READ_YOUR_WRITES_WINDOW = 5.0  # segundos em que quem escreveu continua lendo do principal
+    
+    # Instrumentação SQL por requisição: Server-Timing/X-Query-Count e log de
+    # consultas lentas (ver ``instrumentation.py``). False não registra listeners
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '').lower() in ('1', 'true')
+    SQL_SAMPLE_RATE = 1.0  # fração das requisições medidas
+    SQL_TIMING_HEADERS = True
+    SQL_SLOW_QUERY_MS = 200
+    SQL_SLOW_QUERY_EXPLAIN = False  # inclui o plano da consulta lenta no log
+    SQL_EXPLAIN_SAMPLE_RATE = 1.0  # fração das consultas lentas com EXPLAIN
+    SQL_REPEATED_QUERY_THRESHOLD = 10  # mesmo SQL repetido na requisição (possível N+1)
     JWT_SECRET_KEY = 'jwt-secret-string-muito-segura'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # tamanho máximo de cada parte do upload retomável
+    UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024  # 2GB por arquivo no upload retomável
+    UPLOAD_SESSION_TTL_HOURS = 24  # uploads pendentes sem atividade são descartados
+    UPLOAD_CACHE_MAX_AGE = 365 * 24 * 3600  # arquivos enviados nunca mudam de conteúdo
+    UPLOAD_ACCEL_REDIRECT = None  # ex.: '/protected-uploads' para o nginx servir via X-Accel-Redirect
+    CATALOG_TOTAL_TTL = 30  # segundos de cache do total de cursos por filtro
+    IDENTITY_CACHE_TTL = 60  # segundos de cache da identidade (id, papel, ativo) do token
+    ENTITLEMENT_CACHE_TTL = 300  # segundos de cache dos cursos em que cada usuário está matriculado
+    
+    # Hash de senhas: parâmetros do werkzeug e pool limitado de threads.
+    # Hashes com parâmetros diferentes são refeitos no próximo login.
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:600000'
+    PASSWORD_HASH_WORKERS = 4  # 0 executa na thread da requisição
+    PASSWORD_HASH_MAX_PENDING = 64  # operações em andamento + na fila antes de responder 503
+    PASSWORD_HASH_TIMEOUT = 10.0  # segundos
+    
+    # Analytics: eventos enfileirados e gravados em lote por uma thread
+    ANALYTICS_ASYNC = True
+    ANALYTICS_QUEUE_SIZE = 10000
+    ANALYTICS_BATCH_SIZE = 500
+    ANALYTICS_FLUSH_INTERVAL = 2.0  # segundos
+    ANALYTICS_ENQUEUE_TIMEOUT = 0.01  # espera máxima com a fila cheia antes de descartar
+    ANALYTICS_SAMPLE_RATES = {}  # ex.: {'courses_viewed': 0.1} grava 10% dos eventos
+    ANALYTICS_ROLLUP_INTERVAL = 60  # segundos entre agregações automáticas (0 desativa)
+    ANALYTICS_ROLLUP_LAG = 60  # segundos: eventos mais novos ficam para a próxima agregação
+    
+    # Heartbeats de progresso das aulas: último valor por (aluno, aula) gravado em lote
+    PROGRESS_ASYNC = True  # False grava cada heartbeat na própria requisição
+    PROGRESS_FLUSH_INTERVAL = 5.0  # segundos
+    PROGRESS_MAX_PENDING = 10000  # (aluno, aula) pendentes antes de gravar na requisição
+    PROGRESS_BATCH_MAX_ITEMS = 500  # itens por chamada de /api/students/progress:batch
+    
+    # Fila de escrita: transações de matrícula, progresso, avaliações, comentários
+    # e analytics executadas em série por uma conexão dedicada, um commit por lote
+    WRITE_QUEUE_ENABLED = False
+    WRITE_QUEUE_SIZE = 1000  # transações na fila antes de responder 503
+    WRITE_QUEUE_MAX_BATCH = 64  # transações por commit
+    WRITE_QUEUE_BATCH_WINDOW = 0.0  # segundos esperando mais transações (0: só as já enfileiradas)
+    WRITE_QUEUE_TIMEOUT = 5.0  # segundos de espera da requisição antes de responder 503
+    
+    # Cache das respostas públicas do catálogo (memory, disk ou none)
+    RESPONSE_CACHE_BACKEND = 'memory'
+    RESPONSE_CACHE_TTL = 60  # segundos
+    RESPONSE_CACHE_MAXSIZE = 2048  # entradas (backend memory)
+    RESPONSE_CACHE_DIR = 'cache'  # diretório do backend disk, compartilhado entre workers
+    RESPONSE_CACHE_MAX_ENTRIES = 10000  # arquivos de entrada no backend disk
+    RESPONSE_CACHE_SWEEP_INTERVAL = 60  # segundos entre limpezas do backend disk
+    
+    # Versões reduzidas de avatares e capas, geradas em processos separados (requer Pillow)
+    IMAGE_VARIANT_SIZES = (64, 256, 1024)  # lado máximo em pixels
+    IMAGE_VARIANT_FORMAT = 'webp'  # webp ou jpeg (jpeg se o Pillow não tiver suporte a webp)
+    IMAGE_VARIANT_QUALITY = 80
+    IMAGE_WORKERS = 2  # processos; 0 desativa a geração
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:60000'  # custo menor para desenvolvimento local
+    SQL_INSTRUMENTATION = True
+    SQL_SLOW_QUERY_EXPLAIN = True
 
 class ProductionConfig(Config):
     DEBUG = False
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'production-secret-key'
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-production-secret'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or Config.SQLALCHEMY_DATABASE_URI
+    DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite-wal')
+    SQL_SAMPLE_RATE = 0.05
+    SQL_TIMING_HEADERS = False  # não expor tempos do banco a clientes anônimos
+    SQL_EXPLAIN_SAMPLE_RATE = 0.1
 
 config = {
     'development': DevelopmentConfig,
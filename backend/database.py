@@ -0,0 +1,140 @@
+import sqlite3
+from sqlalchemy import event, make_url, text
+from models import db
+from routing import REPLICA_BIND
+
+# Perfis do engine do banco (``DATABASE_PROFILES`` em config.py). As opções
+# do pool entram em ``SQLALCHEMY_ENGINE_OPTIONS`` antes do ``db.init_app``; os
+# PRAGMAs do SQLite valem por conexão, então são aplicados em cada conexão
+# nova do pool e conferidos uma vez na inicialização.
+
+SYNCHRONOUS_LEVELS = {'OFF': 0, 'NORMAL': 1, 'FULL': 2, 'EXTRA': 3}
+
+# PRAGMAs que alteram o arquivo: não se aplicam à réplica somente leitura
+WRITE_PRAGMAS = {'journal_mode', 'synchronous'}
+
+
+def engine_profile(app):
+    """Nome e definição do perfil configurado (``DATABASE_PROFILE``)"""
+    name = app.config.get('DATABASE_PROFILE', 'sqlite-dev')
+    profiles = app.config.get('DATABASE_PROFILES', {})
+    if name not in profiles:
+        raise ValueError(f"Perfil de banco desconhecido: {name} (use {', '.join(profiles)})")
+    return name, profiles[name]
+
+
+def configure_engine(app):
+    """Opções do pool do perfil; chamar antes de ``db.init_app``"""
+    name, profile = engine_profile(app)
+    is_sqlite = app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+    if profile.get('pragmas') and not is_sqlite:
+        raise ValueError(f'Perfil {name} é para SQLite: use o perfil server com DATABASE_URL')
+    options = dict(profile.get('engine_options', {}))
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})  # ajustes explícitos prevalecem
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    replica = replica_url(app)
+    if replica:
+        app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **{REPLICA_BIND: replica})
+
+
+def replica_url(app):
+    """URL da réplica de leitura; ``readonly`` vira o arquivo principal com ``mode=ro``"""
+    replica = app.config.get('DATABASE_REPLICA_URL')
+    if replica != 'readonly':
+        return replica
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise ValueError('DATABASE_REPLICA_URL=readonly requer um banco SQLite em arquivo')
+    # Caminho relativo continua relativo à pasta instance (o Flask-SQLAlchemy resolve)
+    return url.set(database=f'file:{url.database}', query={'mode': 'ro', 'uri': 'true'}).render_as_string(
+        hide_password=False)
+
+
+def apply_pragmas(engine, pragmas):
+    """Executa os PRAGMAs em cada conexão nova do engine"""
+    if not pragmas or engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def _expected(name, value):
+    if name == 'synchronous' and str(value).upper() in SYNCHRONOUS_LEVELS:
+        return str(SYNCHRONOUS_LEVELS[str(value).upper()])
+    return str(value).lower()
+
+
+def verify_engine(engine, pragmas):
+    """Confere os PRAGMAs em uma conexão nova. Retorna ``{pragma: valor lido}``."""
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+        if engine.dialect.name != 'sqlite' or not pragmas:
+            return {}
+        if engine.url.database in (None, '', ':memory:'):
+            return {}  # banco em memória não usa WAL nem mmap
+
+        current = {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in pragmas}
+    mismatched = {
+        name: (value, current[name]) for name, value in pragmas.items()
+        if str(current[name]).lower() != _expected(name, value)
+    }
+    if mismatched:
+        details = ', '.join(f'{name}={actual} (esperado {expected})' for name, (expected, actual) in mismatched.items())
+        raise RuntimeError(f'PRAGMAs do SQLite não aplicados: {details}')
+    return current
+
+
+def init_engine(app):
+    """Aplica os PRAGMAs do perfil e confere a conexão; chamar depois de ``db.init_app``"""
+    name, profile = engine_profile(app)
+    pragmas = profile.get('pragmas', {})
+    with app.app_context():
+        apply_pragmas(db.engine, pragmas)
+        current = verify_engine(db.engine, pragmas)
+        url = db.engine.url.render_as_string(hide_password=True)
+
+        replica = db.engines.get(REPLICA_BIND)
+        if replica is not None:
+            read_pragmas = {name: value for name, value in pragmas.items() if name not in WRITE_PRAGMAS}
+            apply_pragmas(replica, read_pragmas)
+            verify_engine(replica, read_pragmas)
+            app.logger.info(f"Réplica de leitura: {replica.url.render_as_string(hide_password=True)}")
+    app.logger.info(f"Banco: perfil {name} em {url} {current or ''}".rstrip())
+    return current
+
+
+def refresh_replica():
+    """Copia o banco principal sobre o arquivo da réplica (API de backup do SQLite).
+
+    A cópia é consistente e feita no próprio arquivo, então as conexões já
+    abertas da réplica passam a ver os dados novos. Retorna o caminho da réplica.
+    """
+    replica = db.engines.get(REPLICA_BIND)
+    if replica is None:
+        raise ValueError('Réplica de leitura não configurada (DATABASE_REPLICA_URL)')
+    if db.engine.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        raise ValueError('A cópia da réplica só é feita entre bancos SQLite')
+    target = replica.url.database
+    if target.startswith('file:'):
+        target = target[len('file:'):]
+    if target == db.engine.url.database:
+        raise ValueError('A réplica é o próprio banco principal (mode=ro): não há cópia a atualizar')
+
+    source = db.engine.raw_connection()
+    try:
+        destination = sqlite3.connect(target)
+        try:
+            source.driver_connection.backup(destination)
+        finally:
+            destination.close()
+    finally:
+        source.close()
+    return target
@@ -0,0 +1,73 @@
+from collections import namedtuple
+from flask import current_app, jsonify
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, User
+from cache import TTLCache
+
+# Identidade do usuário autenticado: apenas o que as rotas precisam para
+# autorizar. Quem precisar do modelo completo usa ``load_user``.
+Identity = namedtuple('Identity', ['id', 'uuid', 'role', 'is_active'])
+
+_identities = TTLCache(ttl=60, maxsize=10000)
+
+
+def resolve_identity(user_uuid):
+    """Identidade pelo uuid do token, do cache ou com uma consulta de colunas"""
+    identity = _identities.get(user_uuid)
+    if identity is None:
+        row = db.session.query(User.id, User.uuid, User.role, User.is_active).filter_by(uuid=user_uuid).first()
+        if row is None:
+            return None
+        identity = Identity(*row)
+        _identities.set(user_uuid, identity, ttl=current_app.config.get('IDENTITY_CACHE_TTL', 60))
+    return identity
+
+
+def invalidate_identity(user_uuid):
+    _identities.delete(user_uuid)
+
+
+def load_user(identity):
+    """Modelo ``User`` completo da identidade (usa o mapa de identidade da sessão)"""
+    return db.session.get(User, identity.id)
+
+
+def init_identity(jwt):
+    """Registra a resolução do usuário no Flask-JWT-Extended.
+
+    O ``current_user`` fica memorizado na requisição pelo próprio
+    Flask-JWT-Extended; entre requisições, a identidade vem do cache.
+    """
+    @jwt.user_lookup_loader
+    def _lookup(jwt_header, jwt_data):
+        identity = resolve_identity(jwt_data[current_app.config['JWT_IDENTITY_CLAIM']])
+        if identity is None or not identity.is_active:
+            return None
+        return identity
+
+    @jwt.user_lookup_error_loader
+    def _lookup_error(jwt_header, jwt_data):
+        return jsonify({'error': 'Usuário não encontrado'}), 404
+
+
+# ==================== INVALIDAÇÃO ====================
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _mark_identity_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_identities', set()).add(target.uuid)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_identities(session):
+    # Só após o commit: antes disso outra requisição poderia recarregar o valor antigo
+    for user_uuid in session.info.pop('changed_identities', ()):
+        invalidate_identity(user_uuid)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_identities(session):
+    session.info.pop('changed_identities', None)
@@ -0,0 +1,49 @@
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow é opcional (ver ``images.py``)
+    Image = None
+
+# Código executado nos processos do pool de versões de imagens. Este módulo
+# não importa o Flask, o banco nem o app: os processos são iniciados com
+# forkserver/spawn e carregam apenas o que está aqui.
+
+SAVE_OPTIONS = {
+    'webp': {'method': 4},
+    'jpeg': {'optimize': True, 'progressive': True}
+}
+
+
+def variant_path(sha256, size, fmt):
+    """Caminho relativo a ``UPLOAD_FOLDER`` da versão ``size`` do blob"""
+    extension = 'jpg' if fmt == 'jpeg' else fmt
+    return f'variants/{sha256[:2]}/{sha256}-{size}.{extension}'
+
+
+def render_variants(source, upload_folder, sha256, sizes, fmt, quality):
+    """Gera as versões reduzidas de uma imagem (executa em um processo do pool).
+
+    Não acessa o banco: retorna ``[(size, path, width, height), ...]`` para o
+    processo principal registrar. Versões já existentes em disco são mantidas.
+    """
+    results = []
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA')
+
+        for size in sizes:
+            path = variant_path(sha256, size, fmt)
+            target = os.path.join(upload_folder, path)
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                tmp_path = f'{target}.{os.getpid()}.tmp'
+                resized.save(tmp_path, fmt.upper(), quality=quality, **SAVE_OPTIONS.get(fmt, {}))
+                os.replace(tmp_path, target)
+            results.append((size, path, resized.width, resized.height))
+    return results
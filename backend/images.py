@@ -0,0 +1,209 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Course, StoredFile, ImageVariant
+from storage import blob_path
+from image_worker import render_variants
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow é opcional: sem ele as URLs originais continuam valendo
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Versões reduzidas de avatares e capas. Como o conteúdo é endereçado pelo
+# sha256 (ver ``storage.py``), cada imagem distinta é processada uma única vez
+# e os arquivos gerados têm caminho determinístico: repetir o trabalho
+# não sobrescreve nada e só completa o que faltou. O redimensionamento em si
+# fica em ``image_worker.py``.
+
+class VariantPipeline:
+    """Fila de geração de versões em um pool de processos.
+
+    A imagem é redimensionada fora do processo web (CPU não disputa o GIL com
+    as requisições); o registro no banco e a troca das URLs acontecem no
+    processo principal quando o trabalho termina.
+    """
+
+    def __init__(self, app, workers=2, sizes=(64, 256, 1024), fmt='webp', quality=80):
+        self.app = app
+        self.workers = workers
+        self.sizes = tuple(sorted(sizes))
+        self.format = fmt
+        self.quality = quality
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return Image is not None and self.workers > 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Sem fork: o processo web já tem threads (analytics, progresso,
+            # fila de escrita, hash de senhas) e um filho criado com um lock
+            # delas travado pode ficar bloqueado para sempre. Os processos só
+            # importam ``image_worker`` (Pillow e disco), não o app
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def _missing(self, sha256):
+        done = db.session.query(ImageVariant.size).filter_by(blob_sha256=sha256, format=self.format)
+        existing = {size for (size,) in done.all()}
+        return [size for size in self.sizes if size not in existing]
+
+    def submit(self, sha256, source):
+        """Enfileira as versões que faltam para o blob. Retorna False se nada foi enfileirado."""
+        if not self.enabled:
+            return False
+        sizes = self._missing(sha256)
+        if not sizes:
+            # Mesmo conteúdo já processado: só atualiza quem aponta para ele
+            self._apply(sha256)
+            return False
+        with self._lock:
+            if sha256 in self._pending:
+                return False
+            self._pending.add(sha256)
+
+        args = (render_variants, source, os.path.abspath(self.app.config['UPLOAD_FOLDER']),
+                sha256, sizes, self.format, self.quality)
+        try:
+            try:
+                future = self._get_executor().submit(*args)
+            except BrokenProcessPool:
+                # Um processo morreu (ex.: imagem que estoura a memória): recria o pool
+                self._executor = None
+                future = self._get_executor().submit(*args)
+        except Exception:
+            with self._lock:
+                self._pending.discard(sha256)
+            raise
+        future.add_done_callback(lambda f: self._finished(sha256, f))
+        return True
+
+    def _finished(self, sha256, future):
+        with self._lock:
+            self._pending.discard(sha256)
+        try:
+            results = future.result()
+        except Exception:
+            logger.exception('Falha ao gerar versões da imagem %s', sha256)
+            return
+        with self.app.app_context():
+            try:
+                self._record(sha256, results)
+                self._apply(sha256)
+            except Exception:
+                db.session.rollback()
+                logger.exception('Falha ao registrar versões da imagem %s', sha256)
+
+    def _record(self, sha256, results):
+        for size, path, width, height in results:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(ImageVariant(blob_sha256=sha256, size=size, format=self.format,
+                                                width=width, height=height, path=path))
+            except IntegrityError:
+                pass  # já registrada por uma execução anterior
+        db.session.commit()
+
+    def _apply(self, sha256):
+        """Grava as URLs das versões nos usuários e cursos que usam este conteúdo"""
+        from cache import CATALOG_TAG, course_tag, creator_tag, invalidate
+
+        variants = variants_for_blob(sha256, self.format)
+        if not variants:
+            return
+        urls = [stored.url for stored in StoredFile.query.filter_by(blob_sha256=sha256)]
+        if not urls:
+            return
+
+        users = User.query.filter(User.avatar_url.in_(urls)).all()
+        courses = Course.query.filter(Course.thumbnail_url.in_(urls)).all()
+        for user in users:
+            user.avatar_variants = variants
+        for course in courses:
+            course.thumbnail_variants = variants
+        db.session.commit()
+
+        if users or courses:
+            # O avatar do criador também aparece nas respostas dos cursos dele
+            invalidate(CATALOG_TAG, *[course_tag(course.uuid) for course in courses],
+                       *[creator_tag(user.id) for user in users])
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+def variants_for_blob(sha256, fmt=None):
+    """``{"64": url, "256": url, ...}`` das versões registradas, ou None"""
+    query = ImageVariant.query.filter_by(blob_sha256=sha256)
+    if fmt:
+        query = query.filter_by(format=fmt)
+    variants = {str(variant.size): variant.url for variant in query.order_by(ImageVariant.size)}
+    return variants or None
+
+
+def variants_for_url(url):
+    """Versões já geradas para uma URL de ``/uploads/files/<uuid>/<nome>``.
+
+    Usada ao trocar ``avatar_url``/``thumbnail_url``: se a imagem ainda está
+    na fila, retorna None e o pipeline preenche quando terminar.
+    """
+    prefix = '/uploads/files/'
+    if not url or not url.startswith(prefix):
+        return None
+    file_uuid = url[len(prefix):].split('/', 1)[0]
+    stored = StoredFile.query.filter_by(uuid=file_uuid).first()
+    if stored is None:
+        return None
+    pipeline = current_app.extensions.get('image_variants')
+    return variants_for_blob(stored.blob_sha256, pipeline.format if pipeline else None)
+
+
+def is_image(stored):
+    return stored.file_type == 'avatar' or (stored.content_type or '').startswith('image/')
+
+
+def enqueue_variants(stored):
+    """Agenda as versões reduzidas de um arquivo enviado, se for imagem"""
+    pipeline = current_app.extensions.get('image_variants')
+    if pipeline is None or not pipeline.enabled or not is_image(stored):
+        return False
+    try:
+        return pipeline.submit(stored.blob_sha256, blob_path(stored.blob_sha256))
+    except Exception:
+        # O upload já foi concluído; a geração pode ser refeita com
+        # ``flask build-image-variants``
+        logger.exception('Não foi possível agendar as versões de %s', stored.uuid)
+        return False
+
+
+def init_image_variants(app):
+    """Cria o pipeline de versões de imagens a partir da configuração"""
+    fmt = app.config.get('IMAGE_VARIANT_FORMAT', 'webp')
+    if fmt == 'webp' and Image is not None and not features.check('webp'):
+        fmt = 'jpeg'
+    pipeline = VariantPipeline(
+        app,
+        workers=app.config.get('IMAGE_WORKERS', 2),
+        sizes=app.config.get('IMAGE_VARIANT_SIZES', (64, 256, 1024)),
+        fmt=fmt,
+        quality=app.config.get('IMAGE_VARIANT_QUALITY', 80)
+    )
+    if Image is None and pipeline.workers > 0:
+        app.logger.info('Pillow não instalado: versões reduzidas de imagens desativadas')
+    app.extensions['image_variants'] = pipeline
+    return pipeline
@@ -0,0 +1,177 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from models import db
+from query_plans import explain_plan
+
+# Instrumentação SQL por requisição (``SQL_INSTRUMENTATION``). Os eventos de
+# cursor do SQLAlchemy contam as consultas e somam o tempo no banco de cada
+# requisição amostrada; o total vai nos cabeçalhos ``Server-Timing`` e
+# ``X-Query-Count``. Consultas acima de ``SQL_SLOW_QUERY_MS`` são registradas
+# no log com a rota, os parâmetros (só de SELECTs) e, opcionalmente, o plano
+# (EXPLAIN). Desativada, nenhum listener é registrado.
+
+logger = logging.getLogger(__name__)
+
+# Limite dos parâmetros no log de consultas lentas
+MAX_LOGGED_PARAMETERS = 500
+
+
+def _is_select(statement):
+    return statement.lstrip().upper().startswith(('SELECT', 'WITH'))
+
+
+class _RequestQueries:
+    __slots__ = ('count', 'seconds', 'statements', 'slow')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.slow = []
+
+
+class SqlInstrumentation:
+    """Contagem e tempo das consultas por requisição, com log de consultas lentas.
+
+    Só as requisições sorteadas por ``sample_rate`` são medidas. Os totais por
+    endpoint ficam em ``stats()``; o mesmo SQL repetido ``repeated_threshold``
+    vezes em uma requisição é registrado como possível N+1.
+    """
+
+    def __init__(self, sample_rate=1.0, headers=True, slow_query_ms=200, explain=False,
+                 explain_sample_rate=1.0, repeated_threshold=10, enabled=True):
+        self.sample_rate = sample_rate
+        self.headers = headers
+        self.slow_query_seconds = slow_query_ms / 1000.0
+        self.explain = explain
+        self.explain_sample_rate = explain_sample_rate
+        self.repeated_threshold = repeated_threshold
+        self.enabled = enabled
+
+        self._endpoints = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def instrument(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # O início fica no contexto da execução (um por comando): um comando que
+        # falha não deixa resto para o próximo, como deixaria em ``conn.info``
+        if context is not None and has_request_context() and g.get('sql_queries') is not None:
+            context._sql_started_at = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_sql_started_at', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        queries = g.get('sql_queries') if has_request_context() else None
+        if queries is None:
+            return
+        queries.count += 1
+        queries.seconds += elapsed
+        queries.statements[statement] += 1
+        if elapsed >= self.slow_query_seconds:
+            queries.slow.append((conn.engine, statement, None if executemany else parameters, elapsed))
+
+    def start_request(self):
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            g.sql_queries = _RequestQueries()
+
+    def add_headers(self, response):
+        # Respostas transmitidas ainda executam consultas depois deste ponto:
+        # os cabeçalhos trazem só as que vieram antes do corpo
+        queries = g.get('sql_queries')
+        if queries is not None and self.headers:
+            timing = f'db;dur={queries.seconds * 1000:.2f};desc="{queries.count} consultas"'
+            existing = response.headers.get('Server-Timing')
+            response.headers['Server-Timing'] = f'{existing}, {timing}' if existing else timing
+            response.headers['X-Query-Count'] = str(queries.count)
+        return response
+
+    def finish_request(self, exc=None):
+        queries = g.pop('sql_queries', None)  # os EXPLAINs abaixo não entram na contagem
+        if queries is None:
+            return
+        route = f'{request.method} {request.path}'
+        endpoint = request.endpoint or 'desconhecido'
+
+        for engine, statement, parameters, elapsed in queries.slow:
+            message = f"Consulta lenta ({elapsed * 1000:.1f} ms) em {route} [{endpoint}]: {statement}"
+            if parameters and _is_select(statement):
+                # Só das leituras: INSERT/UPDATE levam hashes de senha, e-mails etc.
+                message += f"\nParâmetros: {repr(parameters)[:MAX_LOGGED_PARAMETERS]}"
+            plan = self._explain(engine, statement, parameters)
+            if plan:
+                message += '\nPlano:\n' + '\n'.join(f'  {line}' for line in plan)
+            logger.warning(message)
+
+        if queries.statements:
+            statement, repeated = queries.statements.most_common(1)[0]
+            if repeated >= self.repeated_threshold:
+                logger.warning(f"Possível N+1 em {route} [{endpoint}]: {repeated} execuções de {statement}")
+
+        with self._lock:
+            counters = self._endpoints[endpoint]
+            counters['requests'] += 1
+            counters['queries'] += queries.count
+            counters['db_ms'] += queries.seconds * 1000
+            counters['slow_queries'] += len(queries.slow)
+            counters['max_queries'] = max(counters['max_queries'], queries.count)
+
+    def _explain(self, engine, statement, parameters):
+        if not self.explain or not _is_select(statement):
+            return None
+        if self.explain_sample_rate < 1.0 and random.random() >= self.explain_sample_rate:
+            return None
+        try:
+            with engine.connect() as connection:
+                return explain_plan(connection, statement, parameters)
+        except Exception as e:
+            return [f'EXPLAIN falhou: {str(e)}']
+
+    def stats(self):
+        with self._lock:
+            endpoints = {name: dict(counters) for name, counters in self._endpoints.items()}
+        for counters in endpoints.values():
+            requests = counters['requests']
+            counters['avg_queries'] = round(counters['queries'] / requests, 2)
+            counters['avg_db_ms'] = round(counters['db_ms'] / requests, 2)
+            counters['db_ms'] = round(counters['db_ms'], 2)
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'slow_query_ms': self.slow_query_seconds * 1000,
+            'endpoints': dict(sorted(endpoints.items(), key=lambda item: -item[1]['avg_queries']))
+        }
+
+
+def init_sql_instrumentation(app):
+    """Registra os listeners nos engines do app (chamar depois de ``db.init_app``)"""
+    enabled = app.config.get('SQL_INSTRUMENTATION', False)
+    instrumentation = SqlInstrumentation(
+        sample_rate=app.config.get('SQL_SAMPLE_RATE', 1.0),
+        headers=app.config.get('SQL_TIMING_HEADERS', True),
+        slow_query_ms=app.config.get('SQL_SLOW_QUERY_MS', 200),
+        explain=app.config.get('SQL_SLOW_QUERY_EXPLAIN', False),
+        explain_sample_rate=app.config.get('SQL_EXPLAIN_SAMPLE_RATE', 1.0),
+        repeated_threshold=app.config.get('SQL_REPEATED_QUERY_THRESHOLD', 10),
+        enabled=enabled
+    )
+    app.extensions['sql_instrumentation'] = instrumentation
+    if not enabled:
+        return instrumentation
+
+    with app.app_context():
+        for engine in db.engines.values():
+            instrumentation.instrument(engine)
+    app.before_request(instrumentation.start_request)
+    app.after_request(instrumentation.add_headers)
+    app.teardown_request(instrumentation.finish_request)
+    return instrumentation
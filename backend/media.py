@@ -0,0 +1,232 @@
+import mimetypes
+import os
+import uuid
+from datetime import timezone
+from flask import current_app, request
+from werkzeug.http import http_date, parse_date, quote_etag
+from werkzeug.security import safe_join
+
+BLOCK_SIZE = 256 * 1024
+
+# Acima deste número de intervalos o Range é ignorado e o arquivo vai inteiro
+MAX_RANGES = 16
+
+
+class FileSegment:
+    """Iterável que lê ``length`` bytes a partir de ``start`` em blocos fixos"""
+
+    def __init__(self, f, start, length, block_size=BLOCK_SIZE):
+        self.f = f
+        self.start = start
+        self.length = length
+        self.block_size = block_size
+
+    def __iter__(self):
+        self.f.seek(self.start)
+        remaining = self.length
+        while remaining:
+            block = self.f.read(min(self.block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+    def close(self):
+        self.f.close()
+
+
+class MultipartRanges:
+    """Corpo ``multipart/byteranges`` para requisições com vários intervalos"""
+
+    def __init__(self, f, ranges, size, content_type, boundary):
+        self.f = f
+        self.parts = []
+        for start, stop in ranges:
+            header = (f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+                      f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+            self.parts.append((header, start, stop - start))
+        self.closing = f'\r\n--{boundary}--\r\n'.encode()
+
+    @property
+    def content_length(self):
+        return sum(len(header) + length for header, _, length in self.parts) + len(self.closing)
+
+    def __iter__(self):
+        for header, start, length in self.parts:
+            yield header
+            yield from FileSegment(self.f, start, length)
+        yield self.closing
+
+    def close(self):
+        self.f.close()
+
+
+def _file_body(f, start, length):
+    """Corpo de um intervalo contíguo do arquivo.
+
+    Se o servidor WSGI fornece ``wsgi.file_wrapper`` (gunicorn, por exemplo),
+    o arquivo vai para ele já posicionado em ``start``: o servidor envia com
+    ``os.sendfile`` a partir da posição atual, limitado pelo Content-Length, e
+    os bytes não passam pelo Python. Sem ele, lê em blocos de tamanho fixo.
+    """
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        f.seek(start)
+        return file_wrapper(f, BLOCK_SIZE)
+    return FileSegment(f, start, length)
+
+
+def parse_ranges(header, size):
+    """Intervalos ``[start, stop)`` satisfatíveis do cabeçalho Range, ordenados e
+    com sobreposições unidas.
+
+    Retorna None se o cabeçalho for inválido (deve ser ignorado) e lista
+    vazia se nenhum intervalo couber no arquivo (416). O parser do werkzeug
+    recusa intervalos fora de ordem ou sobrepostos, que os navegadores enviam.
+    """
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges = []
+    for item in spec.split(','):
+        first, dash, last = item.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if not first:
+                suffix = int(last)
+                start, stop = max(size - suffix, 0), size
+            else:
+                start = int(first)
+                stop = size if not last else min(int(last) + 1, size)
+                if last and int(last) < start:
+                    return None
+        except ValueError:
+            return None
+        if start < stop:
+            ranges.append((start, stop))
+
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _if_range_matches(etag, mtime):
+    """If-Range: o Range só vale se o validador do cliente ainda for o atual"""
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith('"'):
+        return value == etag
+    moment = parse_date(value)
+    return moment is not None and int(moment.timestamp()) == int(mtime)
+
+
+def _stored_file_source(filename):
+    """``files/<uuid>/<nome>``: arquivo lógico servido a partir do blob.
+
+    O conteúdo de um blob nunca muda, então o sha256 é o próprio ETag.
+    """
+    from storage import blob_path, find_stored_file
+
+    parts = filename.split('/')
+    if len(parts) != 3:
+        return None
+    stored = find_stored_file(parts[1])
+    if stored is None or stored.filename != parts[2]:
+        return None
+    path = blob_path(stored.blob_sha256)
+    if not os.path.isfile(path):
+        return None
+    mtime = stored.created_at.replace(tzinfo=timezone.utc).timestamp()
+    return path, quote_etag(stored.blob_sha256), mtime, stored.content_type
+
+
+def _legacy_source(filename):
+    """Arquivo gravado diretamente em ``UPLOAD_FOLDER`` antes dos blobs"""
+    upload_folder = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    path = safe_join(upload_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    top = os.path.relpath(path, upload_folder).split(os.sep)[0]
+    if top in ('.partial', 'blobs'):
+        return None
+    stat = os.stat(path)
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    return path, etag, stat.st_mtime, mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def send_upload(filename):
+    """Serve um arquivo enviado com Range (incluindo múltiplos intervalos),
+    validadores condicionais e cache longo.
+
+    Blobs nunca são sobrescritos e os nomes antigos são únicos
+    (timestamp/uuid), por isso a resposta é marcada como ``immutable``.
+    """
+    if filename.startswith('files/'):
+        source = _stored_file_source(filename)
+    else:
+        source = _legacy_source(filename)
+    if source is None:
+        return None
+
+    path, etag, mtime, content_type = source
+    upload_folder = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    size = os.path.getsize(path)
+
+    response = current_app.response_class(mimetype=content_type, direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(mtime)
+    response.headers['Cache-Control'] = f"public, max-age={current_app.config.get('UPLOAD_CACHE_MAX_AGE', 31536000)}, immutable"
+
+    # Validadores: If-None-Match tem prioridade sobre If-Modified-Since
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag.strip('"')):
+            response.status_code = 304
+            return response
+    elif request.if_modified_since and int(mtime) <= request.if_modified_since.timestamp():
+        response.status_code = 304
+        return response
+
+    accel_prefix = current_app.config.get('UPLOAD_ACCEL_REDIRECT')
+    if accel_prefix:
+        # O proxy (nginx) serve o arquivo, com Range e sendfile próprios
+        relative = os.path.relpath(path, upload_folder).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + relative
+        return response
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header and _if_range_matches(etag, mtime):
+        ranges = parse_ranges(range_header, size)
+        if ranges == []:
+            response.status_code = 416
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        if ranges is not None and len(ranges) > MAX_RANGES:
+            ranges = None
+
+    f = open(path, 'rb')
+    if ranges is None:
+        response.response = _file_body(f, 0, size)
+        response.content_length = size
+    elif len(ranges) == 1:
+        start, stop = ranges[0]
+        response.status_code = 206
+        response.response = _file_body(f, start, stop - start)
+        response.content_length = stop - start
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    else:
+        boundary = uuid.uuid4().hex
+        body = MultipartRanges(f, ranges, size, content_type, boundary)
+        response.status_code = 206
+        response.response = body
+        response.content_length = body.content_length
+        response.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    return response
@@ -1,17 +1,109 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 from datetime import datetime
 import uuid
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hash_password, verify_hash
+from routing import RoutingSession
 
 # Será inicializado no app.py
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
-# Tabelas de relacionamento many-to-many
-course_enrollments = db.Table('course_enrollments',
-    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
-    db.Column('course_id', db.Integer, db.ForeignKey('courses.id'), primary_key=True),
-    db.Column('enrolled_at', db.DateTime, default=datetime.utcnow)
-)
+class Enrollment(db.Model):
+    """Matrícula de um aluno em um curso, com o progresso consolidado.
+
+    Os contadores são mantidos incrementalmente pelas rotas de progresso
+    (ver ``apply_progress``) e podem ser reconstruídos com
+    ``flask rebuild-progress``.
+    """
+    __tablename__ = 'course_enrollments'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), primary_key=True)
+    enrolled_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_lessons = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_watch_time = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # em segundos
+    last_activity_at = db.Column(db.DateTime)
+    
+    course = db.relationship('Course', overlaps='enrolled_courses,students')
+    
+    # Lista de alunos do professor ordenada por progresso (ver ``roster.py``)
+    __table_args__ = (db.Index('ix_enrollments_course_progress', 'course_id', 'completed_lessons', 'user_id'),)
+    
+    @classmethod
+    def exists(cls, user_id, course_id):
+        """Verifica a matrícula pela chave primária, sem carregar a lista de cursos"""
+        return db.session.query(
+            db.exists().where(cls.user_id == user_id, cls.course_id == course_id)
+        ).scalar()
+    
+    @classmethod
+    def for_user(cls, user_id):
+        """Matrículas do usuário com os cursos carregados na mesma consulta"""
+        return cls.query.filter_by(user_id=user_id).join(cls.course).options(
+            db.contains_eager(cls.course)
+        ).order_by(cls.enrolled_at).all()
+    
+    @classmethod
+    def apply_progress(cls, user_id, course_id, completed_delta=0, watch_time_delta=0):
+        """Aplica a variação de uma atualização de progresso na matrícula (sem commit)"""
+        return cls.query.filter_by(user_id=user_id, course_id=course_id).update({
+            cls.completed_lessons: cls.completed_lessons + completed_delta,
+            cls.total_watch_time: cls.total_watch_time + watch_time_delta,
+            cls.last_activity_at: datetime.utcnow()
+        }, synchronize_session=False)
+    
+    @classmethod
+    def rebuild(cls, course_id=None):
+        """Recalcula os contadores a partir de student_progress (sem commit)"""
+        totals = db.session.query(
+            StudentProgress.user_id,
+            Lesson.course_id,
+            db.func.count(StudentProgress.id).filter(StudentProgress.is_completed.is_(True)),
+            db.func.coalesce(db.func.sum(StudentProgress.watch_time), 0),
+            db.func.max(StudentProgress.updated_at)
+        ).join(Lesson, Lesson.id == StudentProgress.lesson_id).group_by(
+            StudentProgress.user_id, Lesson.course_id
+        )
+        enrollments = cls.query
+        if course_id is not None:
+            totals = totals.filter(Lesson.course_id == course_id)
+            enrollments = enrollments.filter_by(course_id=course_id)
+        
+        rollup = {(user_id, c_id): (completed, watch_time, last_activity)
+                  for user_id, c_id, completed, watch_time, last_activity in totals}
+        
+        updated = 0
+        for enrollment in enrollments:
+            completed, watch_time, last_activity = rollup.get(
+                (enrollment.user_id, enrollment.course_id), (0, 0, None))
+            enrollment.completed_lessons = completed
+            enrollment.total_watch_time = watch_time
+            enrollment.last_activity_at = last_activity
+            updated += 1
+        return updated
+    
+    def progress_dict(self, total_lessons):
+        percentage = int((self.completed_lessons / total_lessons) * 100) if total_lessons > 0 else 0
+        return {
+            'completed_lessons': self.completed_lessons,
+            'total_lessons': total_lessons,
+            'percentage': min(percentage, 100),
+            'total_watch_time': self.total_watch_time,
+            'last_activity_at': self.last_activity_at.isoformat() if self.last_activity_at else None
+        }
+
+# Tabela de relacionamento many-to-many (mantida para consultas diretas)
+course_enrollments = Enrollment.__table__
+
+# Tamanho servido em ``avatar_url``/``thumbnail_url`` quando já existem versões
+# reduzidas; as demais ficam em ``*_variants`` para o cliente montar o srcset
+DISPLAY_VARIANT_SIZE = '256'
+
+def variant_url(variants, original_url):
+    if variants and DISPLAY_VARIANT_SIZE in variants:
+        return variants[DISPLAY_VARIANT_SIZE]
+    return original_url
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -23,6 +115,7 @@ class User(db.Model):
     password = db.Column(db.String(128), nullable=False)
     role = db.Column(db.String(20), default='student')  # student, teacher, admin
     avatar_url = db.Column(db.String(255))
+    avatar_variants = db.Column(db.JSON)  # {"64": url, "256": url, ...} (ver images.py)
     bio = db.Column(db.Text)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -31,23 +124,27 @@ class User(db.Model):
     # Relacionamentos
     created_courses = db.relationship('Course', backref='creator', lazy=True)
     enrolled_courses = db.relationship('Course', secondary=course_enrollments, 
-                                     backref=db.backref('students', lazy='dynamic'))
+                                     backref=db.backref('students', lazy='dynamic'),
+                                     overlaps='enrollments')
+    enrollments = db.relationship('Enrollment', lazy='dynamic', overlaps='enrolled_courses,students',
+                                  backref=db.backref('student', overlaps='enrolled_courses,students'))
     comments = db.relationship('Comment', backref='author', lazy=True)
     ratings = db.relationship('Rating', backref='user', lazy=True)
     progress = db.relationship('StudentProgress', backref='student', lazy=True)
     
     def set_password(self, password):
-        self.password = generate_password_hash(password)
+        self.password = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return verify_hash(self.password, password)
     
     def to_dict(self, include_email=False):
         data = {
             'uuid': self.uuid,
             'name': self.name,
             'role': self.role,
-            'avatar_url': self.avatar_url,
+            'avatar_url': variant_url(self.avatar_variants, self.avatar_url),
+            'avatar_variants': self.avatar_variants,
             'bio': self.bio,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
@@ -66,6 +163,7 @@ class Course(db.Model):
     level = db.Column(db.String(20), default='beginner')  # beginner, intermediate, advanced
     price = db.Column(db.Float, default=0.0)
     thumbnail_url = db.Column(db.String(255))
+    thumbnail_variants = db.Column(db.JSON)  # {"64": url, "256": url, ...} (ver images.py)
     is_published = db.Column(db.Boolean, default=False)
     is_featured = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -75,24 +173,43 @@ class Course(db.Model):
     # Chave estrangeira
     creator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
+    # Catálogo publicado em ordem de criação e cursos de cada professor
+    __table_args__ = (
+        db.Index('ix_courses_published_created', 'is_published', 'created_at', 'id'),
+        db.Index('ix_courses_creator_created', 'creator_id', 'created_at'),
+    )
+    
     # Relacionamentos
     lessons = db.relationship('Lesson', backref='course', lazy=True, 
                             cascade='all, delete-orphan', order_by='Lesson.order_index')
     comments = db.relationship('Comment', backref='course', lazy=True)
     ratings = db.relationship('Rating', backref='course', lazy=True)
     
+    stats = db.relationship('CourseStats', uselist=False, lazy='joined',
+                            cascade='all, delete-orphan', backref='course')
+    
+    # Os getters abaixo leem as estatísticas consolidadas (CourseStats) e só
+    # recorrem às tabelas base quando o curso ainda não tem linha de estatísticas
     def get_average_rating(self):
+        if self.stats:
+            return self.stats.get_average_rating()
         if not self.ratings:
             return 0
         return sum(rating.value for rating in self.ratings) / len(self.ratings)
     
     def get_total_duration(self):
+        if self.stats:
+            return self.stats.total_duration
         return sum(lesson.video_duration for lesson in self.lessons if lesson.video_duration)
     
     def get_lesson_count(self):
+        if self.stats:
+            return self.stats.lesson_count
         return len(self.lessons)
     
     def get_student_count(self):
+        if self.stats:
+            return self.stats.student_count
         return self.students.count()
     
     def to_dict(self, include_lessons=False, include_stats=False):
@@ -103,7 +220,8 @@ class Course(db.Model):
             'category': self.category,
             'level': self.level,
             'price': self.price,
-            'thumbnail_url': self.thumbnail_url,
+            'thumbnail_url': variant_url(self.thumbnail_variants, self.thumbnail_url),
+            'thumbnail_variants': self.thumbnail_variants,
             'is_published': self.is_published,
             'is_featured': self.is_featured,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -121,9 +239,164 @@ class Course(db.Model):
                 'lesson_count': self.get_lesson_count(),
                 'student_count': self.get_student_count()
             }
+            if self.stats:
+                data['stats']['rating_count'] = self.stats.rating_count
+                data['stats']['rating_histogram'] = self.stats.get_histogram()
         
         return data
 
+class CourseStats(db.Model):
+    """Estatísticas de um curso mantidas incrementalmente.
+
+    Atualizadas na mesma transação pelos eventos de Rating, Enrollment e
+    Lesson (ver final do módulo). ``flask reconcile-stats`` corrige desvios.
+    """
+    __tablename__ = 'course_stats'
+    
+    RATING_VALUES = (1, 2, 3, 4, 5)
+    
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), primary_key=True)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+    student_count = db.Column(db.Integer, nullable=False, default=0)
+    lesson_count = db.Column(db.Integer, nullable=False, default=0)
+    total_duration = db.Column(db.Integer, nullable=False, default=0)  # em segundos
+    avg_rating = db.Column(db.Float, nullable=False, default=0, server_default='0')  # ordenação do catálogo
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Ordenações ?sort=popular e ?sort=rating do catálogo (ver ``pagination.py``)
+    __table_args__ = (
+        db.Index('ix_course_stats_popular', 'student_count', 'course_id'),
+        db.Index('ix_course_stats_rating', 'avg_rating', 'course_id'),
+    )
+    
+    COUNTER_COLUMNS = ('rating_sum', 'rating_count', 'rating_1', 'rating_2', 'rating_3',
+                       'rating_4', 'rating_5', 'student_count', 'lesson_count', 'total_duration')
+    
+    def get_average_rating(self):
+        if not self.rating_count:
+            return 0
+        return self.rating_sum / self.rating_count
+    
+    def get_histogram(self):
+        return {str(value): getattr(self, f'rating_{value}') for value in self.RATING_VALUES}
+    
+    @classmethod
+    def compute(cls, connection, course_ids):
+        """Calcula as estatísticas a partir das tabelas base, em três consultas agrupadas"""
+        stats = {course_id: dict.fromkeys(cls.COUNTER_COLUMNS, 0) for course_id in course_ids}
+        if not stats:
+            return stats
+        
+        ratings = db.select(
+            Rating.course_id,
+            db.func.sum(Rating.value),
+            db.func.count(Rating.id),
+            *[db.func.count(Rating.id).filter(Rating.value == value) for value in cls.RATING_VALUES]
+        ).where(Rating.course_id.in_(course_ids)).group_by(Rating.course_id)
+        for course_id, rating_sum, rating_count, *histogram in connection.execute(ratings):
+            stats[course_id].update(rating_sum=rating_sum or 0, rating_count=rating_count)
+            for value, count in zip(cls.RATING_VALUES, histogram):
+                stats[course_id][f'rating_{value}'] = count
+        
+        lessons = db.select(
+            Lesson.course_id,
+            db.func.count(Lesson.id),
+            db.func.coalesce(db.func.sum(Lesson.video_duration), 0)
+        ).where(Lesson.course_id.in_(course_ids)).group_by(Lesson.course_id)
+        for course_id, lesson_count, total_duration in connection.execute(lessons):
+            stats[course_id].update(lesson_count=lesson_count, total_duration=total_duration)
+        
+        students = db.select(
+            Enrollment.course_id,
+            db.func.count()
+        ).where(Enrollment.course_id.in_(course_ids)).group_by(Enrollment.course_id)
+        for course_id, student_count in connection.execute(students):
+            stats[course_id]['student_count'] = student_count
+        
+        for values in stats.values():
+            values['avg_rating'] = values['rating_sum'] / values['rating_count'] if values['rating_count'] else 0.0
+        return stats
+    
+    @classmethod
+    def apply(cls, connection, course_id, **deltas):
+        """Soma as variações na linha do curso, criando-a a partir das tabelas base se faltar"""
+        table = cls.__table__
+        values = {name: table.c[name] + delta for name, delta in deltas.items()}
+        if 'rating_sum' in deltas or 'rating_count' in deltas:
+            rating_sum = table.c.rating_sum + deltas.get('rating_sum', 0)
+            rating_count = table.c.rating_count + deltas.get('rating_count', 0)
+            values['avg_rating'] = db.case((rating_count > 0, rating_sum * 1.0 / rating_count), else_=0.0)
+        result = connection.execute(
+            table.update().where(table.c.course_id == course_id).values(
+                updated_at=datetime.utcnow(), **values
+            )
+        )
+        if result.rowcount == 0:
+            # Curso criado neste flush (os demais são semeados no before_flush):
+            # as tabelas base já contêm a alteração corrente (evento pós-flush)
+            values = cls.compute(connection, [course_id])[course_id]
+            connection.execute(table.insert().values(
+                course_id=course_id, updated_at=datetime.utcnow(), **values
+            ))
+    
+    @classmethod
+    def seed(cls, connection, course_ids):
+        """Cria, a partir das tabelas base, as linhas que faltam para ``course_ids``"""
+        table = cls.__table__
+        existing = set(connection.execute(
+            db.select(table.c.course_id).where(table.c.course_id.in_(course_ids))
+        ).scalars())
+        missing = [course_id for course_id in course_ids if course_id not in existing]
+        for course_id, values in cls.compute(connection, missing).items():
+            connection.execute(table.insert().values(
+                course_id=course_id, updated_at=datetime.utcnow(), **values
+            ))
+        return len(missing)
+    
+    @classmethod
+    def backfill(cls, chunk_size=500):
+        """Cria as estatísticas dos cursos que ainda não têm (bancos de versões anteriores)"""
+        missing = [row.id for row in db.session.query(Course.id).outerjoin(
+            cls, cls.course_id == Course.id
+        ).filter(cls.course_id.is_(None))]
+        for start in range(0, len(missing), chunk_size):
+            cls.seed(db.session.connection(), missing[start:start + chunk_size])
+        # Coluna avg_rating recém-adicionada: as linhas antigas vêm com 0
+        db.session.execute(cls.__table__.update().where(
+            cls.rating_count > 0, cls.avg_rating == 0
+        ).values(avg_rating=cls.rating_sum * 1.0 / cls.rating_count))
+        db.session.commit()
+        return len(missing)
+    
+    @classmethod
+    def reconcile(cls, course_id=None):
+        """Compara com as tabelas base e corrige divergências (sem commit)"""
+        course_query = db.session.query(Course.id)
+        if course_id is not None:
+            course_query = course_query.filter(Course.id == course_id)
+        course_ids = [row.id for row in course_query]
+        
+        expected = cls.compute(db.session.connection(), course_ids)
+        current = {row.course_id: row for row in cls.query.filter(cls.course_id.in_(course_ids))}
+        
+        repaired = 0
+        for c_id, values in expected.items():
+            row = current.get(c_id)
+            if row is None:
+                db.session.add(cls(course_id=c_id, **values))
+                repaired += 1
+            elif any(getattr(row, name) != value for name, value in values.items()):
+                for name, value in values.items():
+                    setattr(row, name, value)
+                repaired += 1
+        return repaired
+
 class Lesson(db.Model):
     __tablename__ = 'lessons'
     
@@ -142,6 +415,8 @@ class Lesson(db.Model):
     # Chave estrangeira
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
     
+    __table_args__ = (db.Index('ix_lessons_course_order', 'course_id', 'order_index'),)
+    
     # Relacionamentos
     progress = db.relationship('StudentProgress', backref='lesson', lazy=True)
     
@@ -160,6 +435,10 @@ class Lesson(db.Model):
         }
 
 class Comment(db.Model):
+    """Comentário de um curso. Respostas guardam a raiz da conversa (``root_id``)
+    e a profundidade, para que uma página de conversas seja lida por índice
+    sem percorrer a árvore (ver ``threads.py``).
+    """
     __tablename__ = 'comments'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -172,9 +451,20 @@ class Comment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
     parent_id = db.Column(db.Integer, db.ForeignKey('comments.id'))  # Para respostas
+    root_id = db.Column(db.Integer, db.ForeignKey('comments.id'))  # Comentário principal da conversa (nulo nele próprio)
+    depth = db.Column(db.Integer, default=0, server_default='0')  # 0 = comentário principal
+    
+    # Índices das conversas: página de comentários principais de um curso e
+    # respostas de cada conversa em ordem cronológica
+    __table_args__ = (
+        db.Index('ix_comments_course_threads', 'course_id', 'root_id', 'created_at', 'id'),
+        db.Index('ix_comments_root_replies', 'root_id', 'created_at', 'id'),
+        db.Index('ix_comments_course_parent', 'course_id', 'parent_id', 'created_at'),
+    )
     
     # Relacionamentos
-    replies = db.relationship('Comment', backref=db.backref('parent', remote_side=[id]))
+    replies = db.relationship('Comment', foreign_keys=[parent_id],
+                              backref=db.backref('parent', remote_side=[id]))
     
     def to_dict(self, include_replies=True):
         data = {
@@ -220,6 +510,7 @@ class StudentProgress(db.Model):
     is_completed = db.Column(db.Boolean, default=False)
     watch_time = db.Column(db.Integer, default=0)  # tempo assistido em segundos
     completed_at = db.Column(db.DateTime)
+    client_updated_at = db.Column(db.DateTime)  # momento da medição de watch_time no cliente
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -227,8 +518,11 @@ class StudentProgress(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     lesson_id = db.Column(db.Integer, db.ForeignKey('lessons.id'), nullable=False)
     
-    # Índice único
-    __table_args__ = (db.UniqueConstraint('user_id', 'lesson_id', name='unique_user_lesson_progress'),)
+    # Índice único e aulas concluídas de cada aluno
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'lesson_id', name='unique_user_lesson_progress'),
+        db.Index('ix_student_progress_user_completed', 'user_id', 'is_completed', 'lesson_id'),
+    )
     
     def to_dict(self):
         return {
@@ -251,6 +545,9 @@ class Analytics(db.Model):
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'))
     lesson_id = db.Column(db.Integer, db.ForeignKey('lessons.id'))
     
+    # Consultas por período (dashboard e limpeza de eventos antigos)
+    __table_args__ = (db.Index('ix_analytics_created_type', 'created_at', 'event_type'),)
+    
     def to_dict(self):
         return {
             'event_type': self.event_type,
@@ -260,3 +557,217 @@ class Analytics(db.Model):
             'course_id': self.course_id,
             'lesson_id': self.lesson_id
         }
+
+class AnalyticsRollup(db.Model):
+    """Contagem de eventos por período (hora ou dia), tipo, curso e aula.
+
+    Alimentada incrementalmente a partir de ``analytics`` por
+    ``analytics.rollup_analytics``. ``course_id``/``lesson_id`` valem 0 quando o
+    evento não tem curso/aula, para que a chave única funcione no upsert.
+    """
+    __tablename__ = 'analytics_rollups'
+    
+    BUCKETS = ('hour', 'day')
+    
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.String(4), nullable=False)  # hour, day
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    course_id = db.Column(db.Integer, nullable=False, default=0)
+    lesson_id = db.Column(db.Integer, nullable=False, default=0)
+    count = db.Column(db.Float, nullable=False, default=0)  # reescalado pela amostragem
+    
+    __table_args__ = (
+        db.UniqueConstraint('bucket', 'bucket_start', 'event_type', 'course_id', 'lesson_id',
+                            name='unique_analytics_rollup'),
+        db.Index('ix_analytics_rollups_course_series', 'bucket', 'course_id', 'event_type', 'bucket_start'),
+    )
+    
+    @staticmethod
+    def truncate(moment, bucket):
+        if bucket == 'day':
+            return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        return moment.replace(minute=0, second=0, microsecond=0)
+
+class AnalyticsRollupState(db.Model):
+    """Marca d'água (``created_at`` e id do último evento processado) de cada job de agregação"""
+    __tablename__ = 'analytics_rollup_state'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
+    last_event_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UploadSession(db.Model):
+    """Upload em partes retomável (ver ``uploads.py``).
+
+    ``received`` é quantos bytes contíguos já estão no arquivo parcial; o
+    cliente envia cada parte a partir desse deslocamento e, após uma queda,
+    consulta o estado para continuar de onde parou.
+    """
+    __tablename__ = 'upload_sessions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    uuid = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(20), nullable=False, default='video')  # video, material, avatar
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256 = db.Column(db.String(64))  # hash do arquivo completo informado pelo cliente (opcional)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, complete
+    file_url = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'upload_id': self.uuid,
+            'filename': self.filename,
+            'type': self.file_type,
+            'size': self.total_size,
+            'offset': self.received,
+            'status': self.status,
+            'file_url': self.file_url,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class Blob(db.Model):
+    """Conteúdo armazenado uma única vez, endereçado pelo SHA-256 (ver ``storage.py``).
+
+    ``ref_count`` é o número de arquivos lógicos (``StoredFile``) que apontam
+    para o blob; com zero o conteúdo pode ser removido.
+    """
+    __tablename__ = 'blobs'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StoredFile(db.Model):
+    """Arquivo enviado por um usuário: nome e tipo lógicos apontando para um blob"""
+    __tablename__ = 'stored_files'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    uuid = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blobs.sha256'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(20), nullable=False, default='material')  # video, material, avatar
+    content_type = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    blob = db.relationship('Blob')
+    
+    @property
+    def url(self):
+        return f"/uploads/files/{self.uuid}/{self.filename}"
+    
+    def to_dict(self):
+        return {
+            'uuid': self.uuid,
+            'filename': self.filename,
+            'type': self.file_type,
+            'content_type': self.content_type,
+            'size': self.blob.size if self.blob else None,
+            'sha256': self.blob_sha256,
+            'file_url': self.url,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class ImageVariant(db.Model):
+    """Versão reduzida de uma imagem, gerada uma vez por conteúdo (blob)"""
+    __tablename__ = 'image_variants'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blobs.sha256'), nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # lado máximo pedido
+    format = db.Column(db.String(10), nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    path = db.Column(db.String(255), nullable=False)  # relativo a UPLOAD_FOLDER
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('blob_sha256', 'size', 'format', name='unique_blob_variant'),)
+    
+    @property
+    def url(self):
+        return f"/uploads/{self.path}"
+
+# ==================== MANUTENÇÃO DE CourseStats ====================
+
+def _attribute_change(target, name):
+    """Retorna (valor_antigo, valor_novo) de um atributo alterado no flush"""
+    history = inspect(target).attrs[name].history
+    old = history.deleted[0] if history.deleted else getattr(target, name)
+    return old, getattr(target, name)
+
+def _rating_deltas(value, sign):
+    return {'rating_sum': sign * value, 'rating_count': sign, f'rating_{value}': sign}
+
+@event.listens_for(Session, 'before_flush')
+def _seed_course_stats(session, flush_context, instances):
+    """Cria as linhas ausentes antes de o flush gravar as alterações.
+
+    Calculada depois, a linha já incluiria as linhas deste flush e os eventos
+    abaixo somariam as variações delas uma segunda vez.
+    """
+    course_ids = set()
+    for target in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(target, (Rating, Enrollment, Lesson)):
+            course_ids.add(target.course_id)
+            course_ids.update(inspect(target).attrs.course_id.history.deleted)
+    course_ids.discard(None)
+    if course_ids:
+        CourseStats.seed(session.connection(), sorted(course_ids))
+
+@event.listens_for(Course, 'after_insert')
+def _course_inserted(mapper, connection, target):
+    CourseStats.apply(connection, target.id)
+
+@event.listens_for(Rating, 'after_insert')
+def _rating_inserted(mapper, connection, target):
+    CourseStats.apply(connection, target.course_id, **_rating_deltas(target.value, 1))
+
+@event.listens_for(Rating, 'after_update')
+def _rating_updated(mapper, connection, target):
+    old_value, new_value = _attribute_change(target, 'value')
+    if old_value == new_value:
+        return
+    CourseStats.apply(connection, target.course_id, rating_sum=new_value - old_value,
+                      **{f'rating_{old_value}': -1},
+                      **{f'rating_{new_value}': 1})
+
+@event.listens_for(Rating, 'after_delete')
+def _rating_deleted(mapper, connection, target):
+    CourseStats.apply(connection, target.course_id, **_rating_deltas(target.value, -1))
+
+@event.listens_for(Enrollment, 'after_insert')
+def _enrollment_inserted(mapper, connection, target):
+    CourseStats.apply(connection, target.course_id, student_count=1)
+
+@event.listens_for(Enrollment, 'after_delete')
+def _enrollment_deleted(mapper, connection, target):
+    CourseStats.apply(connection, target.course_id, student_count=-1)
+
+@event.listens_for(Lesson, 'after_insert')
+def _lesson_inserted(mapper, connection, target):
+    CourseStats.apply(connection, target.course_id, lesson_count=1,
+                      total_duration=target.video_duration or 0)
+
+@event.listens_for(Lesson, 'after_update')
+def _lesson_updated(mapper, connection, target):
+    old_course_id, new_course_id = _attribute_change(target, 'course_id')
+    old_duration, new_duration = _attribute_change(target, 'video_duration')
+    old_duration, new_duration = old_duration or 0, new_duration or 0
+    if old_course_id != new_course_id:
+        CourseStats.apply(connection, old_course_id, lesson_count=-1, total_duration=-old_duration)
+        CourseStats.apply(connection, new_course_id, lesson_count=1, total_duration=new_duration)
+    elif old_duration != new_duration:
+        CourseStats.apply(connection, new_course_id, total_duration=new_duration - old_duration)
+
+@event.listens_for(Lesson, 'after_delete')
+def _lesson_deleted(mapper, connection, target):
+    CourseStats.apply(connection, target.course_id, lesson_count=-1,
+                      total_duration=-(target.video_duration or 0))
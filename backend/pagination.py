@@ -0,0 +1,208 @@
+import base64
+import json
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import Boolean, desc, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from models import Course, CourseStats
+from cache import TTLCache
+
+
+class InvalidCursor(ValueError):
+    """Cursor de paginação malformado ou de outra ordenação"""
+
+
+# Chaves de ordenação do catálogo: nome -> (coluna, tipo do valor no cursor, id).
+# Todas são decrescentes e desempatadas pelo id do curso; cada par (coluna, id)
+# tem um índice, então a página é lida na ordem do índice, sem ordenar o catálogo.
+COURSE_SORTS = {
+    'recent': (Course.created_at, datetime, Course.id),
+    'popular': (CourseStats.student_count, int, CourseStats.course_id),
+    'rating': (CourseStats.avg_rating, float, CourseStats.course_id),
+}
+
+_totals = TTLCache(ttl=30, maxsize=2048)
+
+
+class likely(FunctionElement):
+    """Condição quase sempre verdadeira: ``likely()`` no SQLite, a própria condição nos demais"""
+    type = Boolean()
+    inherit_cache = True
+
+
+@compiles(likely)
+def _compile_likely(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(likely, 'sqlite')
+def _compile_likely_sqlite(element, compiler, **kw):
+    return f'likely({compiler.process(element.clauses, **kw)})'
+
+
+def published_filter(sort_by):
+    """Filtro de cursos publicados do catálogo para a ordenação ``sort_by``.
+
+    Nas ordenações por ``course_stats`` o SQLite preferiria a igualdade em
+    ``ix_courses_published_created`` e ordenaria todo o catálogo; marcada como
+    provável, a condição deixa a busca partir do índice da ordenação.
+    """
+    if sort_by in ('popular', 'rating'):
+        return likely(Course.is_published == True)
+    return Course.is_published == True
+
+
+def _encode_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _decode_value(value, value_type):
+    if value_type is datetime:
+        return datetime.fromisoformat(value)
+    return value_type(value)
+
+
+def encode_cursor(sort_by, values):
+    payload = json.dumps({'s': sort_by, 'k': [_encode_value(v) for v in values]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_keyset(cursor, sort_by, value_types):
+    """Valores da chave de um cursor gerado por ``encode_cursor`` para ``sort_by``,
+    convertidos para ``value_types``; None para a primeira página.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload['s'] != sort_by:
+            raise InvalidCursor('Cursor gerado para outra ordenação')
+        values = payload['k']
+        if len(values) != len(value_types):
+            raise InvalidCursor('Cursor inválido')
+        return tuple(_decode_value(value, value_type) for value, value_type in zip(values, value_types))
+    except InvalidCursor:
+        raise
+    except (ValueError, KeyError, TypeError, json.JSONDecodeError) as e:
+        raise InvalidCursor('Cursor inválido') from e
+
+
+def decode_cursor(cursor, sort_by):
+    """Retorna os valores da chave do cursor do catálogo, ou None para a primeira página"""
+    if sort_by not in COURSE_SORTS:
+        raise InvalidCursor('Cursor gerado para outra ordenação')
+    return decode_keyset(cursor, sort_by, (COURSE_SORTS[sort_by][1], int))
+
+
+def sort_courses(query, sort_by):
+    """Aplica a ordenação do catálogo (decrescente, desempate por id)"""
+    expression, _, id_column = COURSE_SORTS[sort_by]
+    if sort_by != 'recent':
+        # Todo curso tem linha em course_stats (criada com o curso ou por
+        # ``CourseStats.backfill``); o join interno deixa a busca partir do índice
+        query = query.join(CourseStats, CourseStats.course_id == Course.id)
+    return query.order_by(desc(expression), desc(id_column))
+
+
+def keyset_page(query, sort_by, cursor, per_page):
+    """Página do catálogo por cursor (keyset) em vez de OFFSET.
+
+    A consulta deve vir filtrada e sem ordenação; o custo de qualquer página é
+    o de uma busca indexada mais ``per_page + 1`` linhas. Retorna
+    ``(items, next_cursor)``; os itens têm o mesmo formato da consulta original.
+    """
+    expression, _, id_column = COURSE_SORTS[sort_by]
+    after = decode_cursor(cursor, sort_by)
+
+    query = sort_courses(query, sort_by).add_columns(
+        expression.label('_cursor_key'), id_column.label('_cursor_id')
+    )
+    if after is not None:
+        query = query.filter(tuple_(expression, id_column) < tuple_(*after))
+
+    rows = query.limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    next_cursor = None
+    if has_next:
+        last = rows[-1]
+        next_cursor = encode_cursor(sort_by, (last._cursor_key, last._cursor_id))
+
+    items = [row[0] if len(row) == 3 else row for row in rows]
+    return items, next_cursor
+
+
+def offset_page(query, page, per_page):
+    """Página por OFFSET sem COUNT: busca uma linha extra para saber se há próxima"""
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return rows[:per_page], len(rows) > per_page
+
+
+def cached_total(query, filters):
+    """Total de resultados do filtro, reaproveitado por alguns segundos"""
+    key = tuple(sorted(filters.items()))
+    total = _totals.get(key)
+    if total is None:
+        total = query.order_by(None).count()
+        _totals.set(key, total, ttl=current_app.config.get('CATALOG_TOTAL_TTL', 30))
+    return total
+
+
+# Parâmetros que não alteram o conjunto de resultados (ficam fora da chave do total)
+PAGINATION_ARGS = {'page', 'per_page', 'cursor', 'sort', 'total'}
+
+# Parâmetros lidos pela listagem do catálogo: os únicos que entram na chave do cache
+CATALOG_ARGS = PAGINATION_ARGS | {'category', 'level', 'search', 'featured', 'creator'}
+
+
+def paginate_catalog(query, args, rank=None):
+    """Ordena e pagina a consulta do catálogo conforme os parâmetros da requisição.
+
+    ``?cursor=`` (vazio na primeira página) ativa a paginação por cursor;
+    sem ele, mantém ``?page=`` com OFFSET. ``?total=false`` dispensa a contagem.
+    ``rank`` é a expressão de relevância devolvida por ``search.apply_search``.
+    Retorna ``(items, pagination)``.
+    """
+    page = max(args.get('page', 1, type=int), 1)
+    per_page = max(min(args.get('per_page', 10, type=int), 50), 1)  # máximo 50 por página
+    cursor = args.get('cursor')
+    include_total = args.get('total', 'true').lower() != 'false'
+
+    sort_by = args.get('sort', 'relevance' if rank is not None else 'recent')
+    if sort_by not in COURSE_SORTS and not (sort_by == 'relevance' and rank is not None):
+        sort_by = 'recent'
+
+    total = None
+    if include_total:
+        filters = {key: value for key, value in args.items() if key not in PAGINATION_ARGS}
+        total = cached_total(query, filters)
+
+    if cursor is not None:
+        if sort_by == 'relevance':
+            raise InvalidCursor('Paginação por cursor não suporta ordenação por relevância')
+        items, next_cursor = keyset_page(query, sort_by, cursor, per_page)
+        return items, {
+            'per_page': per_page,
+            'sort': sort_by,
+            'total': total,
+            'next_cursor': next_cursor,
+            'has_next': next_cursor is not None
+        }
+
+    if sort_by == 'relevance':
+        query = query.order_by(rank, desc(Course.id))
+    else:
+        query = sort_courses(query, sort_by)
+    items, has_next = offset_page(query, page, per_page)
+    return items, {
+        'page': page,
+        'pages': -(-total // per_page) if total is not None else None,
+        'per_page': per_page,
+        'sort': sort_by,
+        'total': total,
+        'has_next': has_next,
+        'has_prev': page > 1
+    }
@@ -0,0 +1,122 @@
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+
+class HasherBusy(Exception):
+    """Fila do pool de hashing cheia ou tempo de espera esgotado"""
+
+
+def hash_method(stored_hash):
+    """Parâmetros de um hash do werkzeug (ex.: ``pbkdf2:sha256:600000``)"""
+    return stored_hash.split('$', 1)[0] if stored_hash and '$' in stored_hash else None
+
+
+@lru_cache(maxsize=None)
+def stored_method(method):
+    """Parâmetros como o werkzeug os grava no hash (``scrypt`` vira ``scrypt:32768:8:1``)"""
+    return hash_method(generate_password_hash('', method))
+
+
+class PasswordHasher:
+    """Hash e verificação de senhas em um pool limitado de threads.
+
+    O PBKDF2 do hashlib libera o GIL, então as threads do pool rodam em
+    paralelo; o limite de ``workers`` impede que um pico de logins ocupe todas
+    as threads da aplicação com CPU. Com ``max_pending`` operações já em
+    andamento ou na fila, novas chamadas falham na hora com ``HasherBusy``
+    em vez de acumular latência. ``workers=0`` executa na própria thread.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=4, max_pending=64, timeout=10.0):
+        self.method = method
+        self.stored_method = stored_method(method)
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending) if workers else None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hasher') if workers else None
+
+    def _run(self, func, *args):
+        if self._executor is None:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('Fila de hashing de senhas cheia')
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy('Tempo esgotado aguardando o hashing de senha')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        if not stored_hash:
+            return False
+        return self._run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """Indica se o hash foi gerado com parâmetros diferentes dos configurados"""
+        return hash_method(stored_hash) != self.stored_method
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def init_password_hasher(app):
+    """Cria o pool de hashing conforme PASSWORD_HASH_* da configuração"""
+    hasher = PasswordHasher(
+        method=app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 4),
+        max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING', 64),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10.0)
+    )
+    app.extensions['password_hasher'] = hasher
+    return hasher
+
+
+def _hasher():
+    if has_app_context() and 'password_hasher' in current_app.extensions:
+        return current_app.extensions['password_hasher']
+    return PasswordHasher(workers=0)
+
+
+def hash_password(password):
+    return _hasher().hash(password)
+
+
+def verify_hash(stored_hash, password):
+    return _hasher().verify(stored_hash, password)
+
+
+def verify_password(user, password):
+    """Confere a senha do usuário e atualiza o hash se os parâmetros mudaram.
+
+    Encerra a transação de leitura antes do hashing para que a conexão volte
+    ao pool durante a parte lenta da requisição; o novo hash fica pendente na
+    sessão e quem chamou decide o commit.
+    """
+    from models import db
+
+    hasher = _hasher()
+    stored_hash = user.password
+    db.session.commit()
+    if not hasher.verify(stored_hash, password):
+        return False
+    if hasher.needs_rehash(stored_hash):
+        new_hash = hasher.hash(password)
+        # Recarrega antes de alterar: o commit acima expirou a instância
+        db.session.refresh(user)
+        user.password = new_hash
+    return True
@@ -0,0 +1,423 @@
+import atexit
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import bindparam, tuple_
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Lesson, StudentProgress, Enrollment
+from analytics import log_event
+from access import enrolled_course_ids, invalidate_entitlements
+from writes import WriteQueueBusy, run_write
+
+
+class ProgressEntry:
+    """Último estado conhecido do progresso de um aluno em uma aula.
+
+    ``client_ts`` é o momento da medição no cliente (para heartbeats online,
+    o horário do servidor); vale a medição mais recente (last-writer-wins).
+    """
+
+    __slots__ = ('course_id', 'watch_time', 'is_completed', 'completed_at', 'client_ts', 'updated_at')
+
+    def __init__(self, course_id, watch_time, is_completed, now, client_ts=None):
+        self.course_id = course_id
+        self.watch_time = watch_time
+        self.is_completed = is_completed
+        self.completed_at = now if is_completed else None
+        self.client_ts = client_ts or now
+        self.updated_at = now
+
+    def merge(self, watch_time, is_completed, now, client_ts=None):
+        # watch_time: vale a medição mais recente; conclusão é definitiva
+        client_ts = client_ts or now
+        if client_ts >= self.client_ts:
+            self.watch_time = watch_time
+            self.client_ts = client_ts
+        if is_completed and not self.is_completed:
+            self.is_completed = True
+            self.completed_at = now
+        self.updated_at = now
+
+    def to_dict(self):
+        return {
+            'is_completed': self.is_completed,
+            'watch_time': self.watch_time,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+
+def _upsert(table):
+    """``INSERT ... ON CONFLICT (user_id, lesson_id) DO UPDATE`` do dialeto em uso.
+
+    O tempo assistido só é trocado por uma medição mais recente que a gravada
+    (``client_updated_at``); a conclusão nunca é desfeita.
+    """
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(table)
+    excluded = stmt.excluded
+    newer = db.or_(table.c.client_updated_at.is_(None),
+                   excluded.client_updated_at >= table.c.client_updated_at)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.lesson_id],
+        set_={
+            'watch_time': db.case((newer, excluded.watch_time), else_=table.c.watch_time),
+            'client_updated_at': db.case((newer, excluded.client_updated_at), else_=table.c.client_updated_at),
+            'is_completed': table.c.is_completed | excluded.is_completed,
+            'completed_at': db.func.coalesce(table.c.completed_at, excluded.completed_at),
+            'updated_at': excluded.updated_at
+        }
+    )
+
+
+def write_progress(batch):
+    """Grava ``{(user_id, lesson_id): ProgressEntry}`` em uma transação.
+
+    Faz uma leitura do estado anterior, um upsert de todas as linhas e uma
+    atualização em lote dos totais das matrículas. Retorna o estado final de
+    cada chave: ``{key: (ProgressEntry gravada, medição aplicada?)}``.
+    """
+    results, completions = run_write(lambda session: _write_progress(session, batch))
+    for user_id, course_id, lesson_id in completions:
+        log_event('lesson_completed', user_id=user_id, course_id=course_id, lesson_id=lesson_id)
+    return results
+
+
+def _write_progress(session, batch):
+    table = StudentProgress.__table__
+
+    # Estado anterior (uma consulta) para calcular as variações das matrículas
+    previous = {
+        (user_id, lesson_id): (watch_time or 0, bool(is_completed), completed_at, client_updated_at)
+        for user_id, lesson_id, watch_time, is_completed, completed_at, client_updated_at in session.query(
+            StudentProgress.user_id, StudentProgress.lesson_id, StudentProgress.watch_time,
+            StudentProgress.is_completed, StudentProgress.completed_at, StudentProgress.client_updated_at
+        ).filter(tuple_(StudentProgress.user_id, StudentProgress.lesson_id).in_(list(batch)))
+    }
+
+    rows = []
+    deltas = defaultdict(lambda: [0, 0])
+    completions = []
+    results = {}
+    for (user_id, lesson_id), entry in batch.items():
+        rows.append({
+            'user_id': user_id,
+            'lesson_id': lesson_id,
+            'watch_time': entry.watch_time,
+            'is_completed': entry.is_completed,
+            'completed_at': entry.completed_at,
+            'client_updated_at': entry.client_ts,
+            'created_at': entry.updated_at,
+            'updated_at': entry.updated_at
+        })
+
+        # Mesma regra do upsert, para saber o resultado sem reler as linhas
+        old_watch_time, was_completed, old_completed_at, old_client_ts = previous.get(
+            (user_id, lesson_id), (0, False, None, None))
+        applied = old_client_ts is None or entry.client_ts >= old_client_ts
+        final = ProgressEntry(entry.course_id, entry.watch_time if applied else old_watch_time,
+                              was_completed or entry.is_completed, entry.updated_at,
+                              entry.client_ts if applied else old_client_ts)
+        final.completed_at = old_completed_at or entry.completed_at
+        results[(user_id, lesson_id)] = (final, applied)
+
+        delta = deltas[(user_id, entry.course_id)]
+        delta[1] += final.watch_time - old_watch_time
+        if entry.is_completed and not was_completed:
+            delta[0] += 1
+            completions.append((user_id, entry.course_id, lesson_id))
+
+    session.execute(_upsert(table), rows)
+
+    enrollments = Enrollment.__table__
+    session.execute(
+        enrollments.update().where(
+            enrollments.c.user_id == bindparam('b_user_id'),
+            enrollments.c.course_id == bindparam('b_course_id')
+        ).values(
+            completed_lessons=enrollments.c.completed_lessons + bindparam('b_completed'),
+            total_watch_time=enrollments.c.total_watch_time + bindparam('b_watch_time'),
+            last_activity_at=bindparam('b_now')
+        ),
+        [{'b_user_id': user_id, 'b_course_id': course_id, 'b_completed': completed,
+          'b_watch_time': watch_time, 'b_now': datetime.utcnow()}
+         for (user_id, course_id), (completed, watch_time) in deltas.items()]
+    )
+    return results, completions
+
+
+# ==================== SINCRONIZAÇÃO EM LOTE ====================
+
+class BatchItemError(ValueError):
+    pass
+
+
+def parse_client_ts(value, now):
+    """``client_ts`` em ISO 8601 ou epoch (segundos ou milissegundos), em UTC.
+
+    Horários no futuro são limitados a ``now``: um relógio adiantado não pode
+    vencer todas as medições seguintes.
+    """
+    if value is None:
+        return now
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            moment = datetime.fromtimestamp(value / 1000 if value > 1e11 else value, timezone.utc)
+        else:
+            moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise BatchItemError('client_ts inválido')
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(moment, now)
+
+
+def parse_watch_time(value):
+    """``watch_time`` enviado pelo player: inteiro não negativo, em segundos"""
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise BatchItemError('watch_time deve ser um inteiro não negativo')
+    return value
+
+
+def _parse_item(item, now):
+    if not isinstance(item, dict):
+        raise BatchItemError('Item deve ser um objeto')
+    lesson_uuid = item.get('lesson_uuid')
+    if not lesson_uuid or not isinstance(lesson_uuid, str):
+        raise BatchItemError('UUID da aula é obrigatório')
+    watch_time = parse_watch_time(item.get('watch_time', 0))
+    return lesson_uuid, watch_time, bool(item.get('is_completed', False)), parse_client_ts(item.get('client_ts'), now)
+
+
+def apply_progress_batch(user_id, items):
+    """Aplica uma fila de atualizações de progresso de um aluno de uma só vez.
+
+    Uma consulta resolve as aulas, outra confere as matrículas e tudo é
+    gravado em uma transação (``write_progress``). Para a mesma aula vale a
+    medição com maior ``client_ts``; conclusões valem sempre. Retorna um
+    resultado por item, na ordem recebida.
+    """
+    now = datetime.utcnow()
+    results = [None] * len(items)
+    parsed = {}
+    for index, item in enumerate(items):
+        try:
+            parsed[index] = _parse_item(item, now)
+        except BatchItemError as e:
+            results[index] = {'status': 'invalid', 'error': str(e)}
+
+    lessons = {
+        lesson_uuid: (lesson_id, course_id)
+        for lesson_uuid, lesson_id, course_id in db.session.query(Lesson.uuid, Lesson.id, Lesson.course_id).filter(
+            Lesson.uuid.in_({values[0] for values in parsed.values()})
+        )
+    } if parsed else {}
+    # Matrículas do cache; só os cursos fora dele são confirmados no banco
+    course_ids = {course_id for _, course_id in lessons.values()}
+    enrolled = course_ids & enrolled_course_ids(user_id) if course_ids else set()
+    unknown = course_ids - enrolled
+    if unknown:
+        confirmed = {
+            course_id for (course_id,) in db.session.query(Enrollment.course_id).filter(
+                Enrollment.user_id == user_id, Enrollment.course_id.in_(unknown)
+            )
+        }
+        if confirmed:
+            invalidate_entitlements(user_id)
+            enrolled |= confirmed
+
+    batch = {}
+    winners = {}
+    keys = {}
+    for index, (lesson_uuid, watch_time, is_completed, client_ts) in parsed.items():
+        if lesson_uuid not in lessons:
+            results[index] = {'lesson_uuid': lesson_uuid, 'status': 'not_found', 'error': 'Aula não encontrada'}
+            continue
+        lesson_id, course_id = lessons[lesson_uuid]
+        if course_id not in enrolled:
+            results[index] = {'lesson_uuid': lesson_uuid, 'status': 'forbidden',
+                              'error': 'Usuário não matriculado neste curso'}
+            continue
+
+        key = (user_id, lesson_id)
+        keys[index] = key
+        entry = batch.get(key)
+        if entry is None:
+            batch[key] = ProgressEntry(course_id, watch_time, is_completed, now, client_ts)
+            winners[key] = index
+        else:
+            if client_ts >= entry.client_ts:
+                winners[key] = index
+            entry.merge(watch_time, is_completed, now, client_ts)
+
+    written = write_progress(batch) if batch else {}
+
+    for index, key in keys.items():
+        final, applied = written[key]
+        lesson_uuid = parsed[index][0]
+        results[index] = {
+            'lesson_uuid': lesson_uuid,
+            'status': 'applied' if applied and winners[key] == index else 'stale',
+            'progress': dict(final.to_dict(), lesson_uuid=lesson_uuid)
+        }
+    return results
+
+
+# Falhas em que o lote volta inteiro para a fila (banco travado ou fila de
+# escrita cheia); as demais são tratadas como dados inválidos
+TRANSIENT_ERRORS = (OperationalError, WriteQueueBusy)
+
+
+class ProgressBuffer:
+    """Agrupa em memória os heartbeats de progresso e grava em lote.
+
+    O player envia o tempo assistido a cada poucos segundos; só o último valor
+    de cada (aluno, aula) interessa. As atualizações ficam em um dicionário e
+    uma thread grava tudo a cada ``flush_interval`` segundos com um único
+    upsert. Conclusões de aula são gravadas na hora (junto com o que estiver
+    pendente), assim como tudo ao encerrar o processo. Acima de
+    ``max_pending`` chaves a própria requisição grava o lote. Com o banco
+    travado o lote volta para a fila; qualquer outro erro faz gravar entrada
+    por entrada, descartando só a que falhar.
+    """
+
+    def __init__(self, app, flush_interval=5.0, max_pending=10000, asynchronous=True):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.asynchronous = asynchronous
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._counters = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def record(self, user_id, lesson_id, course_id, watch_time, is_completed=False):
+        """Registra um heartbeat e retorna o estado agrupado da aula"""
+        now = datetime.utcnow()
+        key = (user_id, lesson_id)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = ProgressEntry(course_id, watch_time, is_completed, now)
+            else:
+                self._counters['coalesced'] += 1
+                entry.merge(watch_time, is_completed, now)
+            self._counters['received'] += 1
+            state = entry.to_dict()
+            full = len(self._pending) >= self.max_pending
+
+        if is_completed or full or not self.asynchronous:
+            _, failures = self.flush()
+            if key in failures:
+                raise failures[key]  # a requisição não pode confirmar o que não foi gravado
+        else:
+            self._ensure_started()
+        return state
+
+    def pending_for(self, user_id, lesson_ids):
+        """Estados ainda não gravados do aluno, por aula (para leituras do próprio aluno)"""
+        with self._lock:
+            return {
+                lesson_id: self._pending[(user_id, lesson_id)].to_dict()
+                for lesson_id in lesson_ids if (user_id, lesson_id) in self._pending
+            }
+
+    def _ensure_started(self):
+        # Mesma estratégia do buffer de analytics: a thread nasce no primeiro uso
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='progress-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Grava o que está pendente. Retorna ``(linhas gravadas, {chave: erro})``."""
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0, {}
+            with self.app.app_context():
+                try:
+                    write_progress(batch)
+                    failures = {}
+                    self._count('batches')
+                except TRANSIENT_ERRORS as e:
+                    db.session.rollback()
+                    failures = dict.fromkeys(batch, e)
+                    self.app.logger.error(f"Erro ao gravar lote de progresso: {str(e)}")
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Erro ao gravar lote de progresso, gravando um a um: {str(e)}")
+                    failures = self._write_each(batch)
+
+            self._count('flushed', len(batch) - len(failures))
+            if failures:
+                self._count('failed', len(failures))
+                self._requeue({key: batch[key] for key, e in failures.items() if isinstance(e, TRANSIENT_ERRORS)})
+            return len(batch) - len(failures), failures
+
+    def _write_each(self, batch):
+        """Isola a entrada que derrubou o lote; as que falham por erro permanente são descartadas"""
+        failures = {}
+        for key, entry in batch.items():
+            try:
+                write_progress({key: entry})
+            except Exception as e:
+                db.session.rollback()
+                failures[key] = e
+                if not isinstance(e, TRANSIENT_ERRORS):
+                    self._count('dropped')
+                    self.app.logger.error(f"Progresso descartado {key}: {str(e)}")
+        return failures
+
+    def _requeue(self, batch):
+        # Heartbeats que chegaram depois têm prioridade sobre o lote que falhou
+        with self._lock:
+            for key, entry in batch.items():
+                newer = self._pending.get(key)
+                if newer is None:
+                    self._pending[key] = entry
+                elif entry.is_completed and not newer.is_completed:
+                    newer.is_completed = True
+                    newer.completed_at = entry.completed_at
+
+    def shutdown(self, timeout=5.0):
+        """Para a thread e grava o que estiver pendente"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data['pending'] = len(self._pending)
+        return data
+
+
+def init_progress_buffer(app):
+    """Cria o buffer de heartbeats de progresso a partir da configuração"""
+    buffer = ProgressBuffer(
+        app,
+        flush_interval=app.config.get('PROGRESS_FLUSH_INTERVAL', 5.0),
+        max_pending=app.config.get('PROGRESS_MAX_PENDING', 10000),
+        asynchronous=app.config.get('PROGRESS_ASYNC', True)
+    )
+    app.extensions['progress'] = buffer
+    atexit.register(buffer.shutdown)
+    return buffer
@@ -0,0 +1,199 @@
+import uuid
+from contextlib import contextmanager
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from models import db, User, Course, Comment, Enrollment
+from cache import NullResponseCache
+from threads import thread_fields
+
+# Verificação dos planos de consulta (``flask check-query-plans``). Cada
+# endpoint de leitura é chamado pelo cliente de teste do Flask; os SELECTs
+# executados são capturados e passam por ``EXPLAIN QUERY PLAN`` no mesmo
+# engine. Uma tabela percorrida inteira (``SCAN tabela`` sem índice) é uma
+# regressão; ordenações em B-tree temporária só geram aviso.
+
+# (nome, caminho, papel do token); {course}, {comment} vêm do banco
+PLAN_ENDPOINTS = [
+    ('catálogo', '/api/courses', None),
+    ('catálogo por cursor', '/api/courses?cursor=', None),
+    ('catálogo por popularidade', '/api/courses?sort=popular&cursor=', None),
+    ('catálogo por avaliação', '/api/courses?sort=rating&cursor=', None),
+    ('catálogo por categoria', '/api/courses?category=Programação', None),
+    ('busca', '/api/courses?search=python', None),
+    ('curso', '/api/courses/{course}', None),
+    ('aulas', '/api/courses/{course}/lessons', 'student'),
+    ('perfil', '/api/auth/profile', 'student'),
+    ('cursos do aluno', '/api/students/my-courses', 'student'),
+    ('progresso no curso', '/api/students/course-progress/{course}', 'student'),
+    ('cursos do professor', '/api/my-courses', 'teacher'),
+    ('alunos do curso', '/api/my-courses/{course}/students', 'teacher'),
+    ('alunos por atividade', '/api/my-courses/{course}/students?sort=activity', 'teacher'),
+    ('exportação de alunos', '/api/my-courses/{course}/students/export', 'teacher'),
+    ('conversas', '/api/my-courses/{course}/comments', None),
+    ('respostas', '/api/my-courses/{course}/comments/{comment}/replies', None),
+    ('série de analytics', '/api/analytics/timeseries', 'admin'),
+]
+
+# Tabelas que podem ser lidas inteiras (catálogo interno ou limitadas por construção)
+ALLOWED_SCANS = {'sqlite_master', 'sqlite_schema', 'analytics_rollup_state'}
+
+
+def _plan_course():
+    return Course.query.filter(Course.is_published.is_(True), Course.lessons.any()).order_by(Course.id).first()
+
+
+def _plan_comment(course):
+    return Comment.query.filter_by(course_id=course.id, parent_id=None).order_by(Comment.id).first()
+
+
+def _plan_student(course):
+    return User.query.join(Enrollment, Enrollment.user_id == User.id).filter(
+        Enrollment.course_id == course.id).order_by(User.id).first()
+
+
+def _fixtures():
+    """Valores dos parâmetros das rotas e tokens de cada papel, a partir do banco"""
+    course = _plan_course()
+    values, tokens = {}, {}
+    if course is None:
+        return values, tokens
+    values['course'] = course.uuid
+
+    comment = _plan_comment(course)
+    if comment is not None:
+        values['comment'] = comment.uuid
+
+    student = _plan_student(course)
+    users = {
+        'student': student,
+        'teacher': db.session.get(User, course.creator_id),
+        'admin': User.query.filter_by(role='admin').order_by(User.id).first()
+    }
+    for role, user in users.items():
+        if user is not None:
+            tokens[role] = create_access_token(identity=user.uuid)
+    return values, tokens
+
+
+@contextmanager
+def plan_fixtures(app):
+    """Cria o que falta para nenhum endpoint ficar de fora (um aluno matriculado e
+    uma conversa com resposta no curso verificado) e remove tudo ao final.
+
+    Precisa de um curso publicado com aulas; sem ele nada é criado.
+    """
+    created = []
+    with app.app_context():
+        course = _plan_course()
+        if course is not None:
+            student = _plan_student(course)
+            if student is None:
+                student = User(name='Aluno (check-query-plans)', email=f'plans-{uuid.uuid4().hex}@cursohub.invalid',
+                               password='!', role='student')
+                db.session.add(student)
+                db.session.flush()
+                db.session.add(Enrollment(user_id=student.id, course_id=course.id))
+                created += [(Enrollment, (student.id, course.id)), (User, student.id)]
+            if _plan_comment(course) is None:
+                root = Comment(content='Conversa de verificação', user_id=student.id, course_id=course.id)
+                db.session.add(root)
+                db.session.flush()
+                root_id, depth = thread_fields(root)
+                reply = Comment(content='Resposta de verificação', user_id=student.id, course_id=course.id,
+                                parent_id=root.id, root_id=root_id, depth=depth)
+                db.session.add(reply)
+                db.session.flush()
+                created = [(Comment, reply.id), (Comment, root.id)] + created
+            db.session.commit()
+    try:
+        yield len(created)
+    finally:
+        # Pela sessão, para que os eventos desfaçam contadores e caches
+        with app.app_context():
+            for model, key in created:
+                record = db.session.get(model, key)
+                if record is not None:
+                    db.session.delete(record)
+                    db.session.flush()
+            db.session.commit()
+
+
+def explain_plan(connection, statement, parameters):
+    """Linhas do ``EXPLAIN QUERY PLAN`` (SQLite) ou do ``EXPLAIN`` dos demais bancos"""
+    prefix = 'EXPLAIN QUERY PLAN' if connection.dialect.name == 'sqlite' else 'EXPLAIN'
+    rows = connection.exec_driver_sql(f'{prefix} {statement}', parameters or ()).all()
+    return [row[-1] for row in rows]
+
+
+def plan_problems(plan, allowed=ALLOWED_SCANS):
+    """``(regressões, avisos)`` de um plano do SQLite"""
+    # Subconsultas e CTEs materializadas também aparecem como SCAN
+    derived = {line.split(' ', 1)[1] for line in plan if line.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+    scans, warnings = [], []
+    for line in plan:
+        if line.startswith('SCAN ') and ' USING ' not in line and 'VIRTUAL TABLE' not in line:
+            name = line.split(' ')[1]
+            if name not in derived and name not in allowed and not name.startswith('('):
+                scans.append(line)
+        elif line.startswith('USE TEMP B-TREE'):
+            warnings.append(line)
+    return scans, warnings
+
+
+def check_query_plans(app, endpoints=PLAN_ENDPOINTS, allowed=ALLOWED_SCANS):
+    """Chama cada endpoint e analisa o plano de cada SELECT executado.
+
+    Retorna uma lista de dicionários com ``name``, ``path``, ``status``,
+    ``queries`` e, por consulta problemática, ``scans``/``warnings`` com o
+    SQL e o plano. Endpoints sem dados no banco ficam com ``skipped``.
+    """
+    with app.app_context():
+        values, tokens = _fixtures()
+        engines = list(db.engines.values())
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.append((conn.engine, statement, parameters))
+
+    response_cache = app.extensions.get('response_cache')
+    app.extensions['response_cache'] = NullResponseCache()  # respostas em cache não executam consultas
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        client = app.test_client()
+        results = []
+        for name, path, role in endpoints:
+            result = {'name': name, 'path': path, 'scans': [], 'warnings': []}
+            results.append(result)
+            try:
+                url = path.format(**values)
+            except KeyError as e:
+                result['skipped'] = f'sem {e.args[0]} no banco'
+                continue
+            if role and role not in tokens:
+                result['skipped'] = f'sem usuário {role} no banco'
+                continue
+
+            captured.clear()
+            headers = {'Authorization': f'Bearer {tokens[role]}'} if role else {}
+            response = client.get(url, headers=headers)
+            response.get_data()  # respostas transmitidas executam as consultas durante a leitura
+            result['status'] = response.status_code
+            statements = list(captured)
+            result['queries'] = len(statements)
+
+            for engine, statement, parameters in statements:
+                with engine.connect() as connection:
+                    plan = explain_plan(connection, statement, parameters)
+                scans, warnings = plan_problems(plan, allowed)
+                if scans:
+                    result['scans'].append({'sql': statement, 'plan': plan})
+                if warnings:
+                    result['warnings'].append({'sql': statement, 'plan': plan})
+        return results
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', capture)
+        app.extensions['response_cache'] = response_cache
@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+from datetime import datetime
+from sqlalchemy import asc, desc, tuple_
+from models import db, User, Enrollment
+from pagination import encode_cursor, decode_keyset
+
+# Lista de alunos de um curso para o professor. O progresso vem dos totais já
+# consolidados em ``course_enrollments`` (mantidos a cada atualização de
+# progresso e recalculados por agregação em ``flask rebuild-progress``), então
+# a lista inteira é uma única consulta, paginada por cursor.
+
+ROSTER_SORTS = {
+    'progress': (Enrollment.completed_lessons, int),
+    'activity': (db.func.coalesce(Enrollment.last_activity_at, Enrollment.enrolled_at), datetime),
+    'enrolled': (Enrollment.enrolled_at, datetime),
+}
+
+EXPORT_FIELDS = ['uuid', 'name', 'enrolled_at', 'completed_lessons', 'total_lessons', 'percentage',
+                 'total_watch_time', 'last_activity_at']
+
+EXPORT_BATCH_SIZE = 500
+
+
+def _roster_query(course_id, sort_by, order):
+    expression, _ = ROSTER_SORTS[sort_by]
+    direction = asc if order == 'asc' else desc
+    query = db.session.query(
+        User, Enrollment.enrolled_at, Enrollment.completed_lessons, Enrollment.total_watch_time,
+        Enrollment.last_activity_at, expression.label('_cursor_key')
+    ).join(User, User.id == Enrollment.user_id).filter(Enrollment.course_id == course_id)
+    return query.order_by(direction(expression), direction(Enrollment.user_id)), expression
+
+
+def _progress(row, total_lessons):
+    percentage = int((row.completed_lessons / total_lessons) * 100) if total_lessons > 0 else 0
+    return {
+        'completed_lessons': row.completed_lessons,
+        'total_lessons': total_lessons,
+        'percentage': min(percentage, 100),
+        'total_watch_time': row.total_watch_time,
+        'last_activity_at': row.last_activity_at.isoformat() if row.last_activity_at else None
+    }
+
+
+def roster_page(course, sort_by='progress', order='desc', cursor=None, per_page=50):
+    """Página da lista de alunos. Retorna ``(students, next_cursor)``."""
+    cursor_name = f'roster:{sort_by}:{order}'
+    after = decode_keyset(cursor, cursor_name, (ROSTER_SORTS[sort_by][1], int))
+
+    query, expression = _roster_query(course.id, sort_by, order)
+    if after is not None:
+        key = tuple_(expression, Enrollment.user_id)
+        query = query.filter(key > tuple_(*after) if order == 'asc' else key < tuple_(*after))
+    rows = query.limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(cursor_name, (rows[-1]._cursor_key, rows[-1].User.id))
+
+    total_lessons = course.get_lesson_count()
+    students = []
+    for row in rows:
+        student = row.User.to_dict()
+        student['enrolled_at'] = row.enrolled_at.isoformat() if row.enrolled_at else None
+        student['progress'] = _progress(row, total_lessons)
+        students.append(student)
+    return students, next_cursor
+
+
+def _export_rows(course, sort_by, order):
+    """Linhas da exportação lidas em lotes do cursor do banco (memória constante)"""
+    total_lessons = course.get_lesson_count()
+    expression, _ = ROSTER_SORTS[sort_by]
+    direction = asc if order == 'asc' else desc
+    query = db.select(
+        User.uuid, User.name, Enrollment.enrolled_at, Enrollment.completed_lessons,
+        Enrollment.total_watch_time, Enrollment.last_activity_at
+    ).join(User, User.id == Enrollment.user_id).where(Enrollment.course_id == course.id).order_by(
+        direction(expression), direction(Enrollment.user_id)
+    )
+    for row in db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE)):
+        progress = _progress(row, total_lessons)
+        yield {
+            'uuid': row.uuid,
+            'name': row.name,
+            'enrolled_at': row.enrolled_at.isoformat() if row.enrolled_at else None,
+            'completed_lessons': progress['completed_lessons'],
+            'total_lessons': total_lessons,
+            'percentage': progress['percentage'],
+            'total_watch_time': progress['total_watch_time'],
+            'last_activity_at': progress['last_activity_at']
+        }
+
+
+def export_csv(course, sort_by='progress', order='desc'):
+    """Gerador do CSV da lista de alunos, uma linha por vez"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for row in _export_rows(course, sort_by, order):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_ndjson(course, sort_by='progress', order='desc'):
+    """Gerador da lista de alunos em NDJSON (um objeto JSON por linha)"""
+    for row in _export_rows(course, sort_by, order):
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def roster_sort(args):
+    """``sort`` e ``order`` da requisição; valores desconhecidos voltam ao padrão"""
+    sort_by = args.get('sort', 'progress')
+    order = args.get('order', 'desc')
+    return (sort_by if sort_by in ROSTER_SORTS else 'progress'), (order if order in ('asc', 'desc') else 'desc')
+
+
+# Formatos de ``/students/export``: nome -> (gerador, mimetype)
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+}
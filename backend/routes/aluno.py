@@ -1,7 +1,10 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, Course, Lesson, StudentProgress
-from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, current_user
+from models import db, Course, Lesson, StudentProgress, Enrollment
+from serializers import serialize, serialize_one
+from progress import BatchItemError, apply_progress_batch, parse_watch_time
+from access import is_enrolled
+from writes import WriteQueueBusy
 
 students_bp = Blueprint('students', __name__, url_prefix='/api/students')
 
@@ -10,42 +13,14 @@ students_bp = Blueprint('students', __name__, url_prefix='/api/students')
 def get_my_courses():
     """Obter cursos do aluno logado"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        # Obter matrículas com progresso consolidado
+        enrollments = Enrollment.for_user(user.id)
         
-        # Obter cursos matriculados
-        enrolled_courses = user.enrolled_courses
-        
-        courses_data = []
-        for course in enrolled_courses:
-            # Calcular progresso do curso
-            total_lessons = len(course.lessons)
-            completed_lessons = 0
-            
-            if total_lessons > 0:
-                for lesson in course.lessons:
-                    progress = StudentProgress.query.filter_by(
-                        user_id=user.id,
-                        lesson_id=lesson.id,
-                        is_completed=True
-                    ).first()
-                    if progress:
-                        completed_lessons += 1
-                
-                progress_percentage = int((completed_lessons / total_lessons) * 100)
-            else:
-                progress_percentage = 0
-            
-            course_dict = course.to_dict(include_stats=True)
-            course_dict['progress'] = {
-                'completed_lessons': completed_lessons,
-                'total_lessons': total_lessons,
-                'percentage': progress_percentage
-            }
-            courses_data.append(course_dict)
+        courses_data = serialize([e.course for e in enrollments], include_stats=True)
+        for enrollment, course_dict in zip(enrollments, courses_data):
+            course_dict['progress'] = enrollment.progress_dict(enrollment.course.get_lesson_count())
         
         return jsonify({'courses': courses_data}), 200
         
@@ -57,11 +32,7 @@ def get_my_courses():
 def update_lesson_progress():
     """Atualizar progresso de uma aula"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         data = request.get_json()
         lesson_uuid = data.get('lesson_uuid')
@@ -71,40 +42,63 @@ def update_lesson_progress():
         if not lesson_uuid:
             return jsonify({'error': 'UUID da aula é obrigatório'}), 400
         
+        try:
+            watch_time = parse_watch_time(watch_time)
+        except BatchItemError as e:
+            return jsonify({'error': str(e)}), 400
+        
         lesson = Lesson.query.filter_by(uuid=lesson_uuid).first()
         if not lesson:
             return jsonify({'error': 'Aula não encontrada'}), 404
         
         # Verificar se o usuário está matriculado no curso
-        if lesson.course not in user.enrolled_courses:
+        if not is_enrolled(user.id, lesson.course_id):
             return jsonify({'error': 'Usuário não matriculado neste curso'}), 403
         
-        # Buscar ou criar progresso
-        progress = StudentProgress.query.filter_by(
-            user_id=user.id,
-            lesson_id=lesson.id
-        ).first()
+        # Heartbeats são agrupados em memória e gravados em lote (ver progress.py);
+        # conclusões são gravadas imediatamente
+        progress = current_app.extensions['progress'].record(
+            user.id, lesson.id, lesson.course_id, watch_time, bool(is_completed)
+        )
+        progress['lesson_uuid'] = lesson.uuid
         
-        if not progress:
-            progress = StudentProgress(
-                user_id=user.id,
-                lesson_id=lesson.id
-            )
-            db.session.add(progress)
+        return jsonify({
+            'message': 'Progresso atualizado com sucesso',
+            'progress': progress
+        }), 200
         
-        # Atualizar progresso
-        progress.watch_time = watch_time
-        if is_completed and not progress.is_completed:
-            progress.is_completed = True
-            progress.completed_at = datetime.utcnow()
+    except WriteQueueBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@students_bp.route('/progress:batch', methods=['POST'])
+@jwt_required()
+def sync_progress_batch():
+    """Sincronizar em uma chamada o progresso acumulado offline pelo player"""
+    try:
+        user = current_user
+        
+        data = request.get_json(silent=True)
+        items = data.get('updates') if isinstance(data, dict) else data
         
-        db.session.commit()
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Lista de atualizações é obrigatória'}), 400
+        
+        max_items = current_app.config.get('PROGRESS_BATCH_MAX_ITEMS', 500)
+        if len(items) > max_items:
+            return jsonify({'error': f'Máximo de {max_items} atualizações por chamada'}), 413
+        
+        results = apply_progress_batch(user.id, items)
         
         return jsonify({
-            'message': 'Progresso atualizado com sucesso',
-            'progress': progress.to_dict()
+            'message': 'Progresso sincronizado',
+            'applied': sum(1 for result in results if result['status'] == 'applied'),
+            'results': results
         }), 200
         
+    except WriteQueueBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -113,29 +107,32 @@ def update_lesson_progress():
 def get_course_progress(course_uuid):
     """Obter progresso detalhado de um curso"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         if not course:
             return jsonify({'error': 'Curso não encontrado'}), 404
         
         # Verificar se está matriculado
-        if course not in user.enrolled_courses:
+        if not is_enrolled(user.id, course.id):
             return jsonify({'error': 'Usuário não matriculado neste curso'}), 403
         
-        # Obter progresso de todas as aulas
+        # Obter progresso de todas as aulas em uma única consulta
+        progress_by_lesson = {
+            p.lesson_id: p for p in StudentProgress.query.filter(
+                StudentProgress.user_id == user.id,
+                StudentProgress.lesson_id.in_([lesson.id for lesson in course.lessons])
+            )
+        }
+        
+        # Heartbeats deste processo ainda não gravados
+        pending_progress = current_app.extensions['progress'].pending_for(
+            user.id, [lesson.id for lesson in course.lessons]
+        )
+        
         lessons_progress = []
-        for lesson in course.lessons:
-            progress = StudentProgress.query.filter_by(
-                user_id=user.id,
-                lesson_id=lesson.id
-            ).first()
-            
-            lesson_dict = lesson.to_dict()
+        for lesson, lesson_dict in zip(course.lessons, serialize(course.lessons)):
+            progress = progress_by_lesson.get(lesson.id)
             if progress:
                 lesson_dict['progress'] = progress.to_dict()
             else:
@@ -145,10 +142,14 @@ def get_course_progress(course_uuid):
                     'completed_at': None
                 }
             
+            # Conclusões já foram gravadas; do pendente só falta o tempo assistido
+            if lesson.id in pending_progress:
+                lesson_dict['progress']['watch_time'] = pending_progress[lesson.id]['watch_time']
+            
             lessons_progress.append(lesson_dict)
         
         return jsonify({
-            'course': course.to_dict(),
+            'course': serialize_one(course),
             'lessons': lessons_progress
         }), 200
         
@@ -0,0 +1,133 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, current_user
+from models import db, Course, Lesson, AnalyticsRollup
+from datetime import datetime, timedelta
+
+analytics_bp = Blueprint('analytics', __name__, url_prefix='/api/analytics')
+
+@analytics_bp.route('/ingestion', methods=['GET'])
+@jwt_required()
+def get_ingestion_stats():
+    """Contadores das filas de gravação de analytics, de progresso e de escrita (apenas admin)"""
+    try:
+        user = current_user
+        
+        if user.role != 'admin':
+            return jsonify({'error': 'Sem permissão para acessar analytics'}), 403
+        
+        return jsonify({
+            'ingestion': current_app.extensions['analytics'].stats(),
+            'progress': current_app.extensions['progress'].stats(),
+            'writes': current_app.extensions['writes'].stats()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/cache', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    """Contadores do cache de respostas do catálogo (apenas admin)"""
+    try:
+        user = current_user
+        
+        if user.role != 'admin':
+            return jsonify({'error': 'Sem permissão para acessar analytics'}), 403
+        
+        return jsonify({'cache': current_app.extensions['response_cache'].stats()}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/sql', methods=['GET'])
+@jwt_required()
+def get_sql_stats():
+    """Consultas e tempo no banco por endpoint nas requisições medidas (apenas admin)"""
+    try:
+        user = current_user
+
+        if user.role != 'admin':
+            return jsonify({'error': 'Sem permissão para acessar analytics'}), 403
+
+        return jsonify({'sql': current_app.extensions['sql_instrumentation'].stats()}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Janela padrão de cada granularidade quando ?start= não é informado
+DEFAULT_WINDOWS = {
+    'hour': timedelta(hours=48),
+    'day': timedelta(days=30)
+}
+
+@analytics_bp.route('/timeseries', methods=['GET'])
+@jwt_required()
+def get_timeseries():
+    """Série temporal de eventos a partir dos rollups por hora/dia"""
+    try:
+        user = current_user
+        
+        if user.role not in ['teacher', 'admin']:
+            return jsonify({'error': 'Sem permissão para acessar analytics'}), 403
+        
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in AnalyticsRollup.BUCKETS:
+            return jsonify({'error': 'bucket deve ser hour ou day'}), 400
+        
+        try:
+            end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow()
+            start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else end - DEFAULT_WINDOWS[bucket]
+        except ValueError:
+            return jsonify({'error': 'Datas devem estar no formato ISO 8601'}), 400
+        
+        query = db.session.query(
+            AnalyticsRollup.bucket_start,
+            AnalyticsRollup.event_type,
+            db.func.sum(AnalyticsRollup.count)
+        ).filter(
+            AnalyticsRollup.bucket == bucket,
+            AnalyticsRollup.bucket_start >= AnalyticsRollup.truncate(start, bucket),
+            AnalyticsRollup.bucket_start <= end
+        )
+        
+        # Escopo: curso informado, ou todos os cursos do professor (admin vê tudo)
+        course_uuid = request.args.get('course')
+        if course_uuid:
+            course = Course.query.filter_by(uuid=course_uuid).first()
+            if not course:
+                return jsonify({'error': 'Curso não encontrado'}), 404
+            if course.creator_id != user.id and user.role != 'admin':
+                return jsonify({'error': 'Sem permissão para acessar analytics deste curso'}), 403
+            query = query.filter(AnalyticsRollup.course_id == course.id)
+        elif user.role != 'admin':
+            own_courses = db.session.query(Course.id).filter_by(creator_id=user.id)
+            query = query.filter(AnalyticsRollup.course_id.in_(own_courses))
+        
+        lesson_uuid = request.args.get('lesson')
+        if lesson_uuid:
+            lesson = Lesson.query.filter_by(uuid=lesson_uuid).first()
+            if not lesson:
+                return jsonify({'error': 'Aula não encontrada'}), 404
+            query = query.filter(AnalyticsRollup.lesson_id == lesson.id)
+        
+        event_type = request.args.get('event')
+        if event_type:
+            query = query.filter(AnalyticsRollup.event_type == event_type)
+        
+        rows = query.group_by(
+            AnalyticsRollup.bucket_start, AnalyticsRollup.event_type
+        ).order_by(AnalyticsRollup.bucket_start, AnalyticsRollup.event_type).all()
+        
+        return jsonify({
+            'bucket': bucket,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'series': [{
+                'bucket_start': bucket_start.isoformat(),
+                'event_type': row_event_type,
+                'count': round(total, 2)
+            } for bucket_start, row_event_type, total in rows]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,7 +1,12 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity
-from werkzeug.security import generate_password_hash
+from flask_jwt_extended import jwt_required, create_access_token, current_user
 from models import db, User
+from analytics import log_event
+from passwords import hash_password, verify_password, HasherBusy
+from identity import load_user
+from images import variants_for_url
+from cache import creator_tag, invalidate
+from conditional import user_version, is_not_modified, not_modified_response, with_validators
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
@@ -27,7 +32,7 @@ def register():
         user = User(
             name=data['name'],
             email=data['email'],
-            password=generate_password_hash(data['password']),
+            password=hash_password(data['password']),
             role=data.get('role', 'student'),
             bio=data.get('bio', '')
         )
@@ -38,12 +43,17 @@ def register():
         # Criar token JWT
         token = create_access_token(identity=user.uuid)
         
+        # Log analytics
+        log_event('user_registered', user_id=user.id)
+        
         return jsonify({
             'message': 'Usuário criado com sucesso',
             'token': token,
             'user': user.to_dict(include_email=True)
         }), 201
         
+    except HasherBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -58,21 +68,30 @@ def login():
         
         user = User.query.filter_by(email=data['email']).first()
         
-        if not user or not user.check_password(data['password']):
+        if not user or not verify_password(user, data['password']):
             return jsonify({'error': 'Credenciais inválidas'}), 401
         
         if not user.is_active:
             return jsonify({'error': 'Conta desativada'}), 401
         
+        # Grava o hash refeito com os parâmetros atuais, se foi o caso
+        if user in db.session.dirty:
+            db.session.commit()
+        
         # Criar token JWT
         token = create_access_token(identity=user.uuid)
         
+        # Log analytics
+        log_event('user_login', user_id=user.id)
+        
         return jsonify({
             'message': 'Login realizado com sucesso',
             'token': token,
             'user': user.to_dict(include_email=True)
         }), 200
         
+    except HasherBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -81,13 +100,13 @@ def login():
 def get_profile():
     """Obter perfil do usuário autenticado"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = load_user(current_user)
         
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        version = user_version(user)
+        if is_not_modified(version):
+            return not_modified_response(version, private=True)
         
-        return jsonify({'user': user.to_dict(include_email=True)}), 200
+        return with_validators(jsonify({'user': user.to_dict(include_email=True)}), version, private=True)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -97,11 +116,7 @@ def get_profile():
 def update_profile():
     """Atualizar perfil do usuário autenticado"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = load_user(current_user)
         
         data = request.get_json()
         
@@ -112,9 +127,13 @@ def update_profile():
             user.bio = data['bio']
         if data.get('avatar_url'):
             user.avatar_url = data['avatar_url']
+            user.avatar_variants = variants_for_url(user.avatar_url)
         
         db.session.commit()
         
+        # Nome e avatar aparecem nas respostas em cache dos cursos do usuário
+        invalidate(creator_tag(user.id))
+        
         return jsonify({
             'message': 'Perfil atualizado com sucesso',
             'user': user.to_dict(include_email=True)
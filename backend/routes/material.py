@@ -1,9 +1,16 @@
-from flask import Blueprint, request, jsonify, send_file
-from flask_jwt_extended import jwt_required
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, current_user
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import os
 from utils import allowed_file
+from models import UploadSession
+from media import send_upload
+from storage import store_stream
+from images import enqueue_variants
+from routing import use_primary
+from uploads import (UPLOAD_SUBDIRS, UploadError, start_upload, write_chunk, finalize_upload, abort_upload,
+                     parse_checksum)
 
 uploads_bp = Blueprint('uploads', __name__, url_prefix='/api')
 
@@ -22,32 +29,18 @@ def upload_file():
             return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            # Adicionar timestamp para evitar conflitos
-            name, ext = os.path.splitext(filename)
-            filename = f"{name}_{int(datetime.now().timestamp())}{ext}"
+            if file_type not in UPLOAD_SUBDIRS:
+                file_type = 'material'
             
-            # Determinar subdiretório baseado no tipo
-            subdir = {
-                'video': 'videos',
-                'avatar': 'avatars', 
-                'material': 'materials'
-            }.get(file_type, 'materials')
-            
-            # Criar diretório se não existir
-            upload_path = os.path.join('uploads', subdir)
-            os.makedirs(upload_path, exist_ok=True)
-            
-            filepath = os.path.join(upload_path, filename)
-            file.save(filepath)
-            
-            # URL relativa para o arquivo
-            file_url = f"/uploads/{subdir}/{filename}"
+            # Armazenamento por conteúdo: o mesmo arquivo enviado de novo não ocupa espaço
+            stored = store_stream(file.stream, file.filename, file_type=file_type, user_id=current_user.id)
+            enqueue_variants(stored)
             
             return jsonify({
                 'message': 'Arquivo enviado com sucesso',
-                'file_url': file_url,
-                'filename': filename
+                'file_url': stored.url,
+                'filename': stored.filename,
+                'file': stored.to_dict()
             }), 200
         
         return jsonify({'error': 'Tipo de arquivo não permitido'}), 400
@@ -55,13 +48,134 @@ def upload_file():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ==================== UPLOAD EM PARTES (RETOMÁVEL) ====================
+# POST cria a sessão; PUT envia cada parte com o cabeçalho Upload-Offset (e,
+# opcionalmente, Upload-Checksum: sha256 <hex>); GET informa o deslocamento
+# para retomar após uma queda; POST .../finalize publica o arquivo.
+
+def _get_upload_session(upload_id):
+    return UploadSession.query.filter_by(uuid=upload_id, user_id=current_user.id).first()
+
+@uploads_bp.route('/upload/sessions', methods=['POST'])
+@jwt_required()
+def create_upload_session():
+    """Iniciar upload em partes"""
+    try:
+        data = request.get_json() or {}
+        
+        session = start_upload(
+            current_user.id,
+            data.get('filename'),
+            data.get('size'),
+            file_type=data.get('type', 'video'),
+            sha256=data.get('sha256')
+        )
+        
+        return jsonify({
+            'upload': session.to_dict(),
+            'chunk_size': current_app.config.get('UPLOAD_CHUNK_SIZE')
+        }), 201
+        
+    except UploadError as e:
+        return jsonify(e.to_dict()), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@uploads_bp.route('/upload/sessions/<upload_id>', methods=['GET'])
+@use_primary  # o deslocamento para retomar não pode vir de uma réplica atrasada
+@jwt_required()
+def get_upload_session(upload_id):
+    """Estado do upload (deslocamento para retomar)"""
+    try:
+        session = _get_upload_session(upload_id)
+        
+        if not session:
+            return jsonify({'error': 'Upload não encontrado'}), 404
+        
+        return jsonify({'upload': session.to_dict()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@uploads_bp.route('/upload/sessions/<upload_id>', methods=['PUT'])
+@jwt_required()
+def upload_chunk(upload_id):
+    """Enviar uma parte do arquivo a partir do deslocamento informado"""
+    try:
+        session = _get_upload_session(upload_id)
+        
+        if not session:
+            return jsonify({'error': 'Upload não encontrado'}), 404
+        
+        offset = request.headers.get('Upload-Offset', type=int)
+        if offset is None:
+            return jsonify({'error': 'Cabeçalho Upload-Offset é obrigatório', 'offset': session.received}), 400
+        
+        if request.content_length is None:
+            return jsonify({'error': 'Content-Length é obrigatório'}), 411
+        
+        new_offset = write_chunk(
+            session, offset, request.stream, request.content_length,
+            checksum=parse_checksum(request.headers.get('Upload-Checksum'))
+        )
+        
+        return jsonify({'offset': new_offset, 'size': session.total_size}), 200
+        
+    except UploadError as e:
+        return jsonify(e.to_dict()), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@uploads_bp.route('/upload/sessions/<upload_id>/finalize', methods=['POST'])
+@jwt_required()
+def finalize_upload_session(upload_id):
+    """Concluir o upload e publicar o arquivo"""
+    try:
+        session = _get_upload_session(upload_id)
+        
+        if not session:
+            return jsonify({'error': 'Upload não encontrado'}), 404
+        
+        session = finalize_upload(session)
+        
+        return jsonify({
+            'message': 'Arquivo enviado com sucesso',
+            'file_url': session.file_url,
+            'filename': os.path.basename(session.file_url),
+            'upload': session.to_dict()
+        }), 200
+        
+    except UploadError as e:
+        return jsonify(e.to_dict()), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@uploads_bp.route('/upload/sessions/<upload_id>', methods=['DELETE'])
+@jwt_required()
+def delete_upload_session(upload_id):
+    """Cancelar upload em partes"""
+    try:
+        session = _get_upload_session(upload_id)
+        
+        if not session:
+            return jsonify({'error': 'Upload não encontrado'}), 404
+        
+        abort_upload(session)
+        
+        return jsonify({'message': 'Upload cancelado'}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @uploads_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    """Servir arquivos estáticos de upload"""
+    """Servir arquivos estáticos de upload (com suporte a Range para vídeos)"""
     try:
-        return send_file(
-            os.path.join('uploads', filename),
-            as_attachment=False
-        )
+        response = send_upload(filename)
+        
+        if response is None:
+            return jsonify({'error': 'Arquivo não encontrado'}), 404
+        
+        return response
     except Exception as e:
         return jsonify({'error': 'Arquivo não encontrado'}), 404
\ No newline at end of file
@@ -1,6 +1,13 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, Course, Lesson, StudentProgress, Rating, Comment
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required, current_user
+from models import db, Course, Lesson, Rating, Comment, Enrollment
+from serializers import serialize
+from cache import catalog_sort_tag, course_tag, invalidate
+from access import is_enrolled
+from threads import thread_page, reply_page, thread_fields
+from roster import EXPORT_FORMATS, roster_page, roster_sort
+from pagination import InvalidCursor
+from writes import run_write, WriteQueueBusy
 from sqlalchemy import desc
 
 my_courses_bp = Blueprint('my_courses', __name__, url_prefix='/api/my-courses')
@@ -10,47 +17,19 @@ my_courses_bp = Blueprint('my_courses', __name__, url_prefix='/api/my-courses')
 def get_my_courses():
     """Obter todos os cursos do usuário (criados se professor, matriculados se aluno)"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         if user.role in ['teacher', 'admin']:
             # Professor: cursos criados
             courses = Course.query.filter_by(creator_id=user.id).order_by(desc(Course.created_at)).all()
-            courses_data = [course.to_dict(include_stats=True) for course in courses]
+            courses_data = serialize(courses, include_stats=True)
         else:
-            # Aluno: cursos matriculados com progresso
-            enrolled_courses = user.enrolled_courses
-            courses_data = []
+            # Aluno: cursos matriculados com progresso consolidado
+            enrollments = Enrollment.for_user(user.id)
+            courses_data = serialize([e.course for e in enrollments], include_stats=True)
             
-            for course in enrolled_courses:
-                # Calcular progresso
-                total_lessons = len(course.lessons)
-                completed_lessons = 0
-                
-                if total_lessons > 0:
-                    for lesson in course.lessons:
-                        progress = StudentProgress.query.filter_by(
-                            user_id=user.id,
-                            lesson_id=lesson.id,
-                            is_completed=True
-                        ).first()
-                        if progress:
-                            completed_lessons += 1
-                    
-                    progress_percentage = int((completed_lessons / total_lessons) * 100)
-                else:
-                    progress_percentage = 0
-                
-                course_dict = course.to_dict(include_stats=True)
-                course_dict['progress'] = {
-                    'completed_lessons': completed_lessons,
-                    'total_lessons': total_lessons,
-                    'percentage': progress_percentage
-                }
-                courses_data.append(course_dict)
+            for enrollment, course_dict in zip(enrollments, courses_data):
+                course_dict['progress'] = enrollment.progress_dict(enrollment.course.get_lesson_count())
         
         return jsonify({'courses': courses_data}), 200
         
@@ -60,13 +39,9 @@ def get_my_courses():
 @my_courses_bp.route('/<course_uuid>/students', methods=['GET'])
 @jwt_required()
 def get_course_students(course_uuid):
-    """Obter alunos matriculados em um curso (apenas para professores)"""
+    """Obter alunos matriculados em um curso com o progresso (apenas para professores)"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         if not course:
@@ -76,36 +51,54 @@ def get_course_students(course_uuid):
         if course.creator_id != user.id and user.role != 'admin':
             return jsonify({'error': 'Sem permissão para ver alunos deste curso'}), 403
         
-        # Obter alunos com progresso
-        students_data = []
-        for student in course.students:
-            # Calcular progresso do aluno
-            total_lessons = len(course.lessons)
-            completed_lessons = 0
-            
-            if total_lessons > 0:
-                for lesson in course.lessons:
-                    progress = StudentProgress.query.filter_by(
-                        user_id=student.id,
-                        lesson_id=lesson.id,
-                        is_completed=True
-                    ).first()
-                    if progress:
-                        completed_lessons += 1
-                
-                progress_percentage = int((completed_lessons / total_lessons) * 100)
-            else:
-                progress_percentage = 0
-            
-            student_dict = student.to_dict()
-            student_dict['progress'] = {
-                'completed_lessons': completed_lessons,
-                'total_lessons': total_lessons,
-                'percentage': progress_percentage
+        sort_by, order = roster_sort(request.args)
+        per_page = max(min(request.args.get('per_page', 50, type=int), 200), 1)
+        
+        try:
+            students, next_cursor = roster_page(course, sort_by, order, request.args.get('cursor'), per_page)
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'students': students,
+            'pagination': {
+                'per_page': per_page,
+                'sort': sort_by,
+                'order': order,
+                'next_cursor': next_cursor,
+                'has_next': next_cursor is not None
             }
-            students_data.append(student_dict)
+        }), 200
         
-        return jsonify({'students': students_data}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@my_courses_bp.route('/<course_uuid>/students/export', methods=['GET'])
+@jwt_required()
+def export_course_students(course_uuid):
+    """Exportar a lista de alunos com o progresso em CSV ou NDJSON (transmitida linha a linha)"""
+    try:
+        user = current_user
+        
+        course = Course.query.filter_by(uuid=course_uuid).first()
+        if not course:
+            return jsonify({'error': 'Curso não encontrado'}), 404
+        
+        if course.creator_id != user.id and user.role != 'admin':
+            return jsonify({'error': 'Sem permissão para ver alunos deste curso'}), 403
+        
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': 'Formato inválido: use csv ou ndjson'}), 400
+        
+        sort_by, order = roster_sort(request.args)
+        generate, mimetype = EXPORT_FORMATS[export_format]
+        filename = f'alunos-{course.uuid}.{export_format}'
+        return Response(
+            stream_with_context(generate(course, sort_by, order)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -115,69 +108,110 @@ def get_course_students(course_uuid):
 def rate_course(course_uuid):
     """Avaliar um curso"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         if not course:
             return jsonify({'error': 'Curso não encontrado'}), 404
         
         # Verificar se está matriculado
-        if course not in user.enrolled_courses:
+        if not is_enrolled(user.id, course.id):
             return jsonify({'error': 'Usuário não matriculado neste curso'}), 403
         
         data = request.get_json()
         rating_value = data.get('rating')
         comment = data.get('comment', '')
         
-        if not rating_value or rating_value < 1 or rating_value > 5:
+        # Estrelas inteiras: cada valor tem o seu contador em course_stats
+        if isinstance(rating_value, bool) or not isinstance(rating_value, int) or not 1 <= rating_value <= 5:
             return jsonify({'error': 'Avaliação deve ser entre 1 e 5 estrelas'}), 400
         
-        # Verificar se já avaliou
-        existing_rating = Rating.query.filter_by(
-            user_id=user.id,
-            course_id=course.id
-        ).first()
-        
-        if existing_rating:
-            # Atualizar avaliação existente
-            existing_rating.value = rating_value
-            existing_rating.comment = comment
-        else:
-            # Criar nova avaliação
-            rating = Rating(
-                value=rating_value,
-                comment=comment,
-                user_id=user.id,
-                course_id=course.id
-            )
-            db.session.add(rating)
+        # A transação pode rodar na thread da fila de escrita: só valores simples
+        user_id, course_id = user.id, course.id
         
-        db.session.commit()
+        def write(session):
+            # Verificar se já avaliou
+            existing_rating = session.query(Rating).filter_by(
+                user_id=user_id,
+                course_id=course_id
+            ).first()
+            
+            if existing_rating:
+                # Atualizar avaliação existente
+                existing_rating.value = rating_value
+                existing_rating.comment = comment
+            else:
+                # Criar nova avaliação
+                rating = Rating(
+                    value=rating_value,
+                    comment=comment,
+                    user_id=user_id,
+                    course_id=course_id
+                )
+                session.add(rating)
+        
+        run_write(write)
+        invalidate(course_tag(course.uuid), catalog_sort_tag('rating'))
         
         return jsonify({'message': 'Avaliação salva com sucesso'}), 200
         
+    except WriteQueueBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @my_courses_bp.route('/<course_uuid>/comments', methods=['GET'])
 def get_course_comments(course_uuid):
-    """Obter comentários de um curso"""
+    """Obter conversas de comentários de um curso (paginadas por cursor)"""
     try:
         course = Course.query.filter_by(uuid=course_uuid).first()
         if not course:
             return jsonify({'error': 'Curso não encontrado'}), 404
         
-        comments = Comment.query.filter_by(
-            course_id=course.id,
-            parent_id=None  # Apenas comentários principais
-        ).order_by(desc(Comment.created_at)).all()
+        per_page = max(min(request.args.get('per_page', 20, type=int), 50), 1)
+        replies = max(min(request.args.get('replies', 3, type=int), 20), 0)
+        
+        try:
+            threads, next_cursor = thread_page(course.id, request.args.get('cursor'), per_page, replies)
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'comments': [comment.to_dict() for comment in comments]
+            'comments': threads,
+            'pagination': {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_next': next_cursor is not None
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@my_courses_bp.route('/<course_uuid>/comments/<comment_uuid>/replies', methods=['GET'])
+def get_comment_replies(course_uuid, comment_uuid):
+    """Carregar mais respostas de uma conversa"""
+    try:
+        root = Comment.query.join(Course, Course.id == Comment.course_id).filter(
+            Course.uuid == course_uuid, Comment.uuid == comment_uuid
+        ).first()
+        if not root or root.parent_id is not None:
+            return jsonify({'error': 'Comentário não encontrado'}), 404
+        
+        per_page = max(min(request.args.get('per_page', 20, type=int), 50), 1)
+        
+        try:
+            replies, next_cursor = reply_page(root, request.args.get('cursor'), per_page)
+        except InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'replies': replies,
+            'pagination': {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_next': next_cursor is not None
+            }
         }), 200
         
     except Exception as e:
@@ -188,11 +222,7 @@ def get_course_comments(course_uuid):
 def add_course_comment(course_uuid):
     """Adicionar comentário a um curso"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         if not course:
@@ -205,26 +235,31 @@ def add_course_comment(course_uuid):
         if not content:
             return jsonify({'error': 'Conteúdo é obrigatório'}), 400
         
-        parent_id = None
+        parent_comment = None
         if parent_uuid:
-            parent_comment = Comment.query.filter_by(uuid=parent_uuid).first()
-            if parent_comment:
-                parent_id = parent_comment.id
+            parent_comment = Comment.query.filter_by(uuid=parent_uuid, course_id=course.id).first()
+        root_id, depth = thread_fields(parent_comment)
         
         comment = Comment(
             content=content,
             user_id=user.id,
             course_id=course.id,
-            parent_id=parent_id
+            parent_id=parent_comment.id if parent_comment else None,
+            root_id=root_id,
+            depth=depth
         )
         
-        db.session.add(comment)
-        db.session.commit()
+        def write(session):
+            session.add(comment)
+            session.flush()
+            return comment.to_dict(include_replies=False)
         
         return jsonify({
             'message': 'Comentário adicionado com sucesso',
-            'comment': comment.to_dict(include_replies=False)
+            'comment': run_write(write)
         }), 201
         
+    except WriteQueueBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
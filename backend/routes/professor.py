@@ -1,7 +1,16 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import desc, or_
-from models import db, User, Course, Lesson
+from flask_jwt_extended import jwt_required, current_user
+from sqlalchemy import desc
+from models import db, User, Course, Lesson, Enrollment
+from serializers import serialize, serialize_one
+from search import apply_search, split_search_rows
+from pagination import paginate_catalog, published_filter, InvalidCursor, CATALOG_ARGS
+from analytics import log_event
+from conditional import course_version, is_not_modified, not_modified_response, with_validators
+from images import variants_for_url
+from access import is_enrolled
+from writes import run_write, WriteQueueBusy
+from cache import CATALOG_TAG, catalog_sort_tag, course_tag, creator_tag, cache_key, get_or_build, invalidate, json_body, json_response
 from sqlalchemy import func
 
 courses_bp = Blueprint('courses', __name__, url_prefix='/api/courses')
@@ -10,59 +19,62 @@ courses_bp = Blueprint('courses', __name__, url_prefix='/api/courses')
 def get_courses():
     """Listar cursos com filtros e paginação"""
     try:
-        # Parâmetros de query
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 50)
-        category = request.args.get('category')
-        level = request.args.get('level')
-        search = request.args.get('search')
-        featured = request.args.get('featured', type=bool)
-        creator_uuid = request.args.get('creator')
-        
-        # Query base
-        query = Course.query.filter_by(is_published=True)
-        
-        # Filtros
-        if category:
-            query = query.filter_by(category=category)
-        if level:
-            query = query.filter_by(level=level)
-        if search:
-            query = query.filter(
-                or_(
-                    Course.title.contains(search),
-                    Course.description.contains(search)
-                )
-            )
-        if featured:
-            query = query.filter_by(is_featured=True)
-        if creator_uuid:
-            creator = User.query.filter_by(uuid=creator_uuid).first()
-            if creator:
-                query = query.filter_by(creator_id=creator.id)
-        
-        # Ordenação
-        query = query.order_by(desc(Course.created_at))
-        
-        # Paginação
-        courses = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
-        
-        return jsonify({
-            'courses': [course.to_dict(include_stats=True) for course in courses.items],
-            'pagination': {
-                'page': page,
-                'pages': courses.pages,
-                'per_page': per_page,
-                'total': courses.total,
-                'has_next': courses.has_next,
-                'has_prev': courses.has_prev
-            }
-        }), 200
-        
+        def build():
+            # Parâmetros de query
+            category = request.args.get('category')
+            level = request.args.get('level')
+            search = request.args.get('search')
+            featured = request.args.get('featured', type=bool)
+            creator_uuid = request.args.get('creator')
+            
+            # Query base
+            query = Course.query.filter(published_filter(request.args.get('sort')))
+            
+            # Filtros
+            if category:
+                query = query.filter_by(category=category)
+            if level:
+                query = query.filter_by(level=level)
+            rank = None
+            if search:
+                query, rank = apply_search(query, search)
+            if featured:
+                query = query.filter_by(is_featured=True)
+            if creator_uuid:
+                creator = User.query.filter_by(uuid=creator_uuid).first()
+                if creator:
+                    query = query.filter_by(creator_id=creator.id)
+            
+            # Ordenação e paginação (por cursor com ?cursor=, ou por página)
+            items, pagination = paginate_catalog(query, request.args, rank)
+            
+            if rank is not None:
+                items, snippets = split_search_rows(items)
+                courses_data = serialize(items, include_stats=True)
+                for course_dict, snippet in zip(courses_data, snippets):
+                    course_dict['search_snippet'] = snippet
+            else:
+                courses_data = serialize(items, include_stats=True)
+            
+            body = json_body({
+                'courses': courses_data,
+                'pagination': pagination
+            })
+            return body, ([course_tag(course.uuid) for course in items] + [creator_tag(course.creator_id) for course in items]
+                          + [catalog_sort_tag(pagination['sort'])])
+        
+        body = get_or_build(cache_key('courses', request.args, CATALOG_ARGS), build, tags=[CATALOG_TAG])
+        
+        # Log analytics
+        log_event('courses_viewed', event_data={
+            'page': request.args.get('page', 1, type=int),
+            'filters': request.args.to_dict()
+        })
+        
+        return json_response(body)
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -70,12 +82,31 @@ def get_courses():
 def get_course(course_uuid):
     """Obter detalhes de um curso específico"""
     try:
-        course = Course.query.filter_by(uuid=course_uuid, is_published=True).first()
+        version = course_version(course_uuid, published_only=True)
         
-        if not course:
+        if not version:
+            return jsonify({'error': 'Curso não encontrado'}), 404
+        
+        # Log analytics
+        log_event('course_viewed', course_id=version.id)
+        
+        # Cliente já tem a versão atual: responde 304 sem serializar
+        if is_not_modified(version):
+            return not_modified_response(version)
+        
+        def build():
+            course = Course.query.filter_by(uuid=course_uuid, is_published=True).first()
+            if not course:
+                return None
+            return json_body({'course': serialize_one(course, include_lessons=True, include_stats=True)}), [creator_tag(course.creator_id)]
+        
+        # A ETag entra na chave: o corpo em cache é sempre o da versão validada
+        body = get_or_build(cache_key(f'course/{course_uuid}/{version.etag}'), build, tags=[course_tag(course_uuid)])
+        
+        if body is None:
             return jsonify({'error': 'Curso não encontrado'}), 404
         
-        return jsonify({'course': course.to_dict(include_lessons=True, include_stats=True)}), 200
+        return with_validators(json_response(body), version)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -85,11 +116,7 @@ def get_course(course_uuid):
 def create_course():
     """Criar novo curso"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         if user.role not in ['teacher', 'admin']:
             return jsonify({'error': 'Sem permissão para criar cursos'}), 403
@@ -112,6 +139,12 @@ def create_course():
         db.session.add(course)
         db.session.commit()
         
+        if course.is_published:
+            invalidate(CATALOG_TAG)
+        
+        # Log analytics
+        log_event('course_created', user_id=user.id, course_id=course.id)
+        
         return jsonify({
             'message': 'Curso criado com sucesso',
             'course': course.to_dict()
@@ -125,8 +158,7 @@ def create_course():
 def update_course(course_uuid):
     """Atualizar curso"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         
@@ -152,12 +184,14 @@ def update_course(course_uuid):
             course.price = data['price']
         if 'thumbnail_url' in data:
             course.thumbnail_url = data['thumbnail_url']
+            course.thumbnail_variants = variants_for_url(course.thumbnail_url)
         if 'is_published' in data:
             course.is_published = data['is_published']
         if 'is_featured' in data and user.role == 'admin':
             course.is_featured = data['is_featured']
         
         db.session.commit()
+        invalidate(CATALOG_TAG, course_tag(course.uuid))
         
         return jsonify({
             'message': 'Curso atualizado com sucesso',
@@ -172,11 +206,7 @@ def update_course(course_uuid):
 def enroll_course(course_uuid):
     """Matricular usuário em um curso"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
-        
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid, is_published=True).first()
         
@@ -184,15 +214,21 @@ def enroll_course(course_uuid):
             return jsonify({'error': 'Curso não encontrado'}), 404
         
         # Verificar se já está matriculado
-        if course in user.enrolled_courses:
+        if is_enrolled(user.id, course.id):
             return jsonify({'error': 'Usuário já matriculado neste curso'}), 409
         
         # Matricular usuário
-        user.enrolled_courses.append(course)
-        db.session.commit()
+        enrollment = Enrollment(user_id=user.id, course_id=course.id)
+        run_write(lambda session: session.add(enrollment))
+        invalidate(course_tag(course.uuid), catalog_sort_tag('popular'))
+        
+        # Log analytics
+        log_event('course_enrolled', user_id=user.id, course_id=course.id)
         
         return jsonify({'message': 'Matrícula realizada com sucesso'}), 200
         
+    except WriteQueueBusy:
+        return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -200,17 +236,22 @@ def enroll_course(course_uuid):
 def get_lessons(course_uuid):
     """Listar aulas de um curso"""
     try:
-        course = Course.query.filter_by(uuid=course_uuid).first()
+        version = course_version(course_uuid, kind='lessons')
         
-        if not course:
+        if not version:
             return jsonify({'error': 'Curso não encontrado'}), 404
         
-        # Ordenar por order_index
-        lessons = Lesson.query.filter_by(course_id=course.id).order_by(Lesson.order_index).all()
+        if is_not_modified(version):
+            return not_modified_response(version)
         
-        return jsonify({
-            'lessons': [lesson.to_dict() for lesson in lessons]
-        }), 200
+        def build():
+            # Ordenar por order_index
+            lessons = Lesson.query.filter_by(course_id=version.id).order_by(Lesson.order_index).all()
+            return json_body({'lessons': serialize(lessons)}), []
+        
+        body = get_or_build(cache_key(f'course/{course_uuid}/lessons/{version.etag}'), build, tags=[course_tag(course_uuid)])
+        
+        return with_validators(json_response(body), version)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -220,8 +261,7 @@ def get_lessons(course_uuid):
 def create_lesson(course_uuid):
     """Criar nova aula em um curso"""
     try:
-        user_uuid = get_jwt_identity()
-        user = User.query.filter_by(uuid=user_uuid).first()
+        user = current_user
         
         course = Course.query.filter_by(uuid=course_uuid).first()
         
@@ -253,6 +293,10 @@ def create_lesson(course_uuid):
         
         db.session.add(lesson)
         db.session.commit()
+        invalidate(course_tag(course.uuid))
+        
+        # Log analytics
+        log_event('lesson_created', user_id=user.id, course_id=course.id, lesson_id=lesson.id)
         
         return jsonify({
             'message': 'Aula criada com sucesso',
@@ -0,0 +1,77 @@
+import time
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+# Roteamento de leituras para a réplica (``DATABASE_REPLICA_URL``). Requisições
+# só de leitura (GET/HEAD) consultam o engine da réplica; escritas, flushes e
+# rotas com ``@use_primary`` ficam no banco principal. Depois de uma escrita o
+# cliente lê do principal por ``READ_YOUR_WRITES_WINDOW`` segundos, o tempo
+# para a réplica alcançar: a marca vai no próprio cliente (cookie e cabeçalho
+# ecoado), então vale em qualquer worker ou processo.
+
+REPLICA_BIND = 'replica'
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# Marca de escrita recente: instante (epoch) até quando ler do principal
+PRIMARY_COOKIE = 'db_primary_until'
+PRIMARY_HEADER = 'X-Read-Primary-Until'
+
+
+class RoutingSession(Session):
+    """Sessão que envia as consultas de requisições só de leitura para a réplica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, 'is_dml', False) and _use_replica():
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _use_replica():
+    return has_request_context() and g.get('db_replica', False)
+
+
+def use_primary(view):
+    """Rota de leitura que precisa do banco principal (ex.: estado que o cliente usa para retomar)"""
+    view.db_route = 'primary'
+    return view
+
+
+def _wrote_recently():
+    """O cliente escreveu há menos de ``READ_YOUR_WRITES_WINDOW`` segundos (cookie ou cabeçalho)"""
+    now = time.time()
+    window = current_app.config.get('READ_YOUR_WRITES_WINDOW', 5.0)
+    for value in (request.headers.get(PRIMARY_HEADER), request.cookies.get(PRIMARY_COOKIE)):
+        try:
+            until = float(value)
+        except (TypeError, ValueError):
+            continue
+        # Valores além da janela foram forjados ou vêm de um relógio adiantado
+        if now < until <= now + window:
+            return True
+    return False
+
+
+def _choose_database():
+    view = current_app.view_functions.get(request.endpoint)
+    route = getattr(view, 'db_route', None)
+    g.db_replica = route is None and request.method in READ_METHODS and not _wrote_recently()
+
+
+def _mark_writer(response):
+    if not g.get('db_replica') and request.method not in READ_METHODS and response.status_code < 400:
+        window = current_app.config.get('READ_YOUR_WRITES_WINDOW', 5.0)
+        until = f'{time.time() + window:.3f}'
+        response.headers[PRIMARY_HEADER] = until
+        response.set_cookie(PRIMARY_COOKIE, until, max_age=max(int(window), 1), httponly=True, samesite='Lax')
+    return response
+
+
+def init_read_routing(app):
+    """Ativa o roteamento se a réplica estiver configurada (chamar depois de ``db.init_app``)"""
+    if REPLICA_BIND not in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        return False
+    app.before_request(_choose_database)
+    app.after_request(_mark_writer)
+    return True
@@ -1,9 +1,12 @@
 # Arquivo de exemplo para demonstrar a nova estrutura modular
 
+import multiprocessing
 from backend.app import create_app
 
 # Criar aplicação com configuração de desenvolvimento
-app = create_app('development')
+# (não nos processos do pool de imagens, que reimportam o módulo principal)
+if multiprocessing.current_process().name == 'MainProcess':
+    app = create_app('development')
 
 if __name__ == '__main__':
     print("Executando CursoHub com nova estrutura modular...")
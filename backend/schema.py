@@ -0,0 +1,41 @@
+from sqlalchemy import inspect, text
+from models import db
+
+
+def upgrade_schema():
+    """Adiciona colunas e índices novos dos modelos em tabelas já existentes.
+
+    O ``db.create_all()`` só cria tabelas ausentes; bancos criados por versões
+    anteriores não recebem as colunas e índices novos. Esta função é
+    idempotente e deve ser chamada logo após o ``create_all``.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                    if not column.nullable:
+                        ddl += ' NOT NULL'
+                conn.execute(text(ddl))
+                added.append(f'{table.name}.{column.name}')
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    added.append(f'{table.name}.{index.name}')
+
+    return added
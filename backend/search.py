@@ -0,0 +1,154 @@
+import html
+import re
+from sqlalchemy import event, text, literal_column, or_
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import table, column
+from models import db, Course, Lesson
+
+# Índice FTS5 dos cursos (rowid = courses.id). O tokenizer unicode61 com
+# remove_diacritics 2 normaliza caixa e acentos: "programacao" encontra "programação".
+SEARCH_TABLE = 'course_search'
+
+# Pesos do BM25 por coluna: título, descrição, categoria, títulos das aulas
+BM25_WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+
+SNIPPET_TOKENS = 12
+
+# Marcadores do trecho devolvido pelo FTS (caracteres de uso privado): o texto
+# do curso é escapado antes de virarem <mark>, então o HTML do professor não passa
+MATCH_START, MATCH_END = '\ue000', '\ue001'
+
+course_search = table(SEARCH_TABLE, column('rowid'), column('title'), column('description'),
+                      column('category'), column('lesson_titles'))
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Resultado da verificação de disponibilidade do índice por engine
+_available = {}
+
+
+def search_available(connection):
+    """Indica se o banco suporta FTS5 e o índice já foi criado"""
+    engine = connection.engine
+    if engine not in _available:
+        if engine.dialect.name != 'sqlite':
+            _available[engine] = False
+        else:
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': SEARCH_TABLE}
+            ).first()
+            _available[engine] = exists is not None
+    return _available[engine]
+
+
+def ensure_search_index():
+    """Cria o índice FTS5 se não existir e o popula. Retorna True se foi criado."""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+
+    with db.engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': SEARCH_TABLE}
+        ).first()
+        if exists:
+            return False
+
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            "title, description, category, lesson_titles, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        _available[db.engine] = True
+        reindex_courses(conn)
+    return True
+
+
+def reindex_courses(connection, course_ids=None):
+    """Reconstrói as entradas do índice (todas ou apenas dos cursos informados)"""
+    params = {}
+    where = ''
+    if course_ids is not None:
+        if not course_ids:
+            return
+        params = {f'id{i}': course_id for i, course_id in enumerate(course_ids)}
+        where = 'WHERE {col} IN (' + ', '.join(f':{name}' for name in params) + ')'
+
+    connection.execute(text(f'DELETE FROM {SEARCH_TABLE} ' + where.format(col='rowid')), params)
+    connection.execute(text(
+        f'INSERT INTO {SEARCH_TABLE} (rowid, title, description, category, lesson_titles) '
+        "SELECT c.id, c.title, coalesce(c.description, ''), coalesce(c.category, ''), "
+        "coalesce((SELECT group_concat(l.title, ' ') FROM lessons l WHERE l.course_id = c.id), '') "
+        'FROM courses c ' + where.format(col='c.id')
+    ), params)
+
+
+def build_match_query(search):
+    """Converte o texto livre do usuário em uma expressão MATCH segura (prefixo em cada termo)"""
+    tokens = _TOKEN_RE.findall(search or '')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def apply_search(query, search):
+    """Filtra uma consulta de cursos pelo texto buscado.
+
+    Retorna ``(query, rank)``. Com o índice FTS5, ``rank`` é a expressão BM25
+    para ``order_by`` (menor é mais relevante) e cada item da consulta passa a
+    ser ``(Course, search_snippet)``. Sem FTS5, recorre ao LIKE e ``rank`` é None.
+    """
+    match = build_match_query(search)
+    if not match:
+        return query, None
+
+    if not search_available(db.session.connection()):
+        return query.filter(
+            or_(
+                Course.title.contains(search),
+                Course.description.contains(search)
+            )
+        ), None
+
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    rank = literal_column(f'bm25({SEARCH_TABLE}, {weights})')
+    snippet = literal_column(
+        f"snippet({SEARCH_TABLE}, -1, '{MATCH_START}', '{MATCH_END}', '…', {SNIPPET_TOKENS})"
+    ).label('search_snippet')
+
+    query = query.join(course_search, course_search.c.rowid == Course.id).filter(
+        literal_column(SEARCH_TABLE).op('MATCH')(match)
+    ).add_columns(snippet)
+    return query, rank
+
+
+def render_snippet(snippet):
+    """Trecho do FTS como HTML seguro: texto escapado, termos encontrados em <mark>"""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def split_search_rows(items):
+    """Separa os itens ``(Course, search_snippet)`` em duas listas"""
+    courses = [row[0] for row in items]
+    snippets = [render_snippet(row.search_snippet) for row in items]
+    return courses, snippets
+
+
+# ==================== SINCRONIZAÇÃO DO ÍNDICE ====================
+
+@event.listens_for(Session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    course_ids = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Course):
+            course_ids.add(instance.id)
+        elif isinstance(instance, Lesson):
+            course_ids.add(instance.course_id)
+    course_ids.discard(None)
+    if not course_ids:
+        return
+
+    connection = session.connection()
+    if search_available(connection):
+        reindex_courses(connection, sorted(course_ids))
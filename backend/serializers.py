@@ -0,0 +1,70 @@
+from sqlalchemy import inspect, tuple_
+from sqlalchemy.orm import selectinload
+from models import db, Course, Lesson, Comment, Rating, StudentProgress
+
+
+def _loader_options(model, options):
+    """Opções de carregamento necessárias para o ``to_dict`` do modelo"""
+    if model is Course:
+        loaders = [selectinload(Course.creator)]
+        if options.get('include_lessons'):
+            loaders.append(selectinload(Course.lessons))
+        return loaders
+    if model is Lesson:
+        return [selectinload(Lesson.course)]
+    if model is Comment:
+        loaders = [selectinload(Comment.author), selectinload(Comment.parent)]
+        if options.get('include_replies', True):
+            loaders.append(selectinload(Comment.replies).selectinload(Comment.author))
+        return loaders
+    if model is Rating:
+        return [selectinload(Rating.user)]
+    if model is StudentProgress:
+        return [selectinload(StudentProgress.lesson).selectinload(Lesson.course)]
+    return []
+
+
+def preload(instances, **options):
+    """Carrega em lote os relacionamentos usados pelo ``to_dict``.
+
+    Executa uma consulta pelas chaves primárias com ``selectinload``; o SQLAlchemy
+    preenche os atributos ainda não carregados das instâncias que já estão na
+    sessão, então o número de consultas não depende do tamanho da lista.
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+
+    model = type(instances[0])
+    loaders = _loader_options(model, options)
+    if not loaders:
+        return instances
+
+    pk_columns = inspect(model).primary_key
+    identities = {inspect(instance).identity for instance in instances}
+    identities.discard(None)
+    if not identities:
+        return instances
+
+    if len(pk_columns) == 1:
+        criterion = pk_columns[0].in_([identity[0] for identity in identities])
+    else:
+        criterion = tuple_(*pk_columns).in_(list(identities))
+
+    db.session.query(model).filter(criterion).options(*loaders).all()
+    return instances
+
+
+def serialize(instances, **options):
+    """Serializa uma lista de modelos com o mesmo formato do ``to_dict``.
+
+    ``options`` são os mesmos argumentos do ``to_dict`` do modelo (por exemplo
+    ``include_stats=True``) e também definem quais relacionamentos carregar.
+    """
+    instances = preload(instances, **options)
+    return [instance.to_dict(**options) for instance in instances]
+
+
+def serialize_one(instance, **options):
+    """Atalho de ``serialize`` para uma única instância"""
+    return serialize([instance], **options)[0]
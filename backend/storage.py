@@ -0,0 +1,217 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+import uuid
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+from models import db, Blob, StoredFile
+
+# Armazenamento endereçado por conteúdo: cada conteúdo distinto é gravado uma
+# única vez em ``<UPLOAD_FOLDER>/blobs/ab/cd/<sha256>``; os arquivos lógicos
+# (nome, tipo, dono) ficam em ``stored_files`` e contam referências no blob.
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def blob_root():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'blobs')
+
+
+def blob_path(sha256):
+    return os.path.join(blob_root(), sha256[:2], sha256[2:4], sha256)
+
+
+def _hash_stream(stream):
+    digest = hashlib.sha256()
+    size = 0
+    for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+        digest.update(block)
+        size += len(block)
+    return digest.hexdigest(), size
+
+
+def _copy_to_temp(stream):
+    """Copia o stream para um temporário no mesmo disco dos blobs, calculando o hash"""
+    tmp_dir = os.path.join(blob_root(), 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+                f.write(block)
+                digest.update(block)
+                size += len(block)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def _place_blob(tmp_path, sha256, content_present):
+    """Move o conteúdo para o caminho do blob, ou descarta se o blob já o tem"""
+    path = blob_path(sha256)
+    if content_present:
+        os.remove(tmp_path)
+        return
+    # Sem referência anterior o arquivo existente pode estar sendo apagado
+    # pela coleta: substitui em vez de aproveitar
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+
+
+def _reserve_blob(sha256, size):
+    """Soma uma referência ao blob antes de gravar ou aproveitar o conteúdo.
+
+    A referência é gravada na hora: a coleta (``collect_blobs``) só apaga
+    blobs com ``ref_count <= 0``, então o conteúdo aproveitado não some entre
+    a verificação e a criação do arquivo lógico. Retorna True se o conteúdo
+    já está no disco; False se quem chamou deve gravá-lo.
+    """
+    updated = Blob.query.filter_by(sha256=sha256).update(
+        {Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False
+    )
+    if not updated:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Blob(sha256=sha256, size=size, ref_count=1))
+        except IntegrityError:
+            # Outra requisição criou o mesmo blob ao mesmo tempo; ela ainda
+            # pode estar gravando, então este upload também grava
+            Blob.query.filter_by(sha256=sha256).update(
+                {Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False
+            )
+    db.session.commit()
+    return bool(updated) and os.path.exists(blob_path(sha256))
+
+
+def _release_reference(sha256):
+    db.session.rollback()
+    Blob.query.filter_by(sha256=sha256).update(
+        {Blob.ref_count: Blob.ref_count - 1}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _create_file(sha256, filename, file_type, user_id):
+    """Cria o arquivo lógico para um blob já reservado por ``_reserve_blob``"""
+    filename = secure_filename(filename) or 'arquivo'
+    stored = StoredFile(
+        blob_sha256=sha256,
+        user_id=user_id,
+        filename=filename,
+        file_type=file_type,
+        content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    )
+    db.session.add(stored)
+    db.session.commit()
+    return stored
+
+
+def _store_reserved(sha256, size, place, filename, file_type, user_id):
+    """Reserva o blob, grava o conteúdo com ``place(content_present)`` e cria o arquivo"""
+    content_present = _reserve_blob(sha256, size)
+    try:
+        place(content_present)
+        return _create_file(sha256, filename, file_type, user_id)
+    except BaseException:
+        _release_reference(sha256)
+        raise
+
+
+def store_stream(stream, filename, file_type='material', user_id=None):
+    """Armazena o conteúdo de um stream e retorna o ``StoredFile`` criado.
+
+    Streams com ``seek`` (o upload multipart do werkzeug já vem em um arquivo
+    temporário) são primeiro apenas lidos para calcular o hash: se o conteúdo
+    já existe, nada é gravado. Caso contrário o conteúdo é copiado uma vez,
+    calculando o hash durante a cópia, e renomeado para o caminho do blob.
+    """
+    if hasattr(stream, 'seek') and getattr(stream, 'seekable', lambda: False)():
+        sha256, size = _hash_stream(stream)
+
+        def place(content_present):
+            if not content_present:
+                stream.seek(0)
+                tmp_path, _, _ = _copy_to_temp(stream)
+                _place_blob(tmp_path, sha256, content_present)
+    else:
+        tmp_path, sha256, size = _copy_to_temp(stream)
+
+        def place(content_present):
+            _place_blob(tmp_path, sha256, content_present)
+    return _store_reserved(sha256, size, place, filename, file_type, user_id)
+
+
+def store_path(path, filename, file_type='material', user_id=None, sha256=None):
+    """Armazena um arquivo já gravado em disco (ex.: upload em partes), movendo-o.
+
+    O arquivo de origem é renomeado para o blob (sem cópia) ou removido se o
+    conteúdo já existir. ``sha256``, quando já calculado, evita reler o arquivo.
+    """
+    size = os.path.getsize(path)
+    if sha256 is None:
+        with open(path, 'rb') as f:
+            sha256, size = _hash_stream(f)
+    return _store_reserved(sha256, size, lambda content_present: _place_blob(path, sha256, content_present),
+                           filename, file_type, user_id)
+
+
+def release_file(stored):
+    """Remove o arquivo lógico; o blob é apagado quando perde a última referência"""
+    sha256 = stored.blob_sha256
+    db.session.delete(stored)
+    Blob.query.filter_by(sha256=sha256).update(
+        {Blob.ref_count: Blob.ref_count - 1}, synchronize_session=False
+    )
+    db.session.commit()
+    return collect_blobs([sha256])
+
+
+def collect_blobs(candidates=None):
+    """Apaga blobs sem referências (todos ou apenas os candidatos). Retorna quantos."""
+    query = db.session.query(Blob.sha256).filter(Blob.ref_count <= 0)
+    if candidates is not None:
+        query = query.filter(Blob.sha256.in_(candidates))
+
+    removed = 0
+    for (sha256,) in query.all():
+        # Condicional: um novo upload do mesmo conteúdo pode ter somado referência
+        deleted = Blob.query.filter(Blob.sha256 == sha256, Blob.ref_count <= 0).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        if deleted:
+            _remove_blob_file(sha256)
+            removed += 1
+    return removed
+
+
+def _remove_blob_file(sha256):
+    """Apaga o arquivo de um blob cuja linha a coleta acabou de remover.
+
+    Um upload do mesmo conteúdo pode recriar a linha e gravar o arquivo a
+    qualquer momento. Por isso o arquivo é primeiro renomeado para fora do
+    caminho do blob, e só então a linha é conferida de novo: se ela voltou, o
+    arquivo é devolvido (o conteúdo é o mesmo, pelo hash); se não voltou,
+    um upload que reservar depois desta consulta grava o próprio arquivo.
+    """
+    path = blob_path(sha256)
+    tombstone = f'{path}.{os.getpid()}.{uuid.uuid4().hex}.deleted'
+    try:
+        os.rename(path, tombstone)
+    except FileNotFoundError:
+        return
+    if db.session.query(Blob.sha256).filter_by(sha256=sha256).first() is not None:
+        os.replace(tombstone, path)
+    else:
+        os.remove(tombstone)
+
+
+def find_stored_file(file_uuid):
+    return StoredFile.query.filter_by(uuid=file_uuid).first()
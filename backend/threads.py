@@ -0,0 +1,163 @@
+from datetime import datetime
+from sqlalchemy import desc, tuple_
+from sqlalchemy.orm import aliased
+from models import db, User, Comment
+from pagination import encode_cursor, decode_keyset
+
+# Conversas de comentários. Cada resposta guarda a raiz da conversa
+# (``root_id``) e a profundidade, então uma página de conversas custa sempre
+# três consultas, independente do tamanho delas:
+#   1. comentários principais da página (keyset por created_at, id);
+#   2. as primeiras respostas de cada conversa e o total de respostas
+#      (ROW_NUMBER/COUNT por janela sobre ``root_id``);
+#   3. os autores de todos os comentários da página.
+
+THREADS_SORT = 'threads'
+REPLIES_SORT = 'replies'
+CURSOR_TYPES = (datetime, int)
+
+
+def thread_fields(parent):
+    """``root_id`` e ``depth`` de uma resposta a ``parent`` (ou de um comentário principal)"""
+    if parent is None:
+        return None, 0
+    return parent.root_id or parent.id, (parent.depth or 0) + 1
+
+
+def backfill_threads():
+    """Preenche ``root_id``/``depth`` de comentários gravados antes das conversas.
+
+    Cada passada resolve um nível da árvore a partir dos pais já preenchidos.
+    Idempotente; retorna quantos comentários foram atualizados.
+    """
+    parent = Comment.__table__.alias('parent')
+    comments = Comment.__table__
+    updated = db.session.execute(
+        comments.update().where(comments.c.depth.is_(None)).values(depth=0)
+    ).rowcount
+    while True:
+        known = db.select(parent.c.id).where(
+            parent.c.id == comments.c.parent_id,
+            db.or_(parent.c.parent_id.is_(None), parent.c.root_id.isnot(None))
+        )
+        root = db.select(db.func.coalesce(parent.c.root_id, parent.c.id)).where(
+            parent.c.id == comments.c.parent_id).scalar_subquery()
+        depth = db.select(parent.c.depth + 1).where(parent.c.id == comments.c.parent_id).scalar_subquery()
+        rows = db.session.execute(
+            comments.update().where(
+                comments.c.parent_id.isnot(None), comments.c.root_id.is_(None), known.exists()
+            ).values(root_id=root, depth=depth)
+        ).rowcount
+        if not rows:
+            break
+        updated += rows
+    db.session.commit()
+    return updated
+
+
+def _authors(comments):
+    ids = {comment.user_id for comment in comments}
+    if not ids:
+        return {}
+    return {user.id: user.to_dict() for user in User.query.filter(User.id.in_(ids))}
+
+
+def _comment_dict(comment, authors, parent_uuid=None):
+    """Mesmo formato do ``Comment.to_dict`` sem carregar relacionamentos"""
+    return {
+        'uuid': comment.uuid,
+        'content': comment.content,
+        'created_at': comment.created_at.isoformat() if comment.created_at else None,
+        'author': authors.get(comment.user_id),
+        'parent_id': parent_uuid,
+        'depth': comment.depth or 0
+    }
+
+
+def _replies_query(root_ids, limit):
+    """Primeiras ``limit`` respostas de cada conversa, com o uuid do pai e o total"""
+    ranked = db.session.query(
+        Comment.id.label('id'),
+        db.func.row_number().over(
+            partition_by=Comment.root_id, order_by=(Comment.created_at, Comment.id)
+        ).label('position'),
+        db.func.count().over(partition_by=Comment.root_id).label('total')
+    ).filter(Comment.root_id.in_(root_ids)).subquery()
+
+    parent = aliased(Comment)
+    return db.session.query(Comment, parent.uuid, ranked.c.total).join(
+        ranked, ranked.c.id == Comment.id
+    ).outerjoin(parent, parent.id == Comment.parent_id).filter(
+        ranked.c.position <= limit
+    ).order_by(Comment.root_id, Comment.created_at, Comment.id)
+
+
+def thread_page(course_id, cursor=None, per_page=20, replies_per_thread=3):
+    """Página de conversas de um curso, das mais recentes para as mais antigas.
+
+    Cada conversa traz as primeiras ``replies_per_thread`` respostas em ordem
+    cronológica, ``reply_count`` e, se houver mais respostas, o
+    ``replies_cursor`` para ``reply_page``. Retorna ``(threads, next_cursor)``.
+    """
+    after = decode_keyset(cursor, THREADS_SORT, CURSOR_TYPES)
+
+    query = Comment.query.filter(Comment.course_id == course_id, Comment.root_id.is_(None),
+                                 Comment.parent_id.is_(None))
+    if after is not None:
+        query = query.filter(tuple_(Comment.created_at, Comment.id) < tuple_(*after))
+    roots = query.order_by(desc(Comment.created_at), desc(Comment.id)).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(roots) > per_page:
+        roots = roots[:per_page]
+        next_cursor = encode_cursor(THREADS_SORT, (roots[-1].created_at, roots[-1].id))
+
+    replies = {}
+    totals = {}
+    if roots and replies_per_thread > 0:
+        for reply, parent_uuid, total in _replies_query([root.id for root in roots], replies_per_thread):
+            replies.setdefault(reply.root_id, []).append((reply, parent_uuid))
+            totals[reply.root_id] = total
+    elif roots:
+        totals = dict(db.session.query(Comment.root_id, db.func.count()).filter(
+            Comment.root_id.in_([root.id for root in roots])
+        ).group_by(Comment.root_id).all())
+
+    authors = _authors(roots + [reply for items in replies.values() for reply, _ in items])
+
+    threads = []
+    for root in roots:
+        thread_replies = replies.get(root.id, [])
+        data = _comment_dict(root, authors)
+        data['replies'] = [_comment_dict(reply, authors, parent_uuid) for reply, parent_uuid in thread_replies]
+        data['reply_count'] = totals.get(root.id, 0)
+        data['replies_cursor'] = None
+        if data['reply_count'] > len(thread_replies):
+            last = thread_replies[-1][0] if thread_replies else None
+            data['replies_cursor'] = encode_cursor(
+                REPLIES_SORT, (last.created_at, last.id) if last else (datetime.min, 0)
+            )
+        threads.append(data)
+    return threads, next_cursor
+
+
+def reply_page(root, cursor=None, per_page=20):
+    """Próximas respostas de uma conversa em ordem cronológica. Retorna ``(replies, next_cursor)``."""
+    after = decode_keyset(cursor, REPLIES_SORT, CURSOR_TYPES)
+
+    parent = aliased(Comment)
+    query = db.session.query(Comment, parent.uuid).outerjoin(
+        parent, parent.id == Comment.parent_id
+    ).filter(Comment.root_id == root.id)
+    if after is not None:
+        query = query.filter(tuple_(Comment.created_at, Comment.id) > tuple_(*after))
+    rows = query.order_by(Comment.created_at, Comment.id).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1][0]
+        next_cursor = encode_cursor(REPLIES_SORT, (last.created_at, last.id))
+
+    authors = _authors([reply for reply, _ in rows])
+    return [_comment_dict(reply, authors, parent_uuid) for reply, parent_uuid in rows], next_cursor
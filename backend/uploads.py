@@ -0,0 +1,224 @@
+import hashlib
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from werkzeug.utils import secure_filename
+from models import db, UploadSession
+from utils import allowed_file
+from storage import store_path
+from images import enqueue_variants
+
+# Bloco de leitura do corpo da requisição: a memória usada por uma parte não
+# depende do tamanho dela
+BLOCK_SIZE = 64 * 1024
+
+UPLOAD_SUBDIRS = {
+    'video': 'videos',
+    'avatar': 'avatars',
+    'material': 'materials'
+}
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Uma escrita por sessão de cada vez neste processo; entre processos, a
+# atualização condicional de ``received`` rejeita a escrita concorrente
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class UploadError(Exception):
+    """Erro de upload com status HTTP e, quando útil, o deslocamento atual"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+    def to_dict(self):
+        data = {'error': str(self)}
+        if self.offset is not None:
+            data['offset'] = self.offset
+        return data
+
+
+def _session_lock(upload_id):
+    with _locks_guard:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def _release_lock(upload_id):
+    with _locks_guard:
+        _locks.pop(upload_id, None)
+
+
+def partial_path(session):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], '.partial', f'{session.uuid}.part')
+
+
+def parse_checksum(header):
+    """Lê o cabeçalho ``Upload-Checksum: sha256 <hex>``"""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    value = value.strip().lower()
+    if algorithm.lower() != 'sha256' or not _SHA256_RE.match(value):
+        raise UploadError('Upload-Checksum deve ser "sha256 <hex>"')
+    return value
+
+
+def start_upload(user_id, filename, size, file_type='video', sha256=None):
+    """Cria a sessão de upload e o arquivo parcial vazio"""
+    if not filename or not allowed_file(filename):
+        raise UploadError('Tipo de arquivo não permitido')
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError('Tamanho do arquivo é obrigatório')
+    if size > current_app.config.get('UPLOAD_MAX_SIZE', 2 * 1024 ** 3):
+        raise UploadError('Arquivo maior que o permitido', 413)
+    if file_type not in UPLOAD_SUBDIRS:
+        raise UploadError('Tipo de upload inválido')
+    if sha256 is not None:
+        sha256 = str(sha256).lower()
+        if not _SHA256_RE.match(sha256):
+            raise UploadError('sha256 inválido')
+
+    session = UploadSession(
+        user_id=user_id,
+        filename=secure_filename(filename),
+        file_type=file_type,
+        total_size=size,
+        sha256=sha256
+    )
+    db.session.add(session)
+    db.session.flush()
+
+    path = partial_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    db.session.commit()
+    return session
+
+
+def write_chunk(session, offset, stream, length, checksum=None):
+    """Grava uma parte a partir de ``offset`` lendo o corpo em blocos.
+
+    A parte só é aceita inteira: se a conexão cair ou o checksum não conferir,
+    o arquivo parcial volta ao tamanho anterior e o cliente reenvia a parte.
+    Retorna o novo deslocamento.
+    """
+    if session.status != 'pending':
+        raise UploadError('Upload já finalizado', 409)
+    if offset != session.received:
+        raise UploadError('Deslocamento diferente do recebido até agora', 409, session.received)
+    if length <= 0:
+        raise UploadError('Parte vazia', offset=session.received)
+    if length > current_app.config.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024):
+        raise UploadError('Parte maior que o permitido', 413, session.received)
+    if offset + length > session.total_size:
+        raise UploadError('Parte ultrapassa o tamanho do arquivo', 400, session.received)
+
+    lock = _session_lock(session.uuid)
+    if not lock.acquire(blocking=False):
+        raise UploadError('Outra parte deste upload está sendo gravada', 409, session.received)
+    try:
+        with open(partial_path(session), 'r+b') as f:
+            f.seek(offset)
+            digest = hashlib.sha256()
+            remaining = length
+            try:
+                while remaining:
+                    block = stream.read(min(BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    f.write(block)
+                    digest.update(block)
+                    remaining -= len(block)
+            except Exception:
+                f.truncate(offset)
+                raise
+
+            if remaining:
+                f.truncate(offset)
+                raise UploadError('Parte incompleta', 400, offset)
+            if checksum and digest.hexdigest() != checksum:
+                f.truncate(offset)
+                raise UploadError('Checksum da parte não confere', 400, offset)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        updated = UploadSession.query.filter_by(id=session.id, received=offset).update({
+            UploadSession.received: offset + length,
+            UploadSession.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        if not updated:
+            db.session.refresh(session)
+            raise UploadError('Deslocamento diferente do recebido até agora', 409, session.received)
+        return offset + length
+    finally:
+        lock.release()
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE * 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finalize_upload(session):
+    """Publica o arquivo completo no armazenamento por conteúdo (idempotente).
+
+    O arquivo parcial é renomeado para o blob, ou descartado se o mesmo
+    conteúdo já estiver armazenado; em nenhum caso os bytes são copiados.
+    """
+    if session.status == 'complete':
+        return session
+    if session.received != session.total_size:
+        raise UploadError('Upload incompleto', 409, session.received)
+
+    path = partial_path(session)
+    sha256 = _file_sha256(path)
+    if session.sha256 and sha256 != session.sha256:
+        raise UploadError('Checksum do arquivo não confere', 400, session.received)
+
+    stored = store_path(path, session.filename, session.file_type, session.user_id, sha256=sha256)
+
+    session.status = 'complete'
+    session.file_url = stored.url
+    db.session.commit()
+    _release_lock(session.uuid)
+    enqueue_variants(stored)
+    return session
+
+
+def abort_upload(session):
+    """Descarta a sessão e o arquivo parcial"""
+    if session.status == 'pending':
+        path = partial_path(session)
+        if os.path.exists(path):
+            os.remove(path)
+    db.session.delete(session)
+    db.session.commit()
+    _release_lock(session.uuid)
+
+
+def cleanup_uploads(max_age_hours=None):
+    """Remove sessões pendentes sem atividade há mais de ``max_age_hours``"""
+    if max_age_hours is None:
+        max_age_hours = current_app.config.get('UPLOAD_SESSION_TTL_HOURS', 24)
+    cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+    stale = UploadSession.query.filter(
+        UploadSession.status == 'pending', UploadSession.updated_at < cutoff
+    ).all()
+    for session in stale:
+        path = partial_path(session)
+        if os.path.exists(path):
+            os.remove(path)
+        db.session.delete(session)
+        _release_lock(session.uuid)
+    db.session.commit()
+    return len(stale)
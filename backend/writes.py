@@ -0,0 +1,248 @@
+import atexit
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from flask import current_app
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from models import db
+from database import apply_pragmas, engine_profile
+
+
+class WriteQueueBusy(Exception):
+    """Fila de escrita cheia ou tempo de espera esgotado"""
+
+
+class _WriteItem:
+    __slots__ = ('work', 'future', 'enqueued_at')
+
+    def __init__(self, work):
+        self.work = work
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class WriteCoordinator:
+    """Transações de escrita executadas em série por uma conexão dedicada.
+
+    O SQLite aceita um escritor por vez: com cada requisição fazendo o próprio
+    commit, as conexões disputam a trava do arquivo (``database is locked``)
+    e cada commit paga um fsync. Aqui a requisição enfileira a sua escrita e
+    espera; uma thread junta as transações que chegaram enquanto o commit
+    anterior acontecia, executa cada uma em um SAVEPOINT (a falha de uma não
+    desfaz as outras) e grava o lote com um único COMMIT (group commit).
+    Com a fila cheia, ou passado ``timeout`` sem a transação começar, a
+    requisição recebe ``WriteQueueBusy``.
+    """
+
+    def __init__(self, app, queue_size=1000, max_batch=64, batch_window=0.0, timeout=5.0, enabled=True):
+        self.app = app
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.enabled = enabled
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._counters = Counter()
+        self._counters_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._engine = None
+        self._connection = None
+        self._session = None
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self._counters[name] += amount
+
+    def run(self, work, timeout=None):
+        """Executa ``work(session)`` no próximo lote e retorna o seu resultado"""
+        if threading.current_thread() is self._thread:
+            # Escrita disparada de dentro de outra transação do lote
+            with self._session.begin_nested():
+                return work(self._session)
+
+        self._ensure_started()
+        item = _WriteItem(work)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._count('rejected')
+            raise WriteQueueBusy('Fila de escrita cheia')
+        self._count('submitted')
+
+        try:
+            return item.future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeout:
+            if item.future.cancel():
+                self._count('timeouts')
+                raise WriteQueueBusy('Tempo esgotado aguardando a fila de escrita')
+            # Já está no lote em andamento: o resultado sai no commit
+            return item.future.result()
+
+    def _ensure_started(self):
+        # Mesma estratégia dos buffers de analytics e progresso: a thread
+        # nasce na primeira escrita
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='write-coordinator', daemon=True)
+                self._thread.start()
+
+    def _create_engine(self):
+        engine = create_engine(db.engine.url, pool_size=1, max_overflow=0)
+        apply_pragmas(engine, engine_profile(self.app)[1].get('pragmas'))
+        if engine.dialect.name == 'sqlite':
+            @event.listens_for(engine, 'connect')
+            def _connect(dbapi_connection, connection_record):
+                # O pysqlite não abre a transação antes de um SAVEPOINT (e o
+                # RELEASE faria o commit): o SQLAlchemy passa a emitir o BEGIN
+                dbapi_connection.isolation_level = None
+
+            @event.listens_for(engine, 'begin')
+            def _begin(connection):
+                # Reserva a escrita no início da transação; outros processos
+                # esperam pelo busy timeout em vez de falhar no meio do lote
+                connection.exec_driver_sql('BEGIN IMMEDIATE')
+        return engine
+
+    def _run(self):
+        with self.app.app_context():
+            while not (self._stop.is_set() and self._queue.empty()):
+                batch = self._collect_batch()
+                if batch:
+                    self._execute(batch)
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _collect_batch(self):
+        """Espera a primeira transação e junta as que já estão na fila"""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _execute(self, batch):
+        if self._connection is None:
+            if self._engine is None:
+                self._engine = self._create_engine()
+            self._connection = self._engine.connect()
+
+        started = time.monotonic()
+        done = []
+        self._session = Session(bind=self._connection, expire_on_commit=False)
+        try:
+            for item in batch:
+                if not item.future.set_running_or_notify_cancel():
+                    continue  # a requisição desistiu antes da transação começar
+                self._count('wait_ms', int((started - item.enqueued_at) * 1000))
+                try:
+                    with self._session.begin_nested():
+                        result = item.work(self._session)
+                except Exception as e:
+                    self._count('failed')
+                    item.future.set_exception(e)
+                else:
+                    done.append((item, result))
+            self._session.commit()
+        except Exception as e:
+            self._session.rollback()
+            self._count('failed', len(done))
+            self.app.logger.error(f"Erro ao gravar lote da fila de escrita: {str(e)}")
+            for item, _ in done:
+                item.future.set_exception(e)
+            # Conexão possivelmente inutilizada: a próxima é aberta do zero
+            self._connection.close()
+            self._connection = None
+            return
+        finally:
+            self._session.close()
+            self._session = None
+            for _ in batch:
+                self._queue.task_done()
+
+        for item, result in done:
+            item.future.set_result(result)
+        with self._counters_lock:
+            self._counters['committed'] += len(done)
+            self._counters['batches'] += 1
+            self._counters['batched'] += len(done)
+            self._counters['commit_ms'] += int((time.monotonic() - started) * 1000)
+            self._counters['max_batch_size'] = max(self._counters['max_batch_size'], len(done))
+
+    def shutdown(self, timeout=5.0):
+        """Para a thread depois de gravar as transações enfileiradas"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._engine is not None:
+            self._engine.dispose()
+
+    def stats(self):
+        with self._counters_lock:
+            data = dict(self._counters)
+        batches = data.get('batches', 0)
+        started = data.get('committed', 0) + data.get('failed', 0)
+        data['enabled'] = self.enabled
+        data['queue_depth'] = self._queue.qsize()
+        data['queue_capacity'] = self._queue.maxsize
+        data['avg_batch_size'] = round(data.get('batched', 0) / batches, 2) if batches else 0
+        data['avg_wait_ms'] = round(data.get('wait_ms', 0) / started, 2) if started else 0
+        return data
+
+
+def init_write_coordinator(app):
+    """Cria a fila de escrita a partir da configuração (desativada por padrão)"""
+    enabled = app.config.get('WRITE_QUEUE_ENABLED', False)
+    with app.app_context():
+        url = db.engine.url
+    if enabled and url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # Um banco em memória não é compartilhado com a conexão dedicada
+        app.logger.warning('Fila de escrita desativada: banco SQLite em memória')
+        enabled = False
+    coordinator = WriteCoordinator(
+        app,
+        queue_size=app.config.get('WRITE_QUEUE_SIZE', 1000),
+        max_batch=app.config.get('WRITE_QUEUE_MAX_BATCH', 64),
+        batch_window=app.config.get('WRITE_QUEUE_BATCH_WINDOW', 0.0),
+        timeout=app.config.get('WRITE_QUEUE_TIMEOUT', 5.0),
+        enabled=enabled
+    )
+    app.extensions['writes'] = coordinator
+    atexit.register(coordinator.shutdown)
+    return coordinator
+
+
+def run_write(work, timeout=None):
+    """Executa ``work(session)`` em uma transação de escrita e retorna o resultado.
+
+    Com ``WRITE_QUEUE_ENABLED`` a transação passa pela fila de escrita; sem
+    ela, roda em ``db.session`` com commit próprio, como antes. ``work`` não
+    faz commit e usa apenas a sessão recebida (objetos da sessão da
+    requisição não pertencem a ela).
+    """
+    coordinator = current_app.extensions.get('writes')
+    if coordinator is not None and coordinator.enabled:
+        return coordinator.run(work, timeout)
+    try:
+        result = work(db.session)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result